@@ -0,0 +1,238 @@
+"""
+Batch analysis of every log under a directory, one summary row per well and day.
+
+Usage is:
+
+python BatchAnalysis.py <directory> [--output summary.csv]
+
+Files are recognised by name (see parse_log_name):
+
+* <site>_<Y-M-D>...log, e.g. CRC4_2019-3-24.log, is a magnetometer log and is
+  run through RotationDetection.process_array for every pod in it
+* <site>_<Y-M-D>_pumpcards.log is a pump card log and goes through
+  CardFeatures.card_features
+
+either can be compressed (.gz, .xz, .zst), see CompressedLog.
+
+The files are analysed on a process pool.  The result of every file is kept
+in a state file (<output>.state.json) together with its size and mtime, so a
+run that is stopped part way, or a later run over the same tree, only analyses
+the files that are new or changed since.
+"""
+
+import argparse
+import csv
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import CardFeatures
+import CompressedLog
+import MagnetometerLog
+import PumpCardLog
+import RotationDetection
+
+STATE_VERSION = 1
+LOG_NAME = re.compile(r'^(?P<site>[^_]+)_(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2})(?P<rest>.*)\.log$')
+
+SUMMARY_FIELDS = (
+    'site', 'date',
+    'magnetometer_files', 'pods', 'samples', 'moving_fraction', 'rotating_fraction',
+    'pumpcard_files', 'cards', 'card_problems', 'mean_area', 'peak_load', 'min_load',
+    'mean_stroke_length', 'mean_spm',
+)
+
+
+def parse_log_name(file_name):
+    """(kind, site, 'YYYY-MM-DD') from a log file name, None if it isn't one
+
+    kind is 'pumpcards' or 'magnetometer'
+    """
+    match = LOG_NAME.match(CompressedLog.log_name(file_name))  # CRC4_2019-3-24.log.gz too
+    if match is None:
+        return None
+    kind = 'pumpcards' if match.group('rest').endswith('_pumpcards') else 'magnetometer'
+    date = f"{int(match.group('year')):04d}-{int(match.group('month')):02d}-{int(match.group('day')):02d}"
+    return kind, match.group('site'), date
+
+
+def find_logs(directory):
+    """[(path, kind, site, date)] of every log file under directory, sorted by path"""
+    logs = []
+    for root, _, file_names in os.walk(directory):
+        for file_name in file_names:
+            parsed = parse_log_name(file_name)
+            if parsed is not None:
+                logs.append((os.path.join(root, file_name),) + parsed)
+    return sorted(logs)
+
+
+def analyze_magnetometer(path):
+    """counts of the samples moving and rotating over all the pods of a log"""
+    columns = MagnetometerLog.read_log(path)
+    result = {'pods': [], 'samples': 0, 'moving_samples': 0, 'rotating_samples': 0}
+    for mac in MagnetometerLog.macs_in(columns):
+        pod = columns['mac'] == mac.encode()
+        moving, rotating = RotationDetection.process_array(columns['mag_x'][pod], columns['mag_y'][pod],
+                                                           columns['mag_z'][pod], columns['pod_time'][pod])
+        result['pods'].append(mac)
+        result['samples'] += len(moving)
+        result['moving_samples'] += int(np.count_nonzero(moving == RotationDetection.Indicator.YES))
+        result['rotating_samples'] += int(np.count_nonzero(rotating == RotationDetection.Indicator.YES))
+    return result
+
+
+def analyze_pumpcards(path):
+    """card count, feature sums and load extremes of a pump card log"""
+    cards = PumpCardLog.read_cards(path, PumpCardLog.date_from_file_name(path))
+    features = CardFeatures.card_features(cards)
+    spm = features['spm'][np.isfinite(features['spm'])]
+    return {
+        'cards': len(cards),
+        'card_problems': len(cards.problems),
+        'area_sum': float(features['area'].sum()),
+        'stroke_length_sum': float(features['stroke_length'].sum()),
+        'spm_sum': float(spm.sum()),
+        'spm_count': len(spm),
+        'peak_load': float(features['peak_load'].max()) if len(cards) else None,
+        'min_load': float(features['min_load'].min()) if len(cards) else None,
+    }
+
+
+def analyze(path, kind):
+    """runs in a pool worker"""
+    if kind == 'pumpcards':
+        return analyze_pumpcards(path)
+    return analyze_magnetometer(path)
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def load_state(state_file):
+    """{path: {'signature', 'kind', 'site', 'date', 'result'}} of the files already analysed"""
+    try:
+        with open(state_file, 'r') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if state.get('version') != STATE_VERSION:
+        return {}
+    return state['files']
+
+
+def save_state(state_file, files):
+    temp_file = state_file + '.tmp'
+    with open(temp_file, 'w') as f:
+        json.dump({'version': STATE_VERSION, 'files': files}, f)
+    os.replace(temp_file, state_file)
+
+
+def summarize(files):
+    """one row (dict with SUMMARY_FIELDS) per site and date, sorted"""
+    totals = {}
+    for entry in files.values():
+        key = (entry['site'], entry['date'])
+        if key not in totals:
+            totals[key] = {'magnetometer_files': 0, 'pods': set(), 'samples': 0, 'moving_samples': 0,
+                           'rotating_samples': 0, 'pumpcard_files': 0, 'cards': 0, 'card_problems': 0,
+                           'area_sum': 0.0, 'stroke_length_sum': 0.0, 'spm_sum': 0.0, 'spm_count': 0,
+                           'peak_load': None, 'min_load': None}
+        total = totals[key]
+        result = entry['result']
+        if entry['kind'] == 'magnetometer':
+            total['magnetometer_files'] += 1
+            total['pods'].update(result['pods'])
+            for name in ('samples', 'moving_samples', 'rotating_samples'):
+                total[name] += result[name]
+        else:
+            total['pumpcard_files'] += 1
+            for name in ('cards', 'card_problems', 'area_sum', 'stroke_length_sum', 'spm_sum', 'spm_count'):
+                total[name] += result[name]
+            for name, pick in (('peak_load', max), ('min_load', min)):
+                if result[name] is not None:
+                    total[name] = result[name] if total[name] is None else pick(total[name], result[name])
+
+    def ratio(numerator, denominator):
+        return numerator / denominator if denominator else None
+
+    rows = []
+    for (site, date), total in sorted(totals.items()):
+        rows.append({
+            'site': site,
+            'date': date,
+            'magnetometer_files': total['magnetometer_files'],
+            'pods': ' '.join(sorted(total['pods'])),
+            'samples': total['samples'],
+            'moving_fraction': ratio(total['moving_samples'], total['samples']),
+            'rotating_fraction': ratio(total['rotating_samples'], total['samples']),
+            'pumpcard_files': total['pumpcard_files'],
+            'cards': total['cards'],
+            'card_problems': total['card_problems'],
+            'mean_area': ratio(total['area_sum'], total['cards']),
+            'peak_load': total['peak_load'],
+            'min_load': total['min_load'],
+            'mean_stroke_length': ratio(total['stroke_length_sum'], total['cards']),
+            'mean_spm': ratio(total['spm_sum'], total['spm_count']),
+        })
+    return rows
+
+
+def run(directory, output_file, state_file=None, processes=None):
+    """analyses the new and changed logs under directory and writes the summary
+
+    returns (files analysed, files skipped as unchanged)
+    """
+    state_file = state_file or output_file + '.state.json'
+    previous = load_state(state_file)
+    files = {}
+    todo = []
+    for path, kind, site, date in find_logs(directory):
+        signature = file_signature(path)
+        entry = previous.get(path)
+        if entry is not None and entry['signature'] == signature and entry['kind'] == kind:
+            files[path] = entry
+        else:
+            todo.append((path, {'signature': signature, 'kind': kind, 'site': site, 'date': date}))
+
+    skipped = len(files)
+    if todo:
+        with ProcessPoolExecutor(processes) as pool:
+            futures = {pool.submit(analyze, path, entry['kind']): (path, entry) for path, entry in todo}
+            for future in as_completed(futures):
+                path, entry = futures[future]
+                try:
+                    entry['result'] = future.result()
+                except Exception as e:  # a broken file shouldn't stop the rest
+                    print(f"{path}: {e!r}")
+                    continue
+                files[path] = entry
+                print(f"{path} done")
+                save_state(state_file, files)
+    save_state(state_file, files)
+
+    with open(output_file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        writer.writerows(summarize(files))
+    return len(files) - skipped, skipped
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize every log under a directory per well and day")
+    parser.add_argument('directory')
+    parser.add_argument('--output', default='summary.csv')
+    parser.add_argument('--state', help="defaults to <output>.state.json")
+    parser.add_argument('--processes', type=int, help="defaults to one per CPU")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    analysed, skipped = run(args.directory, args.output, args.state, args.processes)
+    print(f"{analysed} files analysed, {skipped} unchanged, summary in {args.output} "
+          f"({time.perf_counter() - start:.2f} s)")
@@ -0,0 +1,177 @@
+"""
+Benchmarks of the processing stages on synthetic logs (see SyntheticLogs).
+
+Usage is:
+
+python Benchmark.py [--scales 1h 24h 7d] [--output results.json] [--baseline baseline.json | --no-baseline]
+
+For every scale a magnetometer log (PODS pods at RATE_HZ) and a pump card log
+of that duration are generated (kept in --data-dir and reused if given), then
+each stage is timed REPEATS times and the fastest run is kept:
+
+* parse         MagnetometerLog.read_log
+* detect        RotationDetection.process_array, every pod
+* parse_cards   PumpCardLog.read_cards
+* smooth        PumpCardLog.smooth_cards, positions and loads
+* features      CardFeatures.card_features
+* render        RenderCards.render_cards of the first RENDER_CARDS cards
+
+The results are written as JSON with --output, and compared with a baseline
+(an earlier results file): every stage that got more than --tolerance slower
+is reported and the exit status is 1, so the benchmark can gate a change.  A
+--baseline given is always compared with.  Without one the committed
+BASELINE_FILE is, but only on a machine with the same fingerprint (platform
+and number of CPUs, see FINGERPRINT) since timings don't carry over from one
+machine to another; elsewhere the gate is skipped.  Make a baseline for a
+machine with python Benchmark.py --no-baseline --output baseline.json.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import CardFeatures
+import MagnetometerLog
+import PumpCardLog
+import RenderCards
+import RotationDetection
+import SyntheticLogs
+
+SCALES = {'1h': 1, '24h': 24, '7d': 7 * 24}
+PODS = 1
+RATE_HZ = 25
+REPEATS = 3
+RENDER_CARDS = 100
+TOLERANCE = 0.25  # a stage more than this much slower than the baseline is a regression
+NOISE_SECONDS = 0.005  # ... and by more than this, below it the timings are mostly noise
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+FINGERPRINT = ('machine', 'cpus')  # result fields that must match for the default baseline to apply
+
+
+def timed(function, repeats):
+    """(fastest wall time in seconds, result of the last call)"""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def detect_all(columns):
+    for mac in MagnetometerLog.macs_in(columns):
+        pod = columns['mac'] == mac.encode()
+        RotationDetection.process_array(columns['mag_x'][pod], columns['mag_y'][pod],
+                                        columns['mag_z'][pod], columns['pod_time'][pod])
+
+
+def run_scale(data_dir, scale, hours, repeats=REPEATS, pods=PODS, rate_hz=RATE_HZ):
+    """{stage: {'seconds', 'items', 'per_second'}} for one scale"""
+    log_file = os.path.join(data_dir, f'Bench{scale}_2019-3-24.log')
+    card_file = os.path.join(data_dir, f'Bench{scale}_2019-3-24_pumpcards.log')
+    if not os.path.exists(log_file):
+        SyntheticLogs.write_magnetometer_log(log_file, hours, pods, rate_hz)
+    if not os.path.exists(card_file):
+        SyntheticLogs.write_pumpcard_log(card_file, hours)
+
+    results = {}
+
+    def record(stage, seconds, items):
+        results[stage] = {'seconds': seconds, 'items': items, 'per_second': items / seconds if seconds else None}
+        print(f"{scale:>4} {stage:<12} {seconds:9.4f} s {items:10d} items")
+
+    seconds, columns = timed(lambda: MagnetometerLog.read_log(log_file), repeats)
+    samples = len(columns['mac'])
+    record('parse', seconds, samples)
+    seconds, _ = timed(lambda: detect_all(columns), repeats)
+    record('detect', seconds, samples)
+
+    seconds, cards = timed(lambda: PumpCardLog.read_cards(card_file, '2019-3-24'), repeats)
+    record('parse_cards', seconds, len(cards))
+    seconds, _ = timed(lambda: (PumpCardLog.smooth_cards(cards.positions), PumpCardLog.smooth_cards(cards.loads)),
+                       repeats)
+    record('smooth', seconds, len(cards))
+    seconds, _ = timed(lambda: CardFeatures.card_features(cards), repeats)
+    record('features', seconds, len(cards))
+
+    first = PumpCardLog.PumpCards(cards.times[:RENDER_CARDS], cards.positions[:RENDER_CARDS],
+                                  cards.loads[:RENDER_CARDS], [])
+    with tempfile.TemporaryDirectory() as output_dir:
+        seconds, (_, drawn) = timed(lambda: RenderCards.render_cards(first, output_dir, 0, 24,
+                                                                     processes=1), 1)
+    record('render', seconds, drawn)
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """[description] of the stages more than tolerance slower than in baseline"""
+    regressions = []
+    for scale, stages in results['scales'].items():
+        for stage, result in stages.items():
+            before = baseline.get('scales', {}).get(scale, {}).get(stage)
+            if before is None or not before['seconds']:
+                continue
+            ratio = result['seconds'] / before['seconds']
+            if ratio > 1 + tolerance and result['seconds'] - before['seconds'] > NOISE_SECONDS:
+                regressions.append(f"{scale} {stage}: {before['seconds']:.4f} s -> {result['seconds']:.4f} s "
+                                   f"({ratio:.2f}x)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the processing stages on synthetic logs")
+    parser.add_argument('--scales', nargs='+', default=['1h', '24h'], choices=list(SCALES))
+    parser.add_argument('--output', help="results file to write")
+    parser.add_argument('--baseline', help="results file to compare against (default: BASELINE_FILE, "
+                                           "if it was made on this kind of machine)")
+    parser.add_argument('--no-baseline', action='store_true', help="don't compare, just write the results")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--data-dir', help="where to keep the generated logs (default: a temporary directory)")
+    parser.add_argument('--repeats', type=int, default=REPEATS)
+    parser.add_argument('--pods', type=int, default=PODS)
+    parser.add_argument('--rate-hz', type=float, default=RATE_HZ)
+    args = parser.parse_args()
+
+    results = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.platform(),
+        'cpus': os.cpu_count(),
+        'scales': {},
+    }
+    with tempfile.TemporaryDirectory() as temp_dir:
+        data_dir = args.data_dir or temp_dir
+        os.makedirs(data_dir, exist_ok=True)
+        for scale in args.scales:
+            results['scales'][scale] = run_scale(data_dir, scale, SCALES[scale], args.repeats,
+                                                 args.pods, args.rate_hz)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"results in {args.output}")
+
+    if args.no_baseline:
+        return
+    baseline_file = args.baseline or BASELINE_FILE
+    with open(baseline_file, 'r') as f:
+        baseline = json.load(f)
+    if args.baseline is None and any(baseline.get(field) != results[field] for field in FINGERPRINT):
+        print(f"not comparing with {baseline_file}, it was made on {baseline.get('machine')} "
+              f"with {baseline.get('cpus')} CPUs (pass --baseline to compare anyway)")
+        return
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"slower: {regression}")
+    if regressions:
+        sys.exit(1)
+    print(f"no stage more than {args.tolerance:.0%} slower than {baseline_file}")
+
+
+if __name__ == "__main__":
+    main()
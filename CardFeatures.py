@@ -0,0 +1,84 @@
+"""
+Per-card features of a pump card log, computed for all cards at once.
+
+Usage is:
+
+python CardFeatures.py Whitecap_2019-3-24_pumpcards.log Whitecap_2019-3-24_features.csv
+
+(a .parquet output name writes Parquet instead of CSV), or from code
+
+* features = card_features(cards) with cards from PumpCardLog.read_cards
+    ** a dict of equal length column arrays, one row per card:
+       time, area, peak_load, min_load, mean_load, load_std, stroke_length, spm
+* write_features(features, file_name)
+
+area is the area enclosed by the (unsmoothed) card, in position * load units.
+spm is strokes per minute from the time since the previous card, NaN for the
+first card.
+"""
+
+import sys
+import time
+
+import numpy as np
+
+import Instrumentation
+import PumpCardLog
+
+
+def card_areas(positions, loads):
+    """enclosed area of every card (row) by the shoelace formula"""
+    twice_area = (np.einsum('ij,ij->i', positions[:, :-1], loads[:, 1:])
+                  - np.einsum('ij,ij->i', positions[:, 1:], loads[:, :-1])
+                  + positions[:, -1] * loads[:, 0] - positions[:, 0] * loads[:, -1])
+    return np.abs(twice_area) / 2
+
+
+def strokes_per_minute(times):
+    """60 / seconds since the previous card, NaN for the first card (or a repeated time)"""
+    spm = np.full(len(times), np.nan)
+    if len(times) > 1:
+        seconds = np.diff(times).astype('timedelta64[us]').astype(np.float64) / 10 ** 6
+        with np.errstate(divide='ignore'):
+            spm[1:] = np.where(seconds > 0, 60 / seconds, np.nan)
+    return spm
+
+
+@Instrumentation.staged('card features')
+def card_features(cards):
+    """feature columns of all the cards in a PumpCardLog.PumpCards"""
+    mean_load, load_std = PumpCardLog.card_statistics(cards.loads)
+    return {
+        'time': cards.times,
+        'area': card_areas(cards.positions, cards.loads),
+        'peak_load': cards.loads.max(axis=1),
+        'min_load': cards.loads.min(axis=1),
+        'mean_load': mean_load,
+        'load_std': load_std,
+        'stroke_length': np.ptp(cards.positions, axis=1),
+        'spm': strokes_per_minute(cards.times),
+    }
+
+
+def write_features(features, file_name):
+    """writes the feature columns to a .parquet file, or CSV for any other name"""
+    import pandas as pd  # only for writing, pandas is slow to import
+
+    table = pd.DataFrame(features)
+    if file_name.endswith('.parquet'):
+        table.to_parquet(file_name, index=False)
+    else:
+        table.to_csv(file_name, index=False)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("usage: python CardFeatures.py <pumpcards log> <output .csv or .parquet>")
+        sys.exit(1)
+    start = time.perf_counter()
+    log_file = sys.argv[1]
+    cards = PumpCardLog.read_cards(log_file, PumpCardLog.date_from_file_name(log_file))
+    for line_number, time_stamp, reason in cards.problems:
+        print(f"line {line_number} ({time_stamp}): {reason}")
+    write_features(card_features(cards), sys.argv[2])
+    print(f"{len(cards)} cards to {sys.argv[2]} in {time.perf_counter() - start:.2f} s")
@@ -0,0 +1,189 @@
+"""
+Card shape similarity search and anomaly flagging over all the cards of a log.
+
+Usage is:
+
+python CardShapes.py Whitecap_2019-3-24_pumpcards.log --like 13:05:20 --count 10
+python CardShapes.py Whitecap_2019-3-24_pumpcards.log --unusual 20 --output-dir unusual
+
+or from code, with cards from PumpCardLog.read_cards (or LogCache.load_cards)
+
+* index = ShapeIndex(cards)
+* rows, distances = index.like(row, count)    cards most like card row
+* rows, distances = index.unusual(count)      cards furthest from the well's typical card
+* flagged = index.anomalies()                 rows more than ANOMALY_MADS robust
+                                              deviations from typical
+
+Every card is reduced to a shape vector: position and load are each scaled to
+0..1 within the card (so the shape, not the weight on the rods, is compared)
+and resampled around the closed stroke to SHAPE_POINTS points.  The distance
+between two cards is the RMS difference of their vectors.  The typical card is
+the pointwise median of all the shapes.
+
+The index is exact, not approximate: distances are computed as
+|a|^2 + |b|^2 - 2 a.b with one matrix product per block of queries, so a query
+against a day's cards (a few thousand) or a few hundred thousand cards takes
+milliseconds.  The blocks hold at most BLOCK_DISTANCES distances, whatever the
+number of queries and cards.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+import LogCache
+import PumpCardLog
+
+SHAPE_POINTS = 32  # per axis, so a shape vector has 2 * SHAPE_POINTS values
+BLOCK_DISTANCES = 2 ** 22  # float32 distances computed at once by nearest()
+ANOMALY_MADS = 5.0
+
+
+def resample_closed(values, points):
+    """(N, M) rows of a closed curve -> (N, points), linear between neighbouring points"""
+    length = values.shape[1]
+    where = np.arange(points) * (length / points)
+    low = np.floor(where).astype(np.intp)
+    high = (low + 1) % length
+    fraction = (where - low).astype(values.dtype)
+    return values[:, low] * (1 - fraction) + values[:, high] * fraction
+
+
+def scale_rows(values):
+    """every row scaled to 0..1 (a flat row becomes all zeros)"""
+    low = values.min(axis=1, keepdims=True)
+    span = values.max(axis=1, keepdims=True) - low
+    return (values - low) / np.where(span > 0, span, 1)
+
+
+def shape_vectors(positions, loads, points=SHAPE_POINTS):
+    """(N, 2 * points) float32 shape vectors of the cards, see the module docstring"""
+    positions = np.asarray(positions, dtype=np.float32)
+    loads = np.asarray(loads, dtype=np.float32)
+    shapes = np.empty((len(positions), 2 * points), dtype=np.float32)
+    shapes[:, :points] = scale_rows(resample_closed(positions, points))
+    shapes[:, points:] = scale_rows(resample_closed(loads, points))
+    # RMS instead of summed squares, so distances don't depend on points
+    shapes /= np.sqrt(2 * points, dtype=np.float32)
+    return shapes
+
+
+def robust_threshold(scores, mads=ANOMALY_MADS):
+    """median + mads * scaled median absolute deviation of the scores"""
+    median = np.median(scores)
+    mad = 1.4826 * np.median(np.abs(scores - median))  # ~ standard deviation for normal scores
+    return median + mads * mad
+
+
+class ShapeIndex:
+    """shape vectors of a set of cards, for nearest neighbour and distance from typical queries"""
+
+    __slots__ = ('times', 'shapes', 'squared_norms', 'typical', 'scores')
+
+    def __init__(self, cards, points=SHAPE_POINTS):
+        self.times = cards.times
+        self.shapes = shape_vectors(cards.positions, cards.loads, points)
+        self.squared_norms = np.einsum('ij,ij->i', self.shapes, self.shapes)
+        self.typical = np.median(self.shapes, axis=0) if len(self.shapes) else self.shapes.sum(axis=0)
+        self.scores = self.distances(self.typical[np.newaxis])[0]  # distance of every card from typical
+
+    def __len__(self):
+        return len(self.shapes)
+
+    def distances(self, queries):
+        """(Q, N) distances from shape vectors queries to every card, see nearest() for many queries"""
+        queries = np.asarray(queries, dtype=np.float32)
+        squared = (np.einsum('ij,ij->i', queries, queries)[:, np.newaxis] + self.squared_norms
+                   - 2 * queries @ self.shapes.T)
+        return np.sqrt(np.maximum(squared, 0))  # rounding can take it a little below zero
+
+    def nearest(self, queries, count):
+        """(rows, distances), each (Q, count), of the cards nearest to every query, nearest first"""
+        queries = np.asarray(queries, dtype=np.float32)
+        count = min(count, len(self))
+        rows = np.empty((len(queries), count), dtype=np.intp)
+        distances = np.empty((len(queries), count), dtype=np.float32)
+        block_queries = max(BLOCK_DISTANCES // max(len(self), 1), 1)
+        for first in range(0, len(queries), block_queries):
+            block = self.distances(queries[first:first + block_queries])
+            if count < len(self):
+                candidates = np.argpartition(block, count - 1, axis=1)[:, :count]
+            else:
+                candidates = np.broadcast_to(np.arange(count), block.shape)
+            candidate_distances = np.take_along_axis(block, candidates, axis=1)
+            order = np.argsort(candidate_distances, axis=1, kind='stable')
+            rows[first:first + len(block)] = np.take_along_axis(candidates, order, axis=1)
+            distances[first:first + len(block)] = np.take_along_axis(candidate_distances, order, axis=1)
+        return rows, distances
+
+    def like(self, row, count=10):
+        """(rows, distances) of the count cards most like card row, other than itself"""
+        rows, distances = self.nearest(self.shapes[row:row + 1], count + 1)
+        keep = rows[0] != row
+        return rows[0][keep][:count], distances[0][keep][:count]
+
+    def unusual(self, count=10):
+        """(rows, distances from typical) of the count cards least like the typical card"""
+        count = min(count, len(self))
+        rows = np.argsort(-self.scores, kind='stable')[:count]
+        return rows, self.scores[rows]
+
+    def anomalies(self, mads=ANOMALY_MADS):
+        """rows of the cards further from typical than robust_threshold(), in time order"""
+        return np.flatnonzero(self.scores > robust_threshold(self.scores, mads))
+
+    def row_at(self, time_string):
+        """row of the card nearest in time to an 'H:M:S' time of day"""
+        hours, minutes, seconds = [float(part) for part in time_string.split(':')]
+        day_us = (self.times - self.times.astype('datetime64[D]')).astype(np.int64)
+        return int(np.argmin(np.abs(day_us - ((hours * 60 + minutes) * 60 + seconds) * 10 ** 6)))
+
+
+def select_cards(cards, rows):
+    """PumpCards of the given rows of cards, in time order"""
+    rows = np.sort(rows)
+    return PumpCardLog.PumpCards(cards.times[rows], cards.positions[rows], cards.loads[rows], [])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find similar or unusual cards in a *_pumpcards.log")
+    parser.add_argument('log_file')
+    parser.add_argument('--like', metavar='H:M:S', help="list the cards most like the card at this time")
+    parser.add_argument('--unusual', type=int, metavar='N', help="list the N cards least like the typical card")
+    parser.add_argument('--count', type=int, default=10, help="cards listed by --like")
+    parser.add_argument('--mads', type=float, default=ANOMALY_MADS, help="anomaly threshold")
+    parser.add_argument('--output-dir', help="also render the listed cards (see RenderCards)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    cards = LogCache.load_cards(args.log_file, PumpCardLog.date_from_file_name(args.log_file))
+    index = ShapeIndex(cards)
+    flagged = index.anomalies(args.mads)
+    print(f"{len(index)} cards, {len(flagged)} more than {args.mads} MADs from typical "
+          f"({time.perf_counter() - start:.2f} s)")
+
+    rendered = []
+    if args.like:
+        row = index.row_at(args.like)
+        rows, distances = index.like(row, args.count)
+        print(f"most like {cards.times[row]}:")
+        rendered.append(row)
+    elif args.unusual:
+        rows, distances = index.unusual(args.unusual)
+        print("least like the typical card:")
+    else:
+        rows, distances = flagged, index.scores[flagged]
+    for row, distance in zip(rows, distances):
+        print(f"  {cards.times[row]}  {distance:.4f}")
+    rendered.extend(rows)
+
+    if args.output_dir and rendered:
+        import RenderCards
+
+        graphs, drawn = RenderCards.render_cards(select_cards(cards, np.array(rendered)), args.output_dir)
+        print(f"{graphs} graphs in {args.output_dir}, {drawn} new or changed cards drawn")
+
+
+if __name__ == "__main__":
+    main()
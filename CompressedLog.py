@@ -0,0 +1,121 @@
+"""
+Reading of gzip, xz and zstd compressed logs, as if they were the plain text.
+
+Usage is:
+
+* for block in read_blocks(file_name): ...
+    ** the bytes of the log in blocks of up to block_bytes, decompressed if the
+       name ends in one of COMPRESSIONS (CRC4_2019-3-24.log.gz)
+* for line in iter_lines(file_name): ...
+    ** the lines of the log, without the newline
+* name = log_name(file_name)
+    ** the base name without the compression suffix, for the site and date
+
+A compressed log is decompressed on a background thread while the caller
+parses the blocks it already has (zlib, lzma and zstd release the GIL while
+they work).  The blocks go through a queue of QUEUE_BLOCKS, so at most a few
+blocks are in memory whatever the size of the log.  Plain logs are just read
+block by block.
+
+zstd needs the zstandard package, it is only imported for .zst logs.
+"""
+
+import gzip
+import lzma
+import os
+import queue
+import threading
+
+BLOCK_BYTES = 1024 * 1024
+QUEUE_BLOCKS = 4
+COMPRESSIONS = ('.gz', '.xz', '.zst')
+PUT_SECONDS = 0.1  # how often a blocked decompressing thread checks if the reader went away
+
+
+def compression_of(file_name):
+    """the compression suffix of file_name ('.gz', '.xz', '.zst'), None for a plain log"""
+    for suffix in COMPRESSIONS:
+        if file_name.endswith(suffix):
+            return suffix
+    return None
+
+
+def log_name(file_name):
+    """base name of file_name without the compression suffix"""
+    name = os.path.basename(file_name.replace('\\', '/'))
+    suffix = compression_of(name)
+    return name[:-len(suffix)] if suffix else name
+
+
+def open_log(file_name):
+    """binary file object of the (decompressed) contents of the log"""
+    suffix = compression_of(file_name)
+    if suffix == '.gz':
+        return gzip.open(file_name, 'rb')
+    if suffix == '.xz':
+        return lzma.open(file_name, 'rb')
+    if suffix == '.zst':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(f"reading {file_name} needs the zstandard package (pip install zstandard)")
+        return zstandard.ZstdDecompressor().stream_reader(open(file_name, 'rb'), closefd=True)
+    return open(file_name, 'rb')
+
+
+def read_blocks(file_name, block_bytes=BLOCK_BYTES, queue_blocks=QUEUE_BLOCKS):
+    """yields the (decompressed) bytes of the log, up to block_bytes at a time"""
+    if compression_of(file_name) is None:
+        with open(file_name, 'rb') as f:
+            while True:
+                data = f.read(block_bytes)
+                if not data:
+                    return
+                yield data
+
+    blocks = queue.Queue(queue_blocks)
+    stopped = threading.Event()  # set when the reader is done, even if it stopped early
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                blocks.put(item, timeout=PUT_SECONDS)
+                return
+            except queue.Full:
+                pass
+
+    def decompress():
+        try:
+            with open_log(file_name) as f:
+                while not stopped.is_set():
+                    data = f.read(block_bytes)
+                    put(data)
+                    if not data:
+                        return
+        except BaseException as e:  # handed to the reader, raised there
+            put(e)
+
+    thread = threading.Thread(target=decompress, name=f'decompress {log_name(file_name)}', daemon=True)
+    thread.start()
+    try:
+        while True:
+            data = blocks.get()
+            if isinstance(data, BaseException):
+                raise data
+            if not data:
+                return
+            yield data
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def iter_lines(file_name, block_bytes=BLOCK_BYTES):
+    """yields the lines of the (decompressed) log as bytes, without the newline"""
+    carry = b''
+    for data in read_blocks(file_name, block_bytes):
+        lines = (carry + data).split(b'\n')
+        carry = lines.pop()
+        yield from lines
+    if carry:
+        yield carry
@@ -0,0 +1,192 @@
+"""
+Sequence gaps, repeated samples and packet loss of a magnetometer log.
+
+Usage is:
+
+python DataQuality.py CRC4_2019-3-24.log
+
+or from code, with columns from MagnetometerLog.read_log (or LogCache.load_log)
+
+* flags = flag_samples(columns)
+    ** one int8 per row, a combination of the flags below
+* rows = mag_rows(flags) / accel_rows(flags)
+    ** indices of the rows that carry a new magnetometer reading / a new packet
+* moving, rotating = detect_deduplicated(columns, flags)
+    ** RotationDetection.process_array run on each pod's new magnetometer
+       readings, spread back to every row
+* report = quality_report(columns)
+    ** one dict per pod, see REPORT_FIELDS
+
+Every pod's rows are compared with its previous row:
+
+* REPEATED_PACKET   same sequence number and pod_time, the packet was logged twice
+* MAG_REPEAT        same mag_x, mag_y, mag_z; the magnetometer updates slower
+                    than the accelerometer, so most rows repeat the last reading
+* GAP               packets were lost before this one
+* SEQUENCE_BREAK    the sequence number isn't the one pod_time says it should
+                    be (the counter restarts from 0 after a reconnection)
+* SEQUENCE_WRAP     the 8 bit sequence number went round from 255 to 0
+* TIME_BACKWARDS    pod_time went backwards (the pod restarted)
+
+The sample period is the median pod_time step of the pod.  The sequence number
+gives the number of lost packets modulo 256 and pod_time picks the multiple of
+256; where the two don't agree (a restarted counter) the loss is taken from
+pod_time alone.
+
+The extrema the detector uses can't change from a repeated reading, but its
+noise threshold is taken over THRESH_SAMPLES samples and its windows open and
+close on samples, so detect_deduplicated is not identical to process_array on
+every row: the calibration sees distinct readings instead of mostly repeats.
+"""
+
+import sys
+
+import numpy as np
+
+import MagnetometerLog
+import RotationDetection
+
+REPEATED_PACKET = 1
+MAG_REPEAT = 2
+GAP = 4
+SEQUENCE_BREAK = 8
+SEQUENCE_WRAP = 16
+TIME_BACKWARDS = 32
+
+SEQUENCE_MODULUS = 256
+GAP_PERIODS = 1.5  # a pod_time step longer than this many periods is a gap
+LOSS_TOLERANCE = 0.02  # sequence and pod_time agree on a loss if within this fraction (or 2 packets)
+
+REPORT_FIELDS = (
+    'mac', 'rows', 'repeated_packets', 'mag_readings', 'mag_repeats', 'period_seconds',
+    'gaps', 'lost_packets', 'loss_fraction', 'longest_gap_seconds',
+    'sequence_breaks', 'sequence_wraps', 'time_backwards',
+)
+
+
+def sample_period(pod_time):
+    """median positive pod_time step, NaN with fewer than two distinct times"""
+    steps = np.diff(pod_time)
+    steps = steps[steps > 0]
+    return float(np.median(steps)) if len(steps) else float('nan')
+
+
+def check_pod(sequence, pod_time, mag_x, mag_y, mag_z):
+    """(flags, packets lost before the row) of one pod's rows, in log order"""
+    flags = np.zeros(len(sequence), dtype=np.int8)
+    lost = np.zeros(len(sequence), dtype=np.int64)
+    if len(sequence) < 2:
+        return flags, lost
+    period = sample_period(pod_time)
+    time_step = np.diff(pod_time)
+    periods = time_step / period if period > 0 else np.ones(len(time_step))
+    time_lost = np.maximum(np.round(periods) - 1, 0).astype(np.int64)
+    # the sequence number gives the loss modulo 256, pod_time picks the multiple of 256
+    sequence_lost = (np.diff(sequence) - 1) % SEQUENCE_MODULUS
+    candidate = sequence_lost + SEQUENCE_MODULUS * np.round((time_lost - sequence_lost) / SEQUENCE_MODULUS)
+    agrees = np.abs(candidate - time_lost) <= np.maximum(LOSS_TOLERANCE * time_lost, 2)
+
+    later = flags[1:]  # flags of the rows that have a previous row
+    repeated = (np.diff(sequence) % SEQUENCE_MODULUS == 0) & (time_step == 0)
+    backwards = time_step < 0
+    counted = ~repeated & ~backwards
+    later[repeated] |= REPEATED_PACKET
+    later[(mag_x[1:] == mag_x[:-1]) & (mag_y[1:] == mag_y[:-1]) & (mag_z[1:] == mag_z[:-1])] |= MAG_REPEAT
+    later[backwards] |= TIME_BACKWARDS
+    later[counted & ~agrees] |= SEQUENCE_BREAK
+    lost[1:] = np.where(counted & agrees, candidate, np.where(counted & (periods > GAP_PERIODS), time_lost, 0))
+    later[lost[1:] > 0] |= GAP
+    later[counted & agrees & (sequence[1:] % SEQUENCE_MODULUS < sequence[:-1] % SEQUENCE_MODULUS)] |= SEQUENCE_WRAP
+    return flags, lost
+
+
+def flag_samples(columns):
+    """flags (see the module docstring) of every row of a column dict"""
+    flags = np.zeros(len(columns['mac']), dtype=np.int8)
+    for mac in MagnetometerLog.macs_in(columns):
+        pod = np.flatnonzero(columns['mac'] == mac.encode())
+        flags[pod], _ = check_pod(columns['sequence'][pod], columns['pod_time'][pod],
+                                  columns['mag_x'][pod], columns['mag_y'][pod], columns['mag_z'][pod])
+    return flags
+
+
+def accel_rows(flags):
+    """rows of distinct packets: the full rate accelerometer stream"""
+    return np.flatnonzero((flags & REPEATED_PACKET) == 0)
+
+
+def mag_rows(flags):
+    """rows with a new magnetometer reading: the stream the detector needs"""
+    return np.flatnonzero((flags & (REPEATED_PACKET | MAG_REPEAT)) == 0)
+
+
+def detect_deduplicated(columns, flags=None):
+    """(moving, rotating) for every row, from process_array on each pod's new magnetometer readings
+
+    a row that repeats a reading gets the indicators of the reading it repeats
+    """
+    flags = flag_samples(columns) if flags is None else flags
+    moving = np.full(len(flags), int(RotationDetection.Indicator.TBD), dtype=np.int8)
+    rotating = moving.copy()
+    kept = np.zeros(len(flags), dtype=bool)
+    kept[mag_rows(flags)] = True
+    for mac in MagnetometerLog.macs_in(columns):
+        pod = np.flatnonzero(columns['mac'] == mac.encode())
+        readings = pod[kept[pod]]
+        pod_moving, pod_rotating = RotationDetection.process_array(
+            columns['mag_x'][readings], columns['mag_y'][readings], columns['mag_z'][readings],
+            columns['pod_time'][readings])
+        # every row of the pod takes the indicators of the last reading at or before it
+        latest = np.searchsorted(readings, pod, side='right') - 1
+        moving[pod] = np.where(latest >= 0, pod_moving[np.maximum(latest, 0)], moving[pod])
+        rotating[pod] = np.where(latest >= 0, pod_rotating[np.maximum(latest, 0)], rotating[pod])
+    return moving, rotating
+
+
+def quality_report(columns):
+    """one dict (REPORT_FIELDS) per pod"""
+    report = []
+    for mac in MagnetometerLog.macs_in(columns):
+        pod = np.flatnonzero(columns['mac'] == mac.encode())
+        pod_time = columns['pod_time'][pod]
+        flags, lost = check_pod(columns['sequence'][pod], pod_time,
+                                columns['mag_x'][pod], columns['mag_y'][pod], columns['mag_z'][pod])
+        packets = int(np.count_nonzero((flags & REPEATED_PACKET) == 0))
+        gap_seconds = np.diff(pod_time)[lost[1:] > 0]
+        report.append({
+            'mac': mac,
+            'rows': len(pod),
+            'repeated_packets': len(pod) - packets,
+            'mag_readings': int(np.count_nonzero((flags & (REPEATED_PACKET | MAG_REPEAT)) == 0)),
+            'mag_repeats': int(np.count_nonzero((flags & (REPEATED_PACKET | MAG_REPEAT)) == MAG_REPEAT)),
+            'period_seconds': sample_period(pod_time),
+            'gaps': int(np.count_nonzero(lost)),
+            'lost_packets': int(lost.sum()),
+            'loss_fraction': float(lost.sum() / (lost.sum() + packets)) if packets else 0.0,
+            'longest_gap_seconds': float(gap_seconds.max()) if len(gap_seconds) else 0.0,
+            'sequence_breaks': int(np.count_nonzero(flags & SEQUENCE_BREAK)),
+            'sequence_wraps': int(np.count_nonzero(flags & SEQUENCE_WRAP)),
+            'time_backwards': int(np.count_nonzero(flags & TIME_BACKWARDS)),
+        })
+    return report
+
+
+def report_text(report):
+    """the report as a few lines per pod"""
+    lines = []
+    for pod in report:
+        lines.append(f"{pod['mac']}: {pod['rows']} rows, {pod['mag_readings']} magnetometer readings "
+                     f"({pod['mag_repeats']} repeats), {pod['repeated_packets']} packets logged twice")
+        lines.append(f"  {pod['gaps']} gaps, {pod['lost_packets']} packets lost ({pod['loss_fraction']:.2%}), "
+                     f"longest gap {pod['longest_gap_seconds']:.1f} s at {pod['period_seconds']:.4f} s per sample")
+        lines.append(f"  {pod['sequence_breaks']} sequence breaks, {pod['sequence_wraps']} wraps, "
+                     f"{pod['time_backwards']} times pod_time went backwards")
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("usage: python DataQuality.py <magnetometer log>")
+        sys.exit(1)
+    log_columns = MagnetometerLog.read_log(sys.argv[1])
+    print(report_text(quality_report(log_columns)))
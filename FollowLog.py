@@ -0,0 +1,221 @@
+"""
+Follows a magnetometer log that is still being written, like tail -f.
+
+Usage is:
+
+python FollowLog.py CRC4_2019-3-24.log [--plot]
+
+or from code
+
+* follower = LogFollower(file_name)
+* columns = follower.poll() every so often
+    ** the samples of the lines appended since the last poll (see
+       MagnetometerLog.COLUMNS), with the 'moving' and 'rotating' indicator
+       of each sample's pod after that sample, and the rtu time unwrapped
+       (see MagnetometerLog.unwrap_times) across polls
+
+Only complete lines are read, from the byte offset where the last poll
+stopped, and every sample goes through its pod's RotationDetector.process().
+After each poll the offset, the last unwrapped time and the detector states are
+written to a checkpoint file (<log file>.follow.json by default), so a restart
+picks up at the same line with the noise thresholds, extrema and moving sums it
+had, instead of calibrating again and waiting a full rotating check for the
+first verdict.
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+import CompressedLog
+import MagnetometerLog
+import RotationDetection
+import SampleStore
+
+CHECKPOINT_VERSION = 1
+POLL_SECONDS = 1.0
+PLOT_SECONDS = 10 * 60  # time span shown by the live plot
+FINGERPRINT_BYTES = 256  # start of the log kept in the checkpoint, to notice a different file
+
+
+class LogFollower:
+    """reads the new lines of a growing log and keeps the per pod detectors up to date"""
+
+    __slots__ = ('file_name', 'checkpoint_file', 'offset', 'fingerprint', 'last_time', 'demultiplexer')
+
+    def __init__(self, file_name, checkpoint_file=None):
+        self.file_name = file_name
+        self.checkpoint_file = checkpoint_file or file_name + '.follow.json'
+        self.offset = 0
+        self.fingerprint = ''
+        self.last_time = None  # unwrapped rtu time of the last line read, None before the first
+        self.demultiplexer = RotationDetection.RotationDemultiplexer()
+        self.load_checkpoint()
+
+    def read_fingerprint(self):
+        with open(self.file_name, 'rb') as f:
+            return f.read(FINGERPRINT_BYTES).decode('latin-1')
+
+    def load_checkpoint(self):
+        """resumes from the checkpoint file, if there is one for this log"""
+        try:
+            with open(self.checkpoint_file, 'r') as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return
+        if checkpoint.get('version') != CHECKPOINT_VERSION:
+            return
+        fingerprint = checkpoint['fingerprint']
+        if not self.read_fingerprint().startswith(fingerprint):
+            print(f"{self.checkpoint_file} is for another file, starting from the beginning")
+            return
+        self.offset = checkpoint['offset']
+        self.fingerprint = fingerprint
+        self.last_time = checkpoint.get('last_time')
+        self.demultiplexer.set_state(checkpoint['detectors'])
+
+    def save_checkpoint(self):
+        """writes the offset and detector states, replacing the old checkpoint in one step"""
+        checkpoint = {
+            'version': CHECKPOINT_VERSION,
+            'file_name': os.path.basename(self.file_name),
+            'offset': self.offset,
+            'fingerprint': self.fingerprint,
+            'last_time': self.last_time,
+            'detectors': self.demultiplexer.get_state(),
+        }
+        temp_file = self.checkpoint_file + '.tmp'
+        with open(temp_file, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(temp_file, self.checkpoint_file)
+
+    def poll(self, max_bytes=MagnetometerLog.CHUNK_BYTES):
+        """processes up to max_bytes of complete new lines, returns their column dict
+
+        a partial last line is left for the next poll, and a line longer than
+        max_bytes is read on to its end.  If the log got shorter than the
+        offset it was replaced, and is read again from the start.
+        """
+        size = os.path.getsize(self.file_name)
+        if size < self.offset:
+            print(f"{self.file_name} got shorter, starting from the beginning")
+            self.offset = 0
+            self.fingerprint = ''
+            self.last_time = None
+            self.demultiplexer = RotationDetection.RotationDemultiplexer()
+        if len(self.fingerprint) < FINGERPRINT_BYTES:
+            self.fingerprint = self.read_fingerprint()
+        with open(self.file_name, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read(min(size - self.offset, max_bytes))
+            while b'\n' not in data and self.offset + len(data) < size:
+                data += f.read(min(size - self.offset - len(data), max_bytes))
+        cut = data.rfind(b'\n') + 1
+        if cut == 0:
+            return None
+        columns = MagnetometerLog.parse_chunk(data[:cut])
+        self.offset += cut
+        columns['time'] = MagnetometerLog.unwrap_times(columns['time'], self.last_time)
+        if len(columns['time']):
+            self.last_time = int(columns['time'][-1])
+
+        moving = np.empty(len(columns['mac']), dtype=np.int8)
+        rotating = np.empty(len(columns['mac']), dtype=np.int8)
+        samples = zip(columns['mac'].tolist(), columns['mag_x'].tolist(), columns['mag_y'].tolist(),
+                      columns['mag_z'].tolist(), columns['pod_time'].tolist())
+        for i, (mac, mag_x, mag_y, mag_z, pod_time) in enumerate(samples):
+            detector = self.demultiplexer.detector(mac.decode())
+            detector.process(mag_x, mag_y, mag_z, pod_time)
+            moving[i] = detector.moving
+            rotating[i] = detector.rotating
+        columns['moving'] = moving
+        columns['rotating'] = rotating
+        self.save_checkpoint()
+        return columns
+
+
+class LivePlot:
+    """one figure per pod showing the last PLOT_SECONDS, extended with every poll"""
+
+    __slots__ = ('figures', 'samples', 'date')
+
+    def __init__(self, date=None):
+        self.figures = {}  # mac -> (figure, axes, {name: Line2D})
+        self.samples = SampleStore.SampleStore(PLOT_SECONDS)  # the samples on show
+        self.date = date
+
+    def new_figure(self, mac):
+        import matplotlib.pyplot as plt
+
+        fig, ax = plt.subplots(nrows=2, ncols=1, sharex=True)
+        lines = {name: ax[0].plot([], [], label=name)[0] for name in ('mag_x', 'mag_y', 'mag_z')}
+        lines.update({name: ax[1].plot([], [], label=name)[0] for name in ('moving', 'rotating')})
+        ax[0].set_title(mac)
+        ax[0].set_ylabel("magnetometer")
+        ax[1].set_ylabel("Algorithm")
+        ax[1].set_xlabel('Edmonton Time')
+        for axes in ax:
+            axes.legend(loc='upper left')
+            axes.grid()
+        fig.show()
+        return fig, ax, lines
+
+    def add(self, columns):
+        """appends the samples of a poll and redraws"""
+        import matplotlib.pyplot as plt
+
+        for mac in self.samples.append(columns):
+            samples = self.samples.samples(mac)
+            if mac not in self.figures:
+                self.figures[mac] = self.new_figure(mac)
+            fig, ax, lines = self.figures[mac]
+            times = MagnetometerLog.to_datetime64(samples['time'], self.date)
+            for name, line in lines.items():
+                line.set_data(times, samples[name].copy())  # the buffers are overwritten by later polls
+            for axes in ax:
+                axes.relim()
+                axes.autoscale_view()
+            fig.canvas.draw_idle()
+        plt.pause(0.01)
+
+
+def follow(file_name, checkpoint_file=None, plot=False, poll_seconds=POLL_SECONDS):
+    """follows file_name until interrupted, printing changes of the indicators"""
+    follower = LogFollower(file_name, checkpoint_file)
+    live_plot = None
+    if plot:
+        date = os.path.basename(file_name).split('_')[1].split('.')[0]
+        live_plot = LivePlot(date)
+    reported = {mac: (detector.moving, detector.rotating)
+                for mac, detector in follower.demultiplexer.detectors.items()}
+    print(f"following {file_name} from byte {follower.offset}")
+    try:
+        while True:
+            columns = follower.poll()
+            if columns is None:
+                time.sleep(poll_seconds)
+                continue
+            for mac, detector in follower.demultiplexer.detectors.items():
+                indicators = (detector.moving, detector.rotating)
+                if reported.get(mac) != indicators:
+                    print(f"{mac}: moving {detector.moving.name}, rotating {detector.rotating.name}")
+                    reported[mac] = indicators
+            if live_plot is not None and len(columns['mac']):
+                live_plot.add(columns)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Follow a growing magnetometer log")
+    parser.add_argument('log_file')
+    parser.add_argument('--checkpoint', help="defaults to <log file>.follow.json")
+    parser.add_argument('--plot', action='store_true', help="show a live plot per pod")
+    parser.add_argument('--poll-seconds', type=float, default=POLL_SECONDS)
+    args = parser.parse_args()
+    if CompressedLog.compression_of(args.log_file):
+        parser.error("a compressed log isn't being written to, read it with MagnetometerLog.read_log")
+    follow(args.log_file, args.checkpoint, args.plot, args.poll_seconds)
@@ -0,0 +1,157 @@
+"""
+Per stage wall/CPU timers and counters for a run, with a JSON report.
+
+Usage is:
+
+* Instrumentation.start('plot CRC4_2019-3-24.log', profile=False, trace_memory=False)
+* anywhere in the code
+    ** with Instrumentation.stage('parse log'): ...
+    ** @Instrumentation.staged('rotation detection') on a function
+    ** Instrumentation.count('lines read', n)
+* report = Instrumentation.finish('report.json')
+* print(Instrumentation.summary(report))
+
+Without a started run stage() and count() do nothing and cost next to
+nothing, so the library modules are instrumented unconditionally.  Stages can
+be nested, an outer stage's time includes the inner ones.  profile=True runs
+cProfile for the whole run and adds the functions with the most cumulative
+time to the report, trace_memory=True adds the tracemalloc peak and the lines
+that allocated the most.
+"""
+
+import contextlib
+import cProfile
+import functools
+import json
+import pstats
+import time
+import tracemalloc
+
+PROFILE_FUNCTIONS = 25
+MEMORY_SITES = 10
+
+NO_STAGE = contextlib.nullcontext()
+current = None  # the Run being recorded
+
+
+class Run:
+    """timers and counters of one run"""
+
+    __slots__ = ('name', 'started', 'cpu_started', 'stages', 'counters', 'profiler', 'trace_memory')
+
+    def __init__(self, name, profile=False, trace_memory=False):
+        self.name = name
+        self.stages = {}  # name -> {'calls', 'wall_seconds', 'cpu_seconds'}
+        self.counters = {}
+        self.trace_memory = trace_memory
+        if trace_memory:
+            tracemalloc.start()
+        self.profiler = cProfile.Profile() if profile else None
+        if self.profiler is not None:
+            self.profiler.enable()
+        self.started = time.perf_counter()
+        self.cpu_started = time.process_time()
+
+    def add(self, name, wall_seconds, cpu_seconds=0.0, calls=1):
+        """adds time measured elsewhere (e.g. in a worker process) to a stage"""
+        stage = self.stages.setdefault(name, {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0})
+        stage['calls'] += calls
+        stage['wall_seconds'] += wall_seconds
+        stage['cpu_seconds'] += cpu_seconds
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - wall, time.process_time() - cpu)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self):
+        """stops the profilers and returns the report dict"""
+        report = {
+            'name': self.name,
+            'wall_seconds': time.perf_counter() - self.started,
+            'cpu_seconds': time.process_time() - self.cpu_started,
+            'stages': self.stages,
+            'counters': self.counters,
+        }
+        if self.profiler is not None:
+            self.profiler.disable()
+            stats = pstats.Stats(self.profiler).stats
+            top = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:PROFILE_FUNCTIONS]
+            report['profile'] = [{'function': f'{file_name}:{line}({function})', 'calls': calls,
+                                  'own_seconds': own, 'cumulative_seconds': cumulative}
+                                 for (file_name, line, function), (_, calls, own, cumulative, _) in top]
+        if self.trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            sites = tracemalloc.take_snapshot().statistics('lineno')[:MEMORY_SITES]
+            tracemalloc.stop()
+            report['memory'] = {'peak_bytes': peak,
+                                'largest': [{'line': str(site.traceback), 'bytes': site.size} for site in sites]}
+        return report
+
+
+def start(name, profile=False, trace_memory=False):
+    """starts recording a run, replacing any run in progress"""
+    global current
+    current = Run(name, profile, trace_memory)
+    return current
+
+
+def finish(report_file=None):
+    """ends the run, returns its report (None if no run was started), saved as JSON if report_file is given"""
+    global current
+    if current is None:
+        return None
+    report = current.report()
+    current = None
+    if report_file is not None:
+        with open(report_file, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def stage(name):
+    """context manager timing a stage of the current run"""
+    return NO_STAGE if current is None else current.stage(name)
+
+
+def staged(name):
+    """decorator running every call of the function as a stage"""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(name, n=1):
+    if current is not None:
+        current.count(name, n)
+
+
+def add(name, wall_seconds, cpu_seconds=0.0, calls=1):
+    if current is not None:
+        current.add(name, wall_seconds, cpu_seconds, calls)
+
+
+def summary(report):
+    """the report as a few lines of text, for the GUI or the console"""
+    lines = [f"{report['name']}: {report['wall_seconds']:.2f} s wall, {report['cpu_seconds']:.2f} s CPU"]
+    for name, stage_times in sorted(report['stages'].items(), key=lambda item: -item[1]['wall_seconds']):
+        lines.append(f"  {name}: {stage_times['wall_seconds']:.3f} s wall, {stage_times['cpu_seconds']:.3f} s CPU"
+                     f" ({stage_times['calls']} calls)")
+    for name, value in report['counters'].items():
+        lines.append(f"  {name}: {value}")
+    if 'memory' in report:
+        lines.append(f"  peak memory: {report['memory']['peak_bytes'] / 2 ** 20:.1f} MB")
+    for entry in report.get('profile', [])[:5]:
+        lines.append(f"  {entry['cumulative_seconds']:.3f} s in {entry['function']}")
+    return '\n'.join(lines)
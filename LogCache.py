@@ -0,0 +1,145 @@
+"""
+Cache of parsed logs as memory mapped binary columns.
+
+Usage is:
+
+* columns = load_log(file_name)          same as MagnetometerLog.read_log(file_name)
+* cards = load_cards(file_name, date)    same as PumpCardLog.read_cards(file_name, date)
+
+The first call parses the text log and saves every column (or card matrix) as
+a .npy file in an entry of the cache directory (.logcache next to the log by
+default).  Later calls open those files with np.load(mmap_mode='r'), so there
+is nothing to parse and only the pages that are used get read.  An entry is
+named after the log's path, size and mtime and the parser version, so editing
+or appending to the log, or changing the parser, simply misses the cache.
+
+Entries are touched whenever they are used, and after a new entry is written
+the least recently used ones are removed until the directory is under
+MAX_CACHE_BYTES.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+import Instrumentation
+import MagnetometerLog
+import PumpCardLog
+
+CACHE_DIR_NAME = '.logcache'
+MAX_CACHE_BYTES = 2 * 1024 ** 3
+META_FILE = 'meta.json'
+
+
+def default_cache_dir(file_name):
+    return os.path.join(os.path.dirname(os.path.abspath(file_name)), CACHE_DIR_NAME)
+
+
+def entry_name(file_name, kind, parser_version):
+    """cache entry of the current contents of file_name"""
+    stat = os.stat(file_name)
+    key = f'{os.path.abspath(file_name)}|{stat.st_size}|{stat.st_mtime_ns}|{kind}|{parser_version}'
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def open_column(path):
+    try:
+        return np.load(path, mmap_mode='r')
+    except ValueError:  # an empty column can't be mapped
+        return np.load(path)
+
+
+def read_entry(entry_dir):
+    """({name: memory mapped array}, meta) of a cache entry, None if there isn't one"""
+    try:
+        with open(os.path.join(entry_dir, META_FILE), 'r') as f:
+            meta = json.load(f)
+        arrays = {name: open_column(os.path.join(entry_dir, name + '.npy')) for name in meta['columns']}
+        os.utime(entry_dir)  # most recently used, fails if it was evicted meanwhile
+    except (OSError, ValueError, KeyError):
+        return None
+    return arrays, meta
+
+
+def write_entry(entry_dir, arrays, meta):
+    """saves the arrays (and the meta dict) as a new entry, in one rename
+
+    an entry already at entry_dir (one read_entry couldn't read) is removed first
+    """
+    temp_dir = f'{entry_dir}.tmp{os.getpid()}'
+    os.makedirs(temp_dir, exist_ok=True)
+    for name, values in arrays.items():
+        np.save(os.path.join(temp_dir, name + '.npy'), np.ascontiguousarray(values))
+    with open(os.path.join(temp_dir, META_FILE), 'w') as f:
+        json.dump(dict(meta, columns=list(arrays)), f)
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    try:
+        os.replace(temp_dir, entry_dir)
+    except OSError:  # written by someone else in the meantime
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def entry_bytes(entry_dir):
+    return sum(entry.stat().st_size for entry in os.scandir(entry_dir) if entry.is_file())
+
+
+def evict(cache_dir, max_bytes=MAX_CACHE_BYTES, keep=None):
+    """removes the least recently used entries until the cache is under max_bytes
+
+    the entry named keep stays even if it is the oldest (or too big on its own)
+    """
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.is_dir() and '.tmp' not in entry.name:
+            entries.append((entry.stat().st_mtime_ns, entry.name, entry_bytes(entry.path)))
+    total = sum(size for _, _, size in entries)
+    for _, name, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if name == keep:
+            continue
+        shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+        total -= size
+
+
+def cached(file_name, kind, parser_version, parse, cache_dir=None, max_bytes=MAX_CACHE_BYTES):
+    """(arrays, meta) for file_name from the cache, parse(file_name) -> (arrays, meta) on a miss"""
+    cache_dir = cache_dir or default_cache_dir(file_name)
+    name = entry_name(file_name, kind, parser_version)
+    entry_dir = os.path.join(cache_dir, name)
+    entry = read_entry(entry_dir)
+    if entry is not None:
+        Instrumentation.count('cache hits')
+        return entry
+    Instrumentation.count('cache misses')
+    arrays, meta = parse(file_name)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        write_entry(entry_dir, arrays, meta)
+        evict(cache_dir, max_bytes, keep=name)
+    except OSError as e:  # can't write next to the log, carry on without the cache
+        print(f"not caching {file_name}: {e}")
+        return arrays, meta
+    return read_entry(entry_dir) or (arrays, meta)
+
+
+def load_log(file_name, cache_dir=None):
+    """MagnetometerLog.read_log(file_name) through the cache"""
+    columns, _ = cached(file_name, 'magnetometer', MagnetometerLog.PARSER_VERSION,
+                        lambda name: (MagnetometerLog.read_log(name), {}), cache_dir)
+    return columns
+
+
+def load_cards(file_name, date=None, cache_dir=None):
+    """PumpCardLog.read_cards(file_name, date) through the cache"""
+    def parse(name):
+        cards = PumpCardLog.read_cards(name, date)
+        return ({'times': cards.times, 'positions': cards.positions, 'loads': cards.loads},
+                {'problems': cards.problems})
+
+    arrays, meta = cached(file_name, f'pumpcards {date}', PumpCardLog.PARSER_VERSION, parse, cache_dir)
+    return PumpCardLog.PumpCards(arrays['times'], arrays['positions'], arrays['loads'],
+                                 [tuple(problem) for problem in meta['problems']])
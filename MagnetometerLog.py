@@ -0,0 +1,519 @@
+"""
+Streaming, columnar reader for magnetometer ("rod rotator") log files.
+
+Lines are in the format
+
+MAC,Magnetometer,raw,sequence,rtu_time,pod_time,accel_y,mag_x,mag_y,mag_z
+
+for example
+
+DF:8D:7F:A0:31:36,Magnetometer,Raw,sequence,rtu_time(H-M-S-uS edmonton TZ),pod_time,accel_y,mag_x,mag_y,mag_z
+DF:8D:7F:A0:31:36,Magnetometer,b'f10d01030a2100770d17a49136f3ffa2fe9002',0,13-28-45-722903,672112.8415527344,13969,-13,-350,656
+
+Usage is:
+
+* for columns in iter_chunks(file_name, mac): ...
+    ** columns is a dict of numpy arrays (see COLUMNS), one entry per sample
+* or columns = read_log(file_name, mac) for the whole file at once
+* source='raw' takes pod_time and the sensor values from the raw packet instead
+  of the decimal fields, source='check' reports where the two disagree (see
+  raw_mismatch_report, or run python MagnetometerLog.py <log file>)
+
+The file is read CHUNK_BYTES at a time and each chunk is split into fields with
+numpy (newline/comma positions), so memory stays bounded by the chunk size no
+matter how large the log is.  Logs compressed with gzip, xz or zstd (a .gz, .xz
+or .zst name) are read the same way, see CompressedLog.  The rtu time (H-M-S-uS,
+not zero padded) is turned into integer microseconds since midnight
+arithmetically rather than through strptime.  Header lines are skipped, and lines that don't have exactly ten
+fields or don't parse are counted as rejected.
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import CompressedLog
+import Instrumentation
+
+PARSER_VERSION = 3  # bump when the parsed columns change, it invalidates LogCache entries
+CHUNK_BYTES = 1024 * 1024
+
+NUM_FIELDS = 10
+MAC_FIELD = 0
+TYPE_FIELD = 1
+RAW_FIELD = 2
+SEQUENCE_FIELD = 3
+RTU_TIME_FIELD = 4
+POD_TIME_FIELD = 5
+SENSOR_FIELDS = {'accel_y': 6, 'mag_x': 7, 'mag_y': 8, 'mag_z': 9}
+
+# name -> dtype of the parsed columns
+COLUMNS = {
+    'mac': 'S17',
+    'sequence': np.int64,
+    'time': np.int64,  # rtu time, microseconds since midnight
+    'pod_time': np.float64,
+    'accel_y': np.float64,
+    'mag_x': np.float64,
+    'mag_y': np.float64,
+    'mag_z': np.float64,
+}
+
+NEWLINE = ord('\n')
+COMMA = ord(',')
+DASH = ord('-')
+DOT = ord('.')
+ZERO = ord('0')
+
+MAC_WIDTH = 17
+FLOAT_WIDTH = 32  # longest float field accepted
+TIME_MULTIPLIERS = (3600 * 10 ** 6, 60 * 10 ** 6, 10 ** 6, 1)  # H-M-S-uS
+TIME_LIMITS = (24, 60, 60, 10 ** 6)  # each part must be below its limit
+DAY_US = 24 * 3600 * 10 ** 6
+PAD = FLOAT_WIDTH  # zero bytes around each chunk so fixed width reads never run off the end
+
+# integers are converted 8 digits (one little endian word) at a time, see parse_integers
+WORD_DIGITS = 8
+MAX_DIGITS = 2 * WORD_DIGITS  # longest integer accepted
+ASCII_ZEROS = np.uint64(0x3030303030303030)
+LOW_7_BITS = np.uint64(0x7F7F7F7F7F7F7F7F)
+OVER_9 = np.uint64(0x7676767676767676)  # sets bit 7 of a byte holding more than 9
+HIGH_BITS = np.uint64(0x8080808080808080)
+PAIRS = np.uint64(0x00FF00FF00FF00FF)
+QUADS = np.uint64(0x0000FFFF0000FFFF)
+OCTETS = np.uint64(0x00000000FFFFFFFF)
+# KEEP_BYTES[n + 1] keeps the last n bytes of a word, for n from -1 to WORD_DIGITS
+KEEP_BYTES = np.array([0, 0] + [2 ** 64 - 2 ** (8 * (WORD_DIGITS - n)) for n in range(1, WORD_DIGITS + 1)],
+                      dtype=np.uint64)
+# decimals are divided in double-double arithmetic, see parse_decimals
+MAX_MANTISSA_DIGITS = 18  # the digits are put together in an int64 first
+SPLITTER = 2.0 ** 27 + 1  # splits a double into two 26 bit halves (Veltkamp)
+HALFWAY_ULPS = 2.0 ** -30  # closer than this to halfway between two doubles is left to float()
+
+# the raw column is the pod's BLE payload, b'<38 hex digits>', laid out as
+PACKET_DTYPE = np.dtype([
+    ('rssi', 'i1'),
+    ('header', 'V5'),  # 0d 01 03 0a 21
+    ('counter', 'u1'),  # low byte of the sequence
+    ('ticks', '<u4'),  # pod_time * TICKS_PER_SECOND
+    ('accel_y', '<i2'),
+    ('mag_x', '<i2'),
+    ('mag_y', '<i2'),
+    ('mag_z', '<i2'),
+])
+TICKS_PER_SECOND = 4096
+HEX_WIDTH = 2 * PACKET_DTYPE.itemsize
+RAW_WIDTH = HEX_WIDTH + 3  # with the b'' around it
+HEX_VALUES = np.full(256, 255, dtype=np.uint8)  # ascii -> hex digit value, 255 for anything else
+HEX_VALUES[np.frombuffer(b'0123456789', dtype=np.uint8)] = np.arange(10)
+HEX_VALUES[np.frombuffer(b'abcdef', dtype=np.uint8)] = np.arange(10, 16)
+HEX_VALUES[np.frombuffer(b'ABCDEF', dtype=np.uint8)] = np.arange(10, 16)
+
+# where do the decimal columns come from: the decimal fields, the raw packet,
+# or the decimal fields checked against the packet (adds a 'raw_mismatch' column)
+SOURCES = ('decimal', 'raw', 'check')
+# bit k of raw_mismatch is set when column RAW_CHECKS[k] disagrees with the packet
+RAW_CHECKS = ('sequence', 'pod_time', 'accel_y', 'mag_x', 'mag_y', 'mag_z')
+RAW_UNDECODABLE = 1 << len(RAW_CHECKS)  # the raw field isn't a packet at all
+
+
+def empty_columns():
+    return {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+
+
+def concatenate_columns(chunks):
+    """joins a list of column dicts into one"""
+    if not chunks:
+        return empty_columns()
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+
+
+def words_at(buf, offsets):
+    """buf[offsets[i]:offsets[i] + 8] as little endian uint64s"""
+    words = np.ndarray((len(buf) - 7,), dtype='<u8', buffer=buf, strides=(1,))
+    return words[offsets]
+
+
+def fixed_field_equals(buf, starts, stops, value):
+    """bool per field, True where buf[starts[i]:stops[i]] == value (bytes of 8 or more)"""
+    equal = (stops - starts) == len(value)
+    for offset in list(range(0, len(value) - 8, 8)) + [len(value) - 8]:
+        word = np.frombuffer(value[offset:offset + 8], dtype='<u8')[0]
+        equal &= words_at(buf, starts + offset) == word
+    return equal
+
+
+def word_values(buf, stops, num_digits):
+    """(uint64 values, valid) of the last num_digits (0 to 8) bytes before each of stops, as a decimal
+
+    the 8 bytes ending at each stop are read as one little endian word, the
+    bytes in front of the digits are masked off (they act as leading zeros),
+    and the digits are combined pairwise in three multiply/shift/mask steps
+    (the usual SWAR atoi), so there is no per-digit loop.
+    """
+    keep = KEEP_BYTES[np.clip(num_digits, -1, WORD_DIGITS) + 1]
+    words = words_at(buf, stops - WORD_DIGITS) & keep
+    words ^= ASCII_ZEROS & keep  # '0'..'9' -> 0..9, anything else ends up over 9
+    valid = (((words & LOW_7_BITS) + OVER_9) | words) & HIGH_BITS == 0
+    words = (words * np.uint64(10) + (words >> np.uint64(8))) & PAIRS
+    words = (words * np.uint64(100) + (words >> np.uint64(16))) & QUADS
+    words = (words * np.uint64(10000) + (words >> np.uint64(32))) & OCTETS
+    return words, valid
+
+
+def parse_integers(buf, starts, stops, signed=True, dtype=np.int64):
+    """decimal integers of up to MAX_DIGITS digits in buf[starts[i]:stops[i]] -> (values, valid)
+
+    the last 8 digits of every field are one word_values() word, the digits in
+    front of them (if any field has more) another.
+    """
+    negative = (buf[starts] == DASH) if signed else np.zeros(len(starts), dtype=bool)
+    num_digits = stops - starts - negative
+    valid = (num_digits >= 1) & (num_digits <= MAX_DIGITS)
+    low, valid_low = word_values(buf, stops, np.minimum(num_digits, WORD_DIGITS))
+    valid &= valid_low
+    values = low.view(np.int64)  # under 10**8, the same bits
+    long = valid & (num_digits > WORD_DIGITS)
+    if long.any():
+        high, valid_high = word_values(buf, stops - WORD_DIGITS, np.where(long, num_digits - WORD_DIGITS, 0))
+        valid &= valid_high
+        values += high.astype(np.int64) * 10 ** WORD_DIGITS
+    values = values.astype(dtype, copy=False)
+    if signed:
+        np.negative(values, out=values, where=negative)
+    return values, valid
+
+
+def exact_product(a, b):
+    """(a * b rounded, its rounding error), the two add up to a * b exactly (Dekker's product)"""
+    product = a * b
+    split_a = SPLITTER * a
+    a_high = split_a - (split_a - a)
+    a_low = a - a_high
+    split_b = SPLITTER * b
+    b_high = split_b - (split_b - b)
+    b_low = b - b_high
+    return product, ((a_high * b_high - product) + a_high * b_low + a_low * b_high) + a_low * b_low
+
+
+def parse_decimals(buf, starts, stops, dots):
+    """fixed point decimals like 976540.9616699219 -> (float64 values, valid)
+
+    the digits either side of the point are read with parse_integers and put
+    together as one integer M, the value is M / 10**places.  M is taken as the
+    double nearest to it plus the rest, the quotient of that double is
+    corrected by the remainder of the division (exact, see exact_product), and
+    the corrected quotient is within a tiny fraction of an ulp of the decimal.
+    It rounds to the double float() gives unless the decimal is almost exactly
+    halfway between two doubles; those rows, and the ones with too many digits,
+    are left invalid for the caller to parse the slow way.  dots holds the
+    positions of every '.' in buf.
+    """
+    first = np.searchsorted(dots, starts)
+    valid = (np.searchsorted(dots, stops) - first) == 1
+    dot = dots[np.minimum(first, len(dots) - 1)] if len(dots) else starts
+    dot = np.clip(dot, starts, stops)
+    negative = buf[starts] == DASH
+    whole, valid_whole = parse_integers(buf, starts, dot)
+    fraction, valid_fraction = parse_integers(buf, dot + 1, np.maximum(stops, dot + 1), signed=False)
+    places = np.clip(stops - dot - 1, 0, MAX_DIGITS)
+    valid &= valid_whole & valid_fraction & ((dot - starts - negative + places) <= MAX_MANTISSA_DIGITS)
+    pow10 = 10 ** np.arange(MAX_DIGITS + 1, dtype=np.int64)
+    mantissa = np.where(valid, np.abs(whole) * pow10[places] + fraction, 0)
+
+    divisor = pow10[places].astype(np.float64)  # exact up to 10**22
+    high = mantissa.astype(np.float64)
+    low = (mantissa - high.astype(np.int64)).astype(np.float64)
+    quotient = high / divisor
+    product, product_error = exact_product(quotient, divisor)
+    remainder = ((high - product) - product_error + low) / divisor  # M / 10**places - quotient
+    values = quotient + remainder
+    # where the decimal is between values and its neighbour, in units of their gap
+    past = (quotient - values) + remainder
+    gap = np.where(past < 0, values - np.nextafter(values, 0), np.spacing(values))
+    valid &= np.abs(np.abs(past) - gap / 2) > HALFWAY_ULPS * gap
+    np.negative(values, out=values, where=negative)
+    return values, valid
+
+
+def parse_floats(buf, starts, stops, candidates, dots=None):
+    """buf[starts[i]:stops[i]] -> (float64 values, valid)
+
+    integers (what the pods send for everything but pod_time) are converted
+    arithmetically, or with dots (positions of every '.' in buf) given the
+    fields are read as decimals (parse_decimals).  The rows flagged in
+    candidates that don't convert that way go through numpy's float parser.
+    """
+    if dots is None:
+        values, valid = parse_integers(buf, starts, stops, dtype=np.float64)
+    else:
+        values, valid = parse_decimals(buf, starts, stops, dots)
+    retry = np.flatnonzero(candidates & ~valid & ((stops - starts) <= FLOAT_WIDTH))
+    if len(retry) == 0:
+        return values, valid
+    lengths = stops[retry] - starts[retry]
+    matrix = sliding_window_view(buf, FLOAT_WIDTH)[starts[retry]]
+    matrix = matrix * (np.arange(FLOAT_WIDTH) < lengths[:, None])
+    strings = matrix.view(f'S{FLOAT_WIDTH}').ravel()
+    try:
+        values[retry] = strings.astype(np.float64)
+        valid[retry] = True
+    except ValueError:
+        # a bad field somewhere, go row by row
+        for i, string in zip(retry, strings):
+            try:
+                values[i] = float(string)
+                valid[i] = True
+            except ValueError:
+                pass
+    return values, valid
+
+
+def parse_rtu_time(buf, starts, stops, dashes):
+    """H-M-S-uS fields -> (microseconds since midnight, valid)
+
+    dashes holds the positions of every '-' in buf.  The microseconds are not
+    zero padded in the logs (0-46-2-38624 is 38624 us past the second), so each
+    part is read as a plain integer.  A time with a part out of range (an hour
+    of 24 or more, ...) is invalid, it would throw unwrap_times off by a day.
+    """
+    if len(dashes) == 0:
+        return np.zeros(len(starts), dtype=np.int64), np.zeros(len(starts), dtype=bool)
+    first = np.searchsorted(dashes, starts)
+    valid = (np.searchsorted(dashes, stops) - first) == len(TIME_MULTIPLIERS) - 1
+    separators = dashes[np.minimum(first[:, None] + np.arange(len(TIME_MULTIPLIERS) - 1), len(dashes) - 1)]
+    part_starts = np.column_stack([starts, separators + 1])
+    part_stops = np.maximum(np.column_stack([separators, stops]), part_starts)  # garbage rows are invalid anyway
+    # all four parts in one go, part k of every field is row k
+    values, valid_parts = parse_integers(buf, part_starts.T.ravel(), part_stops.T.ravel(), signed=False)
+    valid_parts &= values < np.repeat(TIME_LIMITS, len(starts))
+    total = np.array(TIME_MULTIPLIERS, dtype=np.int64) @ values.reshape(len(TIME_MULTIPLIERS), -1)
+    return total, valid & np.all(valid_parts.reshape(len(TIME_MULTIPLIERS), -1), axis=0)
+
+
+def decode_packets(buf, starts, stops):
+    """raw fields b'<hex>' in buf[starts[i]:stops[i]] -> (PACKET_DTYPE array, valid)
+
+    the hex digits of all fields are looked up in one go and paired into
+    bytes, which are then viewed as packets, no per-line work.
+    """
+    valid = ((stops - starts) == RAW_WIDTH) & (buf[starts] == ord('b')) & (buf[starts + 1] == ord("'")) \
+        & (buf[stops - 1] == ord("'"))
+    digits = HEX_VALUES[sliding_window_view(buf, HEX_WIDTH)[np.minimum(starts + 2, len(buf) - HEX_WIDTH)]]
+    valid &= digits.max(axis=1, initial=0) < 16
+    packet_bytes = (digits[:, 0::2] << 4) | digits[:, 1::2]
+    return packet_bytes.view(PACKET_DTYPE).ravel(), valid
+
+
+def packet_columns(packets):
+    """the columns a packet carries (the sequence only modulo 256)"""
+    columns = {'sequence': packets['counter'].astype(np.int64),
+               'pod_time': packets['ticks'] / TICKS_PER_SECOND}
+    for name in SENSOR_FIELDS:
+        columns[name] = packets[name].astype(np.float64)
+    return columns
+
+
+def raw_mismatches(columns, packets, decodable):
+    """RAW_CHECKS/RAW_UNDECODABLE bit mask per line of where columns and packets disagree"""
+    mismatch = np.where(decodable, 0, RAW_UNDECODABLE).astype(np.uint8)
+    from_packets = packet_columns(packets)
+    for bit, name in enumerate(RAW_CHECKS):
+        expected = columns[name] & 0xFF if name == 'sequence' else columns[name]
+        mismatch |= np.where(decodable & (from_packets[name] != expected), 1 << bit, 0).astype(np.uint8)
+    return mismatch
+
+
+def split_lines(buf, start, line_stops, commas):
+    """start/stop offsets of the fields of every line with NUM_FIELDS fields
+
+    the lines run from offset start of buf to the last of line_stops (the
+    positions of the newlines), commas holds the positions of the commas.
+    returns (field_starts, field_stops, num_lines), the field arrays have
+    shape (n, NUM_FIELDS) and num_lines doesn't count blank lines
+    """
+    line_starts = np.empty_like(line_stops)
+    line_starts[0] = start
+    line_starts[1:] = line_stops[:-1] + 1
+    # drop the \r of \r\n line endings
+    line_stops = line_stops - (buf[line_stops - 1] == ord('\r'))
+
+    first_comma = np.searchsorted(commas, line_starts)
+    good = np.flatnonzero((np.searchsorted(commas, line_stops) - first_comma) == NUM_FIELDS - 1)
+
+    comma_pos = commas[first_comma[good][:, None] + np.arange(NUM_FIELDS - 1)]
+    field_starts = np.empty((len(good), NUM_FIELDS), dtype=np.intp)
+    field_stops = np.empty((len(good), NUM_FIELDS), dtype=np.intp)
+    field_starts[:, 0] = line_starts[good]
+    field_starts[:, 1:] = comma_pos + 1
+    field_stops[:, :-1] = comma_pos
+    field_stops[:, -1] = line_stops[good]
+    return field_starts, field_stops, int(np.count_nonzero(line_stops > line_starts))
+
+
+def parse_chunk(chunk, mac=None, stats=None, source='decimal'):
+    """parses a bytes object holding whole lines into a column dict
+
+    mac (str) keeps only the lines of that pod.  stats, if given, is a dict
+    whose 'lines', 'headers' and 'rejected' counts are incremented.  source is
+    one of SOURCES: with 'raw' pod_time and the sensor columns are decoded from
+    the raw packet (lines without a good packet are rejected), with 'check'
+    they are parsed from the decimal fields and the 'raw_mismatch' column
+    says where the packet disagrees.
+    """
+    if not chunk.endswith(b'\n'):
+        chunk += b'\n'
+    buf = np.frombuffer(bytes(PAD) + chunk + bytes(PAD), dtype=np.uint8)
+    # newlines, commas, dashes and dots all sort below '0', so one scan of
+    # the buffer finds every separator
+    marks = np.flatnonzero(buf < ZERO)
+    mark_bytes = buf[marks]
+    field_starts, field_stops, num_lines = split_lines(buf, PAD, marks[mark_bytes == NEWLINE],
+                                                       marks[mark_bytes == COMMA])
+
+    def field(k):
+        return buf, field_starts[:, k], field_stops[:, k]
+
+    is_header = fixed_field_equals(*field(SEQUENCE_FIELD), b'sequence')
+    valid = fixed_field_equals(*field(TYPE_FIELD), b'Magnetometer')
+    mac_starts, mac_stops = field_starts[:, MAC_FIELD], field_stops[:, MAC_FIELD]
+    valid &= (mac_stops > mac_starts) & (mac_stops - mac_starts <= MAC_WIDTH)
+    macs = sliding_window_view(buf, MAC_WIDTH)[mac_starts]
+    if np.any(mac_stops - mac_starts != MAC_WIDTH):
+        macs = macs * (np.arange(MAC_WIDTH) < (mac_stops - mac_starts)[:, None])
+    macs = np.ascontiguousarray(macs).view(COLUMNS['mac']).ravel()
+
+    sequence, valid_sequence = parse_integers(*field(SEQUENCE_FIELD), signed=False)
+    rtu_time, valid_time = parse_rtu_time(*field(RTU_TIME_FIELD), marks[mark_bytes == DASH])
+    valid &= valid_sequence & valid_time
+    if source != 'decimal':
+        packets, decodable = decode_packets(*field(RAW_FIELD))
+    if source == 'raw':
+        valid &= decodable
+        columns = {'mac': macs, 'sequence': sequence, 'time': rtu_time}
+        from_packets = packet_columns(packets)
+        for name in ['pod_time'] + list(SENSOR_FIELDS):
+            columns[name] = from_packets[name]
+    else:
+        pod_time, valid_pod_time = parse_floats(*field(POD_TIME_FIELD), valid, marks[mark_bytes == DOT])
+        valid &= valid_pod_time
+        # the sensor columns are parsed together, column k of every line is row k
+        sensor_fields = list(SENSOR_FIELDS.values())
+        sensors, valid_sensors = parse_floats(buf, field_starts[:, sensor_fields].T.ravel(),
+                                              field_stops[:, sensor_fields].T.ravel(),
+                                              np.tile(valid, len(sensor_fields)))
+        sensors = sensors.reshape(len(sensor_fields), -1)
+        valid &= np.all(valid_sensors.reshape(len(sensor_fields), -1), axis=0)
+        columns = {'mac': macs, 'sequence': sequence, 'time': rtu_time, 'pod_time': pod_time}
+        for row, name in enumerate(SENSOR_FIELDS):
+            columns[name] = sensors[row]
+        if source == 'check':
+            columns['raw_mismatch'] = raw_mismatches(columns, packets, decodable)
+
+    if stats is not None:
+        num_headers = int(np.count_nonzero(is_header))
+        stats['lines'] = stats.get('lines', 0) + num_lines
+        stats['headers'] = stats.get('headers', 0) + num_headers
+        stats['rejected'] = stats.get('rejected', 0) + num_lines - num_headers - int(np.count_nonzero(valid))
+    keep = valid
+    if mac is not None:
+        keep = keep & (macs == mac.encode())
+    if keep.all():  # the usual chunk, nothing to drop
+        return columns
+    return {name: values[keep] for name, values in columns.items()}
+
+
+def iter_chunks(file_name, mac=None, chunk_bytes=CHUNK_BYTES, stats=None, source='decimal'):
+    """yields one column dict per chunk_bytes of the file
+
+    chunks are cut at the last newline, the partial line is carried over
+    to the next chunk.  Compressed logs (see CompressedLog) are decompressed
+    on the fly.
+    """
+    carry = b''
+    for data in CompressedLog.read_blocks(file_name, chunk_bytes):
+        block = carry + data
+        cut = block.rfind(b'\n') + 1
+        carry = block[cut:]
+        if cut:  # otherwise no newline yet, keep reading
+            yield parse_chunk(block[:cut], mac, stats, source)
+    if carry:  # the last line may not have a newline
+        yield parse_chunk(carry, mac, stats, source)
+
+
+def read_log(file_name, mac=None, chunk_bytes=CHUNK_BYTES, stats=None, source='decimal'):
+    """whole log file as one column dict"""
+    counts = {}
+    with Instrumentation.stage('parse log'):
+        columns = concatenate_columns(list(iter_chunks(file_name, mac, chunk_bytes, counts, source)))
+    Instrumentation.count('lines read', counts.get('lines', 0))
+    Instrumentation.count('lines rejected', counts.get('rejected', 0))
+    if stats is not None:
+        for name, value in counts.items():
+            stats[name] = stats.get(name, 0) + value
+    return columns
+
+
+def macs_in(columns):
+    """the pods in a column dict, in order of first appearance"""
+    unique, first = np.unique(columns['mac'], return_index=True)
+    return [m.decode() for m in unique[np.argsort(first)]]
+
+
+def to_datetime64(time_us, date=None):
+    """rtu time (microseconds since midnight, past DAY_US after unwrap_times) -> datetime64[us]
+
+    date is a 'YYYY-M-D' string (as in the log file names), without it the
+    times are placed on 1900-01-01 like datetime.strptime does.
+    """
+    if date is None:
+        day = np.datetime64('1900-01-01', 'us')
+    else:
+        year, month, day_of_month = [int(d) for d in date.split('-')]
+        day = np.datetime64(f'{year:04d}-{month:02d}-{day_of_month:02d}', 'us')
+    return day + np.asarray(time_us).astype('timedelta64[us]')
+
+
+def unwrap_times(time_us, reference=None):
+    """rtu times (microseconds since midnight) -> microseconds since midnight of the first day
+
+    the rtu time starts again from 0 at midnight, a step back of more than half
+    a day is taken as passing midnight (smaller steps back are just lines out
+    of order).  reference is the unwrapped time of the line before time_us[0],
+    without it time_us[0] is on the first day.
+    """
+    time_us = np.asarray(time_us, dtype=np.int64)
+    if len(time_us) == 0:
+        return time_us
+    if reference is None:
+        reference = time_us[0]
+    previous = np.empty_like(time_us)
+    previous[0] = reference % DAY_US
+    previous[1:] = time_us[:-1]
+    days = reference // DAY_US + np.cumsum(time_us < previous - DAY_US // 2)
+    return time_us + days * DAY_US
+
+
+def raw_mismatch_report(columns):
+    """one line per sample of a source='check' column dict whose packet disagrees"""
+    report = []
+    for i in np.flatnonzero(columns['raw_mismatch']):
+        mismatch = int(columns['raw_mismatch'][i])
+        if mismatch & RAW_UNDECODABLE:
+            problem = 'raw packet not decodable'
+        else:
+            problem = 'raw packet disagrees on ' + ', '.join(
+                name for bit, name in enumerate(RAW_CHECKS) if mismatch & (1 << bit))
+        report.append(f"{columns['mac'][i].decode()} sequence {columns['sequence'][i]}: {problem}")
+    return report
+
+
+if __name__ == "__main__":
+    import sys
+
+    # python MagnetometerLog.py <log file>: checks the raw packets against the decimal columns
+    stats = {}
+    checked = read_log(sys.argv[1], stats=stats, source='check')
+    for line in raw_mismatch_report(checked):
+        print(line)
+    print(f"{len(checked['mac'])} samples, {np.count_nonzero(checked['raw_mismatch'])} with a bad raw packet "
+          f"({stats['lines']} lines, {stats['headers']} headers, {stats['rejected']} rejected)")
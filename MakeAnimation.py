@@ -1 +1,307 @@
-import pandas as pd
+"""
+Plays the pump cards of a log as an animated GIF (or a video, through ffmpeg),
+one card per frame with a fading trail of the cards before it.
+
+Usage is:
+
+python MakeAnimation.py Whitecap_2019-3-24_pumpcards.log --output whitecap.gif --trail 10 --fps 25
+
+or render_animation(cards, output_file, ...) with cards from PumpCardLog.read_cards.
+
+Every frame is drawn with the same trail + 1 Line2D artists: the axes, ticks
+and labels are drawn once into a background that is restored for every frame
+(blitting), and only the line data and the time stamp change, so a frame costs
+a few draw_artist calls instead of a new plot.
+
+The frames are cut into segments of SEGMENT_FRAMES, rendered on a process pool
+with each worker drawing on its own Figure.
+
+* .gif: the workers map the frames to one fixed palette (see gif_palette) and
+  LZW encode only the pixels that changed since the frame before (see
+  gif_frame); the main process writes the encoded frames to the file in order
+  as they come back.
+* any other name (.mp4, .webm, ...): every worker pipes its frames to an ffmpeg
+  of its own, and the segments are joined without encoding them again.
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+import Instrumentation
+import PumpCardLog
+import RenderCards
+import TimeIndex
+
+TRAIL_CARDS = 10
+FPS = 25
+SEGMENT_FRAMES = 250
+FIGURE_INCHES = (8, 6)
+DPI = 100  # 800 x 600 frames, H.264 needs even sizes
+CURRENT_COLOR = (0.839, 0.153, 0.157)  # tab:red
+TRAIL_COLOR = (0.122, 0.467, 0.706)  # tab:blue
+RAMP_COLORS = 85  # gif palette entries from white to each of black, CURRENT_COLOR and TRAIL_COLOR
+TRANSPARENT = 255  # gif palette entry of the pixels that didn't change since the frame before
+
+
+def frame_size():
+    """(width, height) of a frame in pixels"""
+    return int(FIGURE_INCHES[0] * DPI), int(FIGURE_INCHES[1] * DPI)
+
+
+def axis_limits(values):
+    """(low, high) of all the values with a 5% margin"""
+    low, high = float(values.min()), float(values.max())
+    margin = 0.05 * (high - low) or 1.0
+    return low - margin, high + margin
+
+
+def gif_palette():
+    """flat RGB list of the palette every gif frame is mapped to
+
+    antialiasing and the trail's alpha only blend the line colors with the
+    white background, so ramps from white to the colors drawn cover the frames
+    """
+    steps = np.linspace(0, 1, RAMP_COLORS)[:, np.newaxis]
+    ramps = [1 - steps * (1 - np.array(color)) for color in ((0, 0, 0), CURRENT_COLOR, TRAIL_COLOR)]
+    rgb = np.round(np.concatenate(ramps) * 255).astype(np.uint8)
+    return np.concatenate([rgb, np.zeros((256 - len(rgb), 3), dtype=np.uint8)]).ravel().tolist()
+
+
+def palette_image(size=(1, 1)):
+    from PIL import Image
+
+    image = Image.new('P', size)
+    image.putpalette(gif_palette())
+    return image
+
+
+def gif_header(fps):
+    """GIF header, global palette and loop forever extension"""
+    from PIL import GifImagePlugin
+
+    header, _ = GifImagePlugin.getheader(palette_image(frame_size()), info={'loop': 0, 'duration': 1000 // fps})
+    return b''.join(header)
+
+
+def gif_frame(rgba, previous, palette, duration_ms):
+    """(GIF bytes, palette indices) of a frame, previous is the palette indices of the frame before
+
+    only the rectangle that changed since previous is encoded, and the pixels
+    in it that didn't change are set to TRANSPARENT (so they show the frame
+    before), which LZW packs into almost nothing
+    """
+    from PIL import GifImagePlugin, Image
+
+    indices = np.asarray(Image.fromarray(rgba).convert('RGB').quantize(palette=palette, dither=0))
+    indices = np.where(indices < 3 * RAMP_COLORS, indices, RAMP_COLORS - 1)  # the padding entries are black too
+    top, left = 0, 0
+    changes = indices
+    if previous is not None:
+        changed = indices != previous
+        rows = np.flatnonzero(changed.any(axis=1))
+        columns = np.flatnonzero(changed.any(axis=0))
+        if len(rows):
+            top, bottom, left, right = rows[0], rows[-1] + 1, columns[0], columns[-1] + 1
+        else:  # the same picture, one pixel keeps the frame's time
+            bottom, right = 1, 1
+        changes = np.where(changed, indices, TRANSPARENT)[top:bottom, left:right]
+    image = Image.fromarray(np.ascontiguousarray(changes, dtype=np.uint8), 'P')
+    image.putpalette(palette.getpalette())
+    data = GifImagePlugin.getdata(image, offset=(int(left), int(top)), duration=duration_ms,
+                                  transparency=TRANSPARENT, disposal=1)
+    return b''.join(data), indices
+
+
+def ffmpeg_command(output_file, fps):
+    """ffmpeg reading RGBA frames from stdin, the codec follows from the name of output_file"""
+    width, height = frame_size()
+    return ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgba',
+            '-s', f'{width}x{height}', '-r', str(fps), '-i', 'pipe:', '-pix_fmt', 'yuv420p', output_file]
+
+
+def join_segments(segment_files, output_file, temp_dir):
+    """joins video segments with ffmpeg's concat demuxer, without encoding again"""
+    list_file = os.path.join(temp_dir, 'segments.txt')
+    with open(list_file, 'w') as f:
+        f.writelines(f"file '{segment_file}'\n" for segment_file in segment_files)
+    subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_file,
+                    '-c', 'copy', output_file], check=True)
+
+
+def animation_figure(limits, trail):
+    """(canvas, ax, lines, time label, background) of an empty frame
+
+    lines are the Line2D of the oldest trail card first and the current card
+    last (drawn on top), background is the frame without them
+    """
+    # matplotlib is imported by the first segment (of each worker), not by importing this module
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=FIGURE_INCHES, dpi=DPI)
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    ax.set_xlim(*limits[0])
+    ax.set_ylim(*limits[1])
+    ax.set_xlabel("Position")
+    ax.set_ylabel("Load")
+    lines = []
+    for age in range(trail, -1, -1):
+        line, = ax.plot([], [], color=TRAIL_COLOR if age else CURRENT_COLOR, alpha=1 - age / (trail + 1),
+                        linewidth=1 if age else 2, animated=True)
+        lines.append(line)
+    label = ax.text(0.02, 0.97, '', transform=ax.transAxes, verticalalignment='top', animated=True)
+    canvas.draw()
+    return canvas, ax, lines, label, canvas.copy_from_bbox(fig.bbox)
+
+
+def draw_frame(figure, positions, loads, current, text):
+    """draws card current with the cards before it as its trail, returns the (H, W, 4) RGBA frame
+
+    the frame is a view of the canvas buffer, it changes with the next frame
+    """
+    canvas, ax, lines, label, background = figure
+    canvas.restore_region(background)
+    for age, line in zip(range(len(lines) - 1, -1, -1), lines):
+        if current - age >= 0:  # the first cards of the animation have a shorter trail
+            line.set_data(positions[current - age], loads[current - age])
+            ax.draw_artist(line)
+    label.set_text(text)
+    ax.draw_artist(label)
+    return np.asarray(canvas.buffer_rgba())
+
+
+def render_segment(positions, loads, labels, before, limits, trail, fps, segment_file=None):
+    """renders the cards from row before on (the rows before it are only trail)
+
+    returns (gif bytes of every frame, or None when the segment went to
+    segment_file through ffmpeg, seconds drawing, seconds encoding)
+    """
+    figure = animation_figure(limits, trail)
+    draw_s = encode_s = 0.0
+    encoded = None if segment_file else []
+    if segment_file:
+        ffmpeg = subprocess.Popen(ffmpeg_command(segment_file, fps), stdin=subprocess.PIPE)
+    else:
+        palette = palette_image()
+        previous = None
+    for current in range(before, len(labels)):
+        start = time.perf_counter()
+        rgba = draw_frame(figure, positions, loads, current, labels[current])
+        encoding = time.perf_counter()
+        if segment_file:
+            ffmpeg.stdin.write(rgba.data)
+        else:
+            frame, previous = gif_frame(rgba, previous, palette, 1000 // fps)
+            encoded.append(frame)
+        draw_s += encoding - start
+        encode_s += time.perf_counter() - encoding
+    if segment_file:
+        ffmpeg.stdin.close()
+        if ffmpeg.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed writing {segment_file}")
+    return encoded, draw_s, encode_s
+
+
+def write_segments(segments, output_file, jobs, fps, temp_dir):
+    """writes the output of render_segment for every job to output_file, returns (seconds drawing, encoding)
+
+    gif frames are written as the segments come back, in order, so only the
+    encoded frames of the segments that are done but not yet written are held
+    """
+    draw_s = encode_s = 0.0
+    if not output_file.lower().endswith('.gif'):
+        for _, segment_draw_s, segment_encode_s in segments:
+            draw_s += segment_draw_s
+            encode_s += segment_encode_s
+        join_segments([job[-1] for job in jobs], output_file, temp_dir)
+        return draw_s, encode_s
+    temp_file = os.path.join(temp_dir, 'animation.gif')
+    with open(temp_file, 'wb') as f:
+        f.write(gif_header(fps))
+        for frames, segment_draw_s, segment_encode_s in segments:
+            f.writelines(frames)
+            draw_s += segment_draw_s
+            encode_s += segment_encode_s
+        f.write(b';')  # GIF trailer
+    os.replace(temp_file, output_file)
+    return draw_s, encode_s
+
+
+@Instrumentation.staged('render animation')
+def render_animation(cards, output_file, start_hour=0, duration=24, trail=TRAIL_CARDS, fps=FPS, processes=None,
+                     date=None):
+    """renders the cards in the hour window (see RenderCards) to output_file, returns the number of frames
+
+    output_file is a .gif, or a video ffmpeg can write.  processes is the size
+    of the process pool (None for one per CPU, 1 to render in this process).
+    The window's hours are counted from date, the log's 'YYYY-M-D' (see
+    RenderCards.hour_window).
+    """
+    video = not output_file.lower().endswith('.gif')
+    if video and shutil.which('ffmpeg') is None:
+        raise RuntimeError(f"writing {output_file} needs ffmpeg on the PATH, a .gif name doesn't")
+    indices = RenderCards.cards_in_window(cards.times, start_hour, duration, date)
+    if len(indices) == 0:
+        return 0
+    positions = PumpCardLog.smooth_cards(cards.positions[indices])
+    loads = PumpCardLog.smooth_cards(cards.loads[indices])
+    labels = [t.strftime("%Y-%m-%d %H:%M:%S") for t in cards.times[indices].astype(datetime)]
+    limits = (axis_limits(positions), axis_limits(loads))
+
+    output_dir = os.path.dirname(os.path.abspath(output_file))
+    with tempfile.TemporaryDirectory(dir=output_dir) as temp_dir:
+        jobs = []
+        for first in range(0, len(indices), SEGMENT_FRAMES):
+            start = max(first - trail, 0)  # the trail of the segment's first card comes along
+            stop = first + SEGMENT_FRAMES
+            segment_file = os.path.join(temp_dir, f'{first:08d}{os.path.splitext(output_file)[1]}') if video else None
+            jobs.append((positions[start:stop], loads[start:stop], labels[start:stop], first - start,
+                         limits, trail, fps, segment_file))
+
+        if processes == 1 or len(jobs) < 2:
+            draw_s, encode_s = write_segments(map(render_segment, *zip(*jobs)), output_file, jobs, fps, temp_dir)
+        else:
+            with ProcessPoolExecutor(processes) as pool:
+                draw_s, encode_s = write_segments(pool.map(render_segment, *zip(*jobs)), output_file, jobs, fps,
+                                                  temp_dir)
+    # drawing and encoding happen in the workers, only their wall times come back
+    Instrumentation.add('animation: draw', draw_s, calls=len(jobs))
+    Instrumentation.add('animation: encode', encode_s, calls=len(jobs))
+    Instrumentation.count('frames rendered', len(indices))
+    return len(indices)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Animate the pump cards of a *_pumpcards.log")
+    parser.add_argument('log_file')
+    parser.add_argument('--output', help="a .gif, or a video ffmpeg can write (.mp4, ...); "
+                                         "defaults to <site>_<date>.gif")
+    parser.add_argument('--start-hour', type=int, default=0)
+    parser.add_argument('--duration', type=int, default=24, help="hours after the start hour")
+    parser.add_argument('--trail', type=int, default=TRAIL_CARDS, help="earlier cards shown fading out")
+    parser.add_argument('--fps', type=int, default=FPS)
+    parser.add_argument('--processes', type=int, help="defaults to one per CPU")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    date = PumpCardLog.date_from_file_name(args.log_file)
+    cards = TimeIndex.read_card_window(args.log_file, args.start_hour, args.start_hour + args.duration + 1, date)
+    output = args.output or f"{PumpCardLog.site_from_file_name(args.log_file)}_{date}.gif"
+    frames = render_animation(cards, output, args.start_hour, args.duration, args.trail, args.fps, args.processes,
+                              date)
+    seconds = time.perf_counter() - start
+    print(f"{frames} frames ({frames / args.fps:.0f} s at {args.fps} fps) in {output} in {seconds:.2f} s "
+          f"({frames / seconds:.1f} frames/s)")
+
+
+if __name__ == "__main__":
+    main()
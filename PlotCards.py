@@ -1,11 +1,13 @@
+"""
+The GUI: a thin pyforms shell over the processing modules, which don't import
+any GUI toolkit and can be used on their own (see RenderCards, BatchAnalysis,
+FollowLog).  matplotlib is only imported, with the Qt backend, when the first
+rotator plot is shown; pump cards are rendered by RenderCards (and animated by
+MakeAnimation) without pyplot.
+"""
+
 import os
-import statistics
-import time
-from datetime import datetime
 
-import matplotlib
-import matplotlib.pyplot as plt
-import numpy as np
 import pyforms
 from pyforms.basewidget import BaseWidget
 from pyforms.controls import ControlButton
@@ -13,11 +15,19 @@ from pyforms.controls import ControlCheckBox
 from pyforms.controls import ControlCombo
 from pyforms.controls import ControlFile
 from pyforms.controls import ControlText
-from scipy.ndimage import gaussian_filter1d
-
+from pyforms.controls import ControlTextArea
+
+import CompressedLog
+import DataQuality
+import Instrumentation
+import LogCache
+import MakeAnimation
+import MagnetometerLog
+import PlotDecimation
+import PumpCardLog
+import RenderCards
 import RotationDetection
-
-matplotlib.use('Agg')
+import SampleStore
 
 
 ### Gui code
@@ -32,7 +42,7 @@ class Hawkiiiiplotter(BaseWidget):
         self._mode_selector.add_item("")
         self._mode_selector.add_item("Rod Rotator", "0")
         self._mode_selector.add_item("Pump Cards", "1")
-        # self._mode_selector.add_item("Pump Animation", "2")
+        self._mode_selector.add_item("Pump Animation", "2")
 
         # Save vs View (matplotlib)
         self._submit_mode = ControlButton('Start Analysis')
@@ -45,13 +55,21 @@ class Hawkiiiiplotter(BaseWidget):
         self._cards_per_graph = ControlText('Cards Per Graph', default="5")
         self._time_between_cards = ControlText('Time Between Cards', '0')
         self._generate_cards = ControlButton('Generate Cards')
+        self._trail_cards = ControlText('Trail (cards)', default=str(MakeAnimation.TRAIL_CARDS))
+        self._make_animation = ControlButton('Make Animation')
 
         # Definition of the Rod Rotator fields
         self._testfile_magnetometer = ControlFile('File Name')
         self._save_selector = ControlCheckBox("Save Graphs")
         self._use_algorithm = ControlCheckBox("Process with algorithm")
+        self._skip_repeats = ControlCheckBox("Skip repeated magnetometer readings")
+        self._retention_hours = ControlText('Keep (hours per pod)', default="48")
         self._generate_plots = ControlButton('Generate Plots')
 
+        # Run report of either mode
+        self._profile_run = ControlCheckBox("Profile run")
+        self._run_summary = ControlTextArea('Run report')
+
         # Hide the menu items
         self._testfile.hide()
         self._time_start_hour.hide()
@@ -60,27 +78,28 @@ class Hawkiiiiplotter(BaseWidget):
         self._cards_per_graph.hide()
         self._time_between_cards.hide()
         self._generate_cards.hide()
+        self._trail_cards.hide()
+        self._make_animation.hide()
         self._save_selector.hide()
         self._generate_plots.hide()
         self._testfile_magnetometer.hide()
         self._use_algorithm.hide()
-
-        self.pos_lines = {}
-        self.load_lines = {}
-        self.average_load = {}
-        self.load_standard_deviation = {}
-        self.accel = []
-        self.magx = []
-        self.magy = []
-        self.magz = []
-        self.time = []
-        self.rotating = []
-        self.moving = []
+        self._skip_repeats.hide()
+        self._retention_hours.hide()
+        self._profile_run.hide()
+        self._run_summary.hide()
+
+        self.cards = None  # PumpCardLog.PumpCards
+        self.average_load = None  # per card, same order as self.cards
+        self.load_standard_deviation = None
+        self.samples = None  # SampleStore.SampleStore of the rotator log on show
+        self.decimated = {}  # PlotDecimation.DecimatedPlot per open figure, kept alive for its zoom callbacks
         self.date_stamp = None
 
         # self._testfile.changed_event = self.__make_dictionaries #Doesnt allow reset...
         # self._testfile_magnetometer.changed_event = self.__make_dictionaries_magnetometer
         self._generate_cards.value = self.__make_cards
+        self._make_animation.value = self.__make_animation
         self._submit_mode.value = self.__menu_view
         self._generate_plots.value = self.__plot_log_file
 
@@ -93,134 +112,84 @@ class Hawkiiiiplotter(BaseWidget):
             self._cards_per_graph.show()
             # self._time_between_cards.show()
             self._generate_cards.show()
+            self._profile_run.show()
+            self._run_summary.show()
             self._mode_selector.hide()
             self._save_selector.hide()
             self._submit_mode.hide()
+        elif self._mode_selector.value == "2":  # pump card animation
+            self._testfile.show()
+            self._time_start_hour.show()
+            self._duration.show()
+            self._trail_cards.show()
+            self._make_animation.show()
+            self._profile_run.show()
+            self._run_summary.show()
+            self._mode_selector.hide()
+            self._submit_mode.hide()
         elif self._mode_selector.value == "0":  # rr plot generator
             self._testfile_magnetometer.show()
             # self._save_selector.show() #not incorporated yet...
-            self._use_algorithm.hide()
+            self._use_algorithm.show()
+            self._skip_repeats.show()
+            self._retention_hours.show()
             self._generate_plots.show()
+            self._profile_run.show()
+            self._run_summary.show()
             self._mode_selector.hide()
             self._submit_mode.hide()
         else:
             pass
 
     def __make_dictionaries(self):
-        if self._testfile == "":
-            pass
-        else:
-            fn = self._testfile.value
-            filename = self._testfile.value.split("/")[-1]
-            self.date_stamp = filename.split("_")[-2]
-            if fn is "":
-                pass
-            else:
-                with open(fn, 'r') as f:
-                    all_lines = f.readlines()
-                for line in all_lines:
-                    if 'position' in line:
-                        if len(line)
-                        print("position: " + str(len(line)))
-                        # split_line = [s.strip() for s in line.split(",")[:2]]
-                        # split_line_values = [float(s.strip()) for s in line.split(",")[2:]]
-                        # time_stamp = split_line[1]
-                        # datetime_str = str(self.date_stamp + " " + time_stamp)
-                        # datetime_object = datetime.strptime(datetime_str, '20%y-%m-%d %H:%M:%S:%f')
-                        # readable_time = datetime_object.strftime("%H:%M:%S")
-                        # # if int(time_start_hour) <= int(datetime_object.hour) <= int(time_stop_hour):
-                        # self.pos_lines[readable_time] = split_line_values[:]
-                        # self._generate_cards.show()
-
-                    if 'load' in line:
-                        print("load: " + str(len(line)))
-
-                        # split_line = [s.strip() for s in line.split(",")[:2]]
-                        # split_line_values = [float(s.strip()) for s in line.split(",")[2:]]
-                        # time_stamp = split_line[1]
-                        # datetime_str = str(self.date_stamp + " " + time_stamp)
-                        # datetime_object = datetime.strptime(datetime_str, '20%y-%m-%d %H:%M:%S:%f')
-                        # readable_time = datetime_object.strftime("%H:%M:%S")
-                        # load_avg = statistics.mean(split_line_values)
-                        # load_std = statistics.stdev(split_line_values)
-                        # self.average_load[readable_time] = load_avg
-                        # self.load_standard_deviation[readable_time] = load_std
-                        # # if int(time_start_hour) <= int(datetime_object.hour) <= int(time_stop_hour):
-                        # self.load_lines[readable_time] = split_line_values[:]
-                        # self._generate_cards.show()
-
-    def __make_dictionaries_magnetometer(self):
-        if self._testfile == "":
+        fn = self._testfile.value
+        if fn == "":
             pass
         else:
-            fn = self._testfile_magnetometer.value
-            filename = self._testfile_magnetometer.value.split("/")[-1]
-            self.date_stamp = filename.split("_")[-1][:-4]
-            if fn is "":
-                pass
-            else:
-                with open(fn, 'r') as f:
-                    all_lines = f.readlines()
-                for line in all_lines:
-                    if 'Magnetometer' in line:
-                        if 'sequence' not in line:
-                            split_line = [s.strip() for s in line.split(",")]
-                            split_line_values = [float(s.strip()) for s in line.split(",")[5:]]
-                            time_stamp_rtu = split_line[4]
-                            accely = split_line_values[1]
-                            magz = split_line_values[4]
-                            datetime_object = datetime.strptime(time_stamp_rtu, '%H-%M-%S-%f')
-                            readable_time = datetime_object.strftime("%H:%M:%S")
-                            self.magz_lines[datetime_object] = magz
-                            self.accely_lines[datetime_object] = accely
+            self.date_stamp = PumpCardLog.date_from_file_name(fn)
+            self.cards = LogCache.load_cards(fn, self.date_stamp)
+            for line_number, time_stamp, reason in self.cards.problems:
+                print(f"line {line_number} ({time_stamp}): {reason}")
+            self.average_load, self.load_standard_deviation = PumpCardLog.card_statistics(self.cards.loads)
+
+    def __start_run(self, log_file_name):
+        Instrumentation.start(os.path.basename(log_file_name), profile=self._profile_run.value is True,
+                              trace_memory=self._profile_run.value is True)
+
+    def __finish_run(self, log_file_name, notes=None):
+        """saves the run report next to the log and shows its summary (and the notes)"""
+        report = Instrumentation.finish(f"{log_file_name}.report.json")
+        text = Instrumentation.summary(report)
+        if notes:
+            text = f"{notes}\n{text}"
+        print(text)
+        self._run_summary.value = text
 
     def __make_cards(self):
-        self.__make_dictionaries()
-        first_card_series = True
-        card_counter = 0
-        legend_list = []
-        log_name = self._testfile.value
-        log_name = log_name.split("/")[-1]
-        self._testfile = log_name.split("_")[0]
-        if not os.path.exists(self._testfile):
-            os.mkdir(self._testfile)
-
-        for filename in os.listdir(self._testfile):
-            if filename.endswith('.png'):
-                os.unlink(self._testfile + "/" + filename)
-
-        for i, t in enumerate(self.pos_lines.keys()):
-            # self._generate_cards.hide()
-            if card_counter == int(self._cards_per_graph.value):
-                plt.xlabel("Position")
-                plt.ylabel("Load")
-                plt.legend(legend_list, loc='center left', bbox_to_anchor=(1, 0.5))
-                plt.savefig(f'Whitecap/{plot_title}.png', bbox_inches='tight')
-                plt.clf()
-                legend_list.clear()
-                card_counter = 0
-                first_card_series = True
-
-            if len(self.pos_lines[t]) == 128 and len(self.load_lines[t]) == 128:
-                datetime_str = str(self.date_stamp + " " + t)
-                datetime_object = datetime.strptime(datetime_str, '20%y-%m-%d %H:%M:%S')
-                readable_time = datetime_object.strftime("20%y-%m-%d %H:%M:%S")
-                if first_card_series:
-                    plot_title = t
-                    first_card_series = False
-                if int(self._time_start_hour.value) <= int(datetime_object.hour) <= (int(
-                        self._time_start_hour.value) + int(self._duration.value)):
-                    load_smoothed = gaussian_filter1d(self.load_lines[t], sigma=1.2)
-                    position_smoothed = gaussian_filter1d(self.pos_lines[t], sigma=1.2)
-                    position_smoothed = np.append(position_smoothed, position_smoothed[0])
-                    load_smoothed = np.append(load_smoothed, load_smoothed[0])
-                    plt.plot(position_smoothed, load_smoothed)
-                    legend_list.append(readable_time)
-                    card_counter += 1
+        self.__start_run(self._testfile.value)
+        try:
+            self.__make_dictionaries()
+            output_dir = PumpCardLog.site_from_file_name(self._testfile.value)
+            graphs, drawn = RenderCards.render_cards(self.cards, output_dir, int(self._time_start_hour.value),
+                                                     int(self._duration.value), int(self._cards_per_graph.value),
+                                                     date=self.date_stamp)
+            print(f"{graphs} graphs in {output_dir}, {drawn} new or changed cards drawn")
+        finally:  # a failed run still stops the profilers
+            self.__finish_run(self._testfile.value)
+
+    def __make_animation(self):
+        self.__start_run(self._testfile.value)
+        try:
+            self.__make_dictionaries()
+            output_file = f"{PumpCardLog.site_from_file_name(self._testfile.value)}_{self.date_stamp}.gif"
+            frames = MakeAnimation.render_animation(self.cards, output_file, int(self._time_start_hour.value),
+                                                    int(self._duration.value), int(self._trail_cards.value),
+                                                    date=self.date_stamp)
+            print(f"{frames} frames in {output_file}")
+        finally:
+            self.__finish_run(self._testfile.value)
 
     def __plot_log_file(self):
-        matplotlib.use("Qt5Agg")
-
         """plots a "log" file with a specific name format - and data format.  
 
         example log_file_name is CRC5_2019-3-20_554_minutes.log
@@ -232,69 +201,74 @@ class Hawkiiiiplotter(BaseWidget):
 
         TODO: deal with the 
         """
-        # if self._use_algorithm.value is True:
-        #     RotationDetection.init()
+        import matplotlib
+
+        matplotlib.use("Qt5Agg")  # before pyplot is first imported
+        import matplotlib.pyplot as plt
+
         log_file_name = self._testfile_magnetometer.value
-        split_name = os.path.basename(log_file_name).split("_")
-        crc_name = split_name[0]
-        date_part = split_name[1][:-4]
-        print(date_part)
-        year, month, day = [int(d) for d in date_part.split("-")]
-
-        with open(log_file_name, 'r') as f:
-            all_lines = f.readlines()
-        for line in all_lines:
-            if "CD:2C:9A:5E:B2:98" in line:
-                if "sequence" not in line:
-                    if len(line) > 100:
-                        line = line.split(',')
-                        time_string = line[4]
-                        time_pod = float(line[5])
-                        accel_y = float(line[6])
-                        mag_x = float(line[7])
-                        mag_y = float(line[8])
-                        mag_z = float(line[9])
-                        datetime_object = datetime.strptime(time_string, '%H-%M-%S-%f')
-                        self.time.append(datetime_object)
-                        self.accel.append(accel_y)
-                        self.magx.append(mag_x)
-                        self.magy.append(mag_y)
-                        self.magz.append(mag_z)
-                        # if self._use_algorithm.value is True:
-                        #     RotationDetection.process(mag_x, mag_y, mag_z, time_pod)
-                        #     if RotationDetection.currently_moving():
-                        #         self.moving.append(1)
-                        #     else:
-                        #         self.moving.append(0)
-                        #     if RotationDetection.currently_rotating():
-                        #         self.rotating.append(1)
-                        #     else:
-                        #         self.rotating.append(0)
-
-        fig, ax = plt.subplots(nrows=3, ncols=1, sharex=True)
-        ax[0].plot(self.time, self.magx, label='X')
-        ax[0].plot(self.time, self.magy, label='Y')
-        ax[0].plot(self.time, self.magz, label='Z')
-        ax[0].legend()
-        ax[0].grid()
-        ax[0].set_ylabel("magnetometer")
-        ax[0].set_title(log_file_name)
-
-        ax[1].plot(self.time, self.accel)
-        ax[1].set_ylabel("accelerometer")
-        ax[1].grid()
-        ax[1].set_xlabel('Edmonton Time')
-
-        # ax[2].plot(self.time, self.rotating, label='rotating')
-        # ax[2].plot(self.time, self.moving, label='moving')
-        # ax[2].legend()
-        # ax[2].grid()
-        # ax[2].set_ylabel("Algorithm")
-        # ax[2].set_xlabel('Edmonton Time')
-        # ax[2].set_title(log_file_name)
-
-        fig.tight_layout()
-        fig.show()
+        self.__start_run(log_file_name)
+        quality = None
+        try:
+            split_name = CompressedLog.log_name(log_file_name).split("_")
+            crc_name = split_name[0]
+            date_part = split_name[1][:-4]
+            print(date_part)
+            year, month, day = [int(d) for d in date_part.split("-")]
+
+            # a new store per log, the previous log's samples are let go (its figures stay open)
+            self.samples = SampleStore.SampleStore(float(self._retention_hours.value) * 3600)
+            columns = LogCache.load_log(log_file_name)
+            # past midnight the rtu time starts from 0 again, the store's retention needs it to keep going up
+            columns = dict(columns, time=MagnetometerLog.unwrap_times(columns['time']))
+            flags = DataQuality.flag_samples(columns)
+            quality = DataQuality.report_text(DataQuality.quality_report(columns))
+            if self._use_algorithm.value is True and self._skip_repeats.value is True:
+                # the detector only sees new readings, repeated rows take the indicators of the reading
+                moving, rotating = DataQuality.detect_deduplicated(columns, flags)
+                columns = dict(columns, moving=moving, rotating=rotating)
+            packets = DataQuality.accel_rows(flags)  # packets logged twice are dropped
+            self.samples.append({name: values[packets] for name, values in columns.items()})
+            if self._use_algorithm.value is True and self._skip_repeats.value is not True:
+                for mac in self.samples.macs():
+                    # same result as RotationDetection.process() on every packet
+                    self.samples.detect(mac)
+
+            with Instrumentation.stage('plot'):
+                for mac in self.samples.macs():
+                    samples = self.samples.samples(mac)
+                    time_stamps = MagnetometerLog.to_datetime64(samples['time'], date_part)
+                    fig, ax = plt.subplots(nrows=3, ncols=1, sharex=True)
+                    # a day is millions of samples per line, draw min/max per pixel instead
+                    decimated = self.decimated[fig] = PlotDecimation.DecimatedPlot()
+                    fig.canvas.mpl_connect('close_event', lambda event, fig=fig: self.decimated.pop(fig, None))
+                    decimated.plot(ax[0], time_stamps, samples['mag_x'], label='X')
+                    decimated.plot(ax[0], time_stamps, samples['mag_y'], label='Y')
+                    decimated.plot(ax[0], time_stamps, samples['mag_z'], label='Z')
+                    ax[0].legend()
+                    ax[0].grid()
+                    ax[0].set_ylabel("magnetometer")
+                    ax[0].set_title(f"{log_file_name} ({mac})")
+
+                    decimated.plot(ax[1], time_stamps, samples['accel_y'])
+                    ax[1].set_ylabel("accelerometer")
+                    ax[1].grid()
+                    ax[1].set_xlabel('Edmonton Time')
+
+                    if self._use_algorithm.value is True:
+                        decimated.plot(ax[2], time_stamps, samples['rotating'] == RotationDetection.Indicator.YES,
+                                       label='rotating')
+                        decimated.plot(ax[2], time_stamps, samples['moving'] == RotationDetection.Indicator.YES,
+                                       label='moving')
+                        ax[2].legend()
+                        ax[2].grid()
+                        ax[2].set_ylabel("Algorithm")
+                        ax[2].set_xlabel('Edmonton Time')
+
+                    fig.tight_layout()
+                    fig.show()
+        finally:
+            self.__finish_run(log_file_name, quality)
 
     # Execute the application
 
@@ -0,0 +1,89 @@
+"""
+Min/max decimation of long time series for plotting.
+
+A day of magnetometer samples is millions of points per line, far more than the
+axes has pixels.  Each line is cut into one bucket per horizontal pixel and only
+the minimum and maximum sample of each bucket are drawn, so spikes survive and
+the picture is the same as plotting everything.  When the x range changes
+(zoom, pan) the visible part is decimated again from the full data.
+
+Usage is:
+
+decimated = DecimatedPlot()
+decimated.plot(ax, time, mag_x, label='X')    # instead of ax.plot(time, mag_x, label='X')
+
+Keep a reference to decimated for as long as the figure is shown.
+"""
+
+import numpy as np
+
+
+def min_max_indices(values, buckets):
+    """sorted indices of the first, last, and the min and max of each of buckets equal runs of values"""
+    count = len(values)
+    if count <= 2 * buckets + 2:
+        return np.arange(count)
+    size = -(-count // buckets)
+    full = count // size
+    blocks = values[:full * size].reshape(full, size)
+    offsets = np.arange(full) * size
+    picks = [blocks.argmin(axis=1) + offsets, blocks.argmax(axis=1) + offsets, [0, count - 1]]
+    if full * size < count:
+        tail = values[full * size:]
+        picks.append([full * size + tail.argmin(), full * size + tail.argmax()])
+    return np.unique(np.concatenate(picks))
+
+
+class DecimatedPlot:
+    """plots lines decimated to the axes' width, redone for the visible range on xlim_changed"""
+
+    __slots__ = ('lines', 'connected', 'converted')
+
+    def __init__(self):
+        self.lines = {}  # axes -> [[Line2D, x, y, x in axis units (None if not sorted), last range]]
+        self.connected = set()
+        self.converted = {}  # id(x) -> (x, x in axis units), shared by the lines plotted against the same x
+
+    def plot(self, ax, x, y, **kwargs):
+        """like ax.plot(x, y, **kwargs) for a single line, returns the Line2D"""
+        x = np.asarray(x)
+        y = np.asarray(y)
+        indices = min_max_indices(y, self.buckets(ax))
+        line, = ax.plot(x[indices], y[indices], **kwargs)
+        if id(x) in self.converted:
+            x_units = self.converted[id(x)][1]
+        else:
+            x_units = np.asarray(ax.convert_xunits(x), dtype=np.float64)
+            if np.any(x_units[1:] < x_units[:-1]):
+                x_units = None
+            self.converted[id(x)] = (x, x_units)  # x is kept so its id isn't reused
+        self.lines.setdefault(ax, []).append([line, x, y, x_units, None])
+        if ax not in self.connected:
+            ax.callbacks.connect('xlim_changed', self.update)
+            self.connected.add(ax)
+        return line
+
+    @staticmethod
+    def buckets(ax):
+        """one bucket per pixel of the axes width"""
+        return max(int(ax.bbox.width), 1)
+
+    def update(self, ax):
+        """re-decimates the lines of ax (and the axes sharing its x) to the visible range"""
+        for shared_ax in ax.get_shared_x_axes().get_siblings(ax):
+            low, high = shared_ax.get_xlim()
+            buckets = self.buckets(shared_ax)
+            for entry in self.lines.get(shared_ax, ()):
+                line, x, y, x_units, last_range = entry
+                if last_range == (low, high, buckets):
+                    continue
+                entry[4] = (low, high, buckets)
+                if x_units is None:
+                    start, stop = 0, len(x)
+                else:
+                    # one sample beyond each edge so the line runs off the axes
+                    start = max(np.searchsorted(x_units, low, 'left') - 1, 0)
+                    stop = min(np.searchsorted(x_units, high, 'right') + 1, len(x))
+                indices = start + min_max_indices(y[start:stop], buckets)
+                line.set_data(x[indices], y[indices])
+            shared_ax.figure.canvas.draw_idle()
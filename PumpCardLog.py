@@ -0,0 +1,177 @@
+"""
+Reader for pump card log files (*_pumpcards.log).
+
+Each card (stroke) is a pair of lines sharing a time stamp
+
+position,H:M:S:us,v1,...,v128
+load,H:M:S:us,v1,...,v128
+
+Usage is:
+
+* cards = read_cards(file_name, date)
+    ** cards.times is a datetime64[us] vector, one entry per card
+    ** cards.positions and cards.loads are contiguous (N, POINTS_PER_CARD) float arrays,
+       row i of each belongs to the same stroke
+    ** cards.problems lists the strokes that couldn't be paired, with the reason
+* mean, std = card_statistics(cards.loads) for per-card load statistics
+* smooth_cards(cards.positions) / smooth_cards(cards.loads) for closed, plot ready strokes
+
+Cards are paired on the full (microsecond) time stamp, so two cards in the same
+second don't collide.  A gzip, xz or zstd compressed log (a .gz, .xz or .zst
+name) is decompressed as it is read, see CompressedLog.
+"""
+
+import numpy as np
+
+import CompressedLog
+import Instrumentation
+import MagnetometerLog
+
+PARSER_VERSION = 1  # bump when read_cards changes, it invalidates LogCache entries
+POINTS_PER_CARD = 128
+SMOOTHING_SIGMA = 1.2
+
+
+class PumpCards:
+    """cards read from a pump card log"""
+
+    __slots__ = ('times', 'positions', 'loads', 'problems')
+
+    def __init__(self, times, positions, loads, problems):
+        self.times = times
+        self.positions = positions
+        self.loads = loads
+        self.problems = problems
+
+    def __len__(self):
+        return len(self.times)
+
+
+def parse_card_time(time_string):
+    """'H:M:S:us' (not zero padded) -> microseconds since midnight"""
+    hours, minutes, seconds, microseconds = [int(part) for part in time_string.split(':')]
+    return ((hours * 60 + minutes) * 60 + seconds) * 10 ** 6 + microseconds
+
+
+def range_lines(file_name, start=0, stop=None):
+    """lines (bytes) of the log from byte start up to byte stop (None for the end of the file)
+
+    a compressed log (see CompressedLog) can't be seeked in, so it can only be
+    read whole
+    """
+    if start == 0 and stop is None:
+        yield from CompressedLog.iter_lines(file_name)
+        return
+    if CompressedLog.compression_of(file_name):
+        raise ValueError(f"{file_name} is compressed, it can only be read whole")
+    with open(file_name, 'rb') as f:
+        f.seek(start)
+        yield from (f if stop is None else f.read(stop - start).splitlines())
+
+
+@Instrumentation.staged('parse cards')
+def read_cards(file_name, date=None, points=POINTS_PER_CARD, ranges=None):
+    """reads and pairs the position/load strokes of a pump card log
+
+    date is a 'YYYY-M-D' string (see date_from_file_name) used for the time
+    stamps, cards after midnight go on the next day.  Strokes that aren't
+    paired, or don't have the expected number of points, are left out of the
+    matrices and listed in problems as (line_number, time_string, reason) tuples.
+
+    ranges limits the reading to parts of the file, as (start byte, stop byte,
+    number of the first line, unwrapped time before the first line) tuples
+    (see TimeIndex), rather than the whole file.
+    """
+    if ranges is None:
+        ranges = [(0, None, 1, None)]
+    pending = {}  # time string -> (line number, position values) waiting for its load
+    times = []
+    card_ranges = []  # index in ranges of every card, for the midnight unwrapping
+    positions = []
+    loads = []
+    problems = []
+    paired = set()  # time strings of the cards made
+    for range_index, (start, stop, first_line, _) in enumerate(ranges):
+        for line_number, line in enumerate(range_lines(file_name, start, stop), first_line):
+            split_line = line.decode().rstrip().split(',', 2)
+            if len(split_line) < 3 or split_line[0] not in ('position', 'load'):
+                if line.strip():
+                    problems.append((line_number, '', 'not a position or load line'))
+                continue
+            kind, time_string, values = split_line
+            try:
+                values = np.array(values.split(','), dtype=np.float64)
+                time_us = parse_card_time(time_string)
+            except ValueError:
+                problems.append((line_number, time_string, f'bad {kind} line'))
+                continue
+            if kind == 'position':
+                if time_string in pending:
+                    problems.append((pending[time_string][0], time_string, 'position without load'))
+                pending[time_string] = (line_number, values)
+                continue
+            if time_string not in pending:
+                problems.append((line_number, time_string, 'load without position'))
+                continue
+            position_line, position_values = pending.pop(time_string)
+            if len(position_values) != points or len(values) != points:
+                problems.append((position_line, time_string,
+                                 f'{len(position_values)} positions and {len(values)} loads, '
+                                 f'expected {points} of each'))
+                continue
+            times.append(time_us)
+            paired.add(time_string)
+            card_ranges.append(range_index)
+            positions.append(position_values)
+            loads.append(values)
+    for time_string, (line_number, _) in pending.items():
+        problems.append((line_number, time_string, 'position without load'))
+    problems.sort()
+    Instrumentation.count('cards paired', len(times))
+    # a card can have several problems (a bad load line leaves its position without load), count it once
+    Instrumentation.count('cards dropped', len({problem[1] for problem in problems if problem[1]} - paired))
+
+    times = np.array(times, dtype=np.int64)
+    card_ranges = np.array(card_ranges, dtype=np.intp)
+    for range_index, (_, _, _, reference) in enumerate(ranges):
+        in_range = card_ranges == range_index
+        times[in_range] = MagnetometerLog.unwrap_times(times[in_range], reference)
+    if len(times):
+        positions = np.stack(positions)
+        loads = np.stack(loads)
+    else:
+        positions = np.empty((0, points))
+        loads = np.empty((0, points))
+    return PumpCards(MagnetometerLog.to_datetime64(times, date), positions, loads, problems)
+
+
+def card_statistics(loads):
+    """per-card mean and (sample) standard deviation of the load, one reduction each"""
+    return loads.mean(axis=1), loads.std(axis=1, ddof=1)
+
+
+@Instrumentation.staged('smooth cards')
+def smooth_cards(values, sigma=SMOOTHING_SIGMA, out=None):
+    """smooths every card (row) of an (N, points) matrix in one call
+
+    A card is a closed stroke, so the filter wraps around from the last point to
+    the first.  Returns an (N, points + 1) array with the first point repeated at
+    the end to close the curve; pass a buffer of that shape as out to reuse it.
+    """
+    from scipy.ndimage import gaussian_filter1d  # scipy is only needed here, and slow to import
+
+    if out is None:
+        out = np.empty((values.shape[0], values.shape[1] + 1))
+    gaussian_filter1d(values, sigma, axis=1, mode='wrap', output=out[:, :-1])
+    out[:, -1] = out[:, 0]
+    return out
+
+
+def date_from_file_name(file_name):
+    """'YYYY-M-D' date part of a name like Whitecap_2019-3-24_pumpcards.log(.gz)"""
+    return CompressedLog.log_name(file_name).split('_')[-2]
+
+
+def site_from_file_name(file_name):
+    """'Whitecap' part of a name like Whitecap_2019-3-24_pumpcards.log(.gz)"""
+    return CompressedLog.log_name(file_name).split('_')[0]
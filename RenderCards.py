@@ -0,0 +1,245 @@
+"""
+Renders pump card graphs to PNG files without a display, spread over a process pool.
+
+Usage is:
+
+python RenderCards.py Whitecap_2019-3-24_pumpcards.log --start-hour 6 --duration 12 --cards-per-graph 5
+
+or render_cards(cards, output_dir, ...) with cards from PumpCardLog.read_cards.
+
+The cards from start_hour of the log's day (the date in its name) up to the
+end of hour start_hour + duration (on the next day if it is past midnight, and
+a start hour of 24 or more is on the next day too) are drawn cards_per_graph to
+a graph (the last graph may have fewer), each graph named after the date and time
+of its first card.  Graphs go to a directory named after the
+site (the part of the log name before the first '_') unless --output-dir is
+given.
+
+Rendering is incremental: every graph is keyed by a hash of its cards' data and
+the drawing parameters (cards_per_graph, the smoothing sigma), and the keys of
+the graphs on disk are kept in RENDER_MANIFEST in the output directory, per
+hour window (its start and stop date and time, so per log date too).  A graph
+whose key hasn't changed is not drawn again, only the cards of new or changed
+graphs are smoothed and drawn.  A PNG is only removed when the manifest has it
+as a graph of the same window, the window no longer has a graph of its name
+and no other window has it, so rendering another date or another window of
+the same site leaves their graphs alone.  Re-running on a log that was
+appended to redraws the last (partial) graph and the new ones.  --force
+redraws everything.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+import Instrumentation
+import MagnetometerLog
+import PumpCardLog
+import TimeIndex
+
+RENDER_MANIFEST = '.render.json'
+RENDER_VERSION = 1  # bump when render_group draws differently, it redraws every graph
+PNG_NAME_FORMAT = "%Y-%m-%d_%H-%M-%S.png"  # of the first card of a graph
+
+
+def hour_window(times, start_hour, duration, date=None):
+    """(start, stop) datetime64[h] from start_hour of date to the end of hour start_hour + duration
+
+    None if there is no date and no times.  date is the 'YYYY-M-D' of the log
+    name, the day TimeIndex.read_card_window counts the hours from, so a start
+    hour of 24 or more is on the next day for both.  Without it the hours are
+    counted from the day of the first card.
+    The window is on the full date and time, so cards of the next day (a
+    window past midnight, or a log running past it) don't land on the same
+    hours of the first day.
+    """
+    if date is not None:
+        day = MagnetometerLog.to_datetime64(0, date).astype('datetime64[D]')
+    elif len(times):
+        day = times.min().astype('datetime64[D]')
+    else:
+        return None
+    start = day + np.timedelta64(start_hour, 'h')
+    return start, start + np.timedelta64(duration + 1, 'h')
+
+
+def cards_in_window(times, start_hour, duration, date=None):
+    """indices of the cards in the hour window (see hour_window)"""
+    window = hour_window(times, start_hour, duration, date)
+    if window is None:
+        return np.empty(0, dtype=np.intp)
+    start, stop = window
+    return np.flatnonzero((times >= start) & (times < stop))
+
+
+def render_group(png_name, labels, positions, loads):
+    """draws one graph on its own Figure (no pyplot state, so it's safe in a worker)
+
+    returns (number of cards drawn, seconds drawing, seconds in savefig)
+    """
+    # matplotlib is imported by the first graph (of each worker), not by importing this module
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    start = time.perf_counter()
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    for position, load in zip(positions, loads):
+        ax.plot(position, load)
+    ax.set_xlabel("Position")
+    ax.set_ylabel("Load")
+    ax.legend(labels, loc='center left', bbox_to_anchor=(1, 0.5))
+    saving = time.perf_counter()
+    fig.savefig(png_name, bbox_inches='tight')
+    return len(labels), saving - start, time.perf_counter() - saving
+
+
+def group_key(times, positions, loads, parameters):
+    """hash of a graph's cards (unsmoothed) and the parameters it is drawn with"""
+    key = hashlib.sha1(json.dumps(parameters).encode())
+    for values in (times.astype(np.int64), positions, loads):
+        key.update(np.ascontiguousarray(values).tobytes())
+    return key.hexdigest()
+
+
+def window_name(window):
+    """manifest key of an hour_window, e.g. '2019-03-24T06 2019-03-24T19'"""
+    return f"{window[0]} {window[1]}"
+
+
+def read_manifest(output_dir):
+    """{window name: {png name: group key}} of the graphs rendered to output_dir"""
+    try:
+        with open(os.path.join(output_dir, RENDER_MANIFEST), 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    # a manifest from before the windows had their own has no dicts, its graphs are drawn again
+    return {name: graphs for name, graphs in manifest.items() if isinstance(graphs, dict)}
+
+
+def write_manifest(output_dir, manifest):
+    """writes the manifest, without the windows that have no graphs"""
+    manifest_file = os.path.join(output_dir, RENDER_MANIFEST)
+    with open(manifest_file + '.tmp', 'w') as f:
+        json.dump({name: graphs for name, graphs in manifest.items() if graphs}, f, indent=0, sort_keys=True)
+    os.replace(manifest_file + '.tmp', manifest_file)
+
+
+@Instrumentation.staged('render cards')
+def render_cards(cards, output_dir, start_hour=0, duration=24, cards_per_graph=5, processes=None, force=False,
+                 date=None):
+    """renders the cards in the hour window to output_dir, returns (graphs, cards drawn)
+
+    the window's hours are counted from date, the log's 'YYYY-M-D' (see
+    hour_window).  graphs is the number of graphs of the window, cards drawn
+    only counts the graphs that were new or changed (all of them with force).
+    processes is the size of the process pool (None for one per CPU, 1 to draw
+    in this process).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    window = hour_window(cards.times, start_hour, duration, date)
+    if window is None:
+        return 0, 0
+    scope = window_name(window)
+    manifest = read_manifest(output_dir)
+    previous = manifest.pop(scope, {})  # graphs of this window from the last run
+    recorded = {} if force else previous
+    parameters = [RENDER_VERSION, cards_per_graph, PumpCardLog.SMOOTHING_SIGMA]
+
+    indices = cards_in_window(cards.times, start_hour, duration, date)
+    times = cards.times[indices]
+    card_times = times.astype(datetime)
+    keys = {}  # png name -> key of every graph of the window
+    changed = []  # first card (in the window) of the graphs to draw
+    for first in range(0, len(indices), cards_per_graph):
+        group = indices[first:first + cards_per_graph]
+        png_name = card_times[first].strftime(PNG_NAME_FORMAT)
+        keys[png_name] = group_key(times[first:first + cards_per_graph], cards.positions[group],
+                                   cards.loads[group], parameters)
+        if recorded.get(png_name) != keys[png_name] or not os.path.exists(os.path.join(output_dir, png_name)):
+            changed.append(first)
+
+    # the manifest entries of the graphs about to be redrawn go (in every window, a graph of
+    # another window with the same name is drawn over), so an interrupted run can't leave a
+    # stale graph marked current
+    graphs = {png_name: key for png_name, key in recorded.items()
+              if keys.get(png_name) == key and os.path.exists(os.path.join(output_dir, png_name))}
+    manifest = {name: {png_name: key for png_name, key in other.items() if keys.get(png_name, key) == key}
+                for name, other in manifest.items()}
+    # PNGs this window drew that are no longer among its graphs go, unless another window has them
+    elsewhere = {png_name for other in manifest.values() for png_name in other}
+    for png_name in previous:
+        if png_name not in keys and png_name not in elsewhere:
+            try:
+                os.unlink(os.path.join(output_dir, png_name))
+            except FileNotFoundError:
+                pass
+    manifest[scope] = graphs
+    write_manifest(output_dir, manifest)
+
+    # only the cards of the changed graphs are smoothed
+    redraw = indices[[row for first in changed for row in range(first, min(first + cards_per_graph, len(indices)))]]
+    positions = PumpCardLog.smooth_cards(cards.positions[redraw])
+    loads = PumpCardLog.smooth_cards(cards.loads[redraw])
+    jobs = []
+    for number, first in enumerate(changed):
+        group_times = card_times[first:first + cards_per_graph]
+        start = number * cards_per_graph  # only the last graph of the window can be short
+        jobs.append((os.path.join(output_dir, group_times[0].strftime(PNG_NAME_FORMAT)),
+                     [t.strftime("%Y-%m-%d %H:%M:%S") for t in group_times],
+                     positions[start:start + len(group_times)],
+                     loads[start:start + len(group_times)]))
+
+    if processes == 1 or len(jobs) < 2:
+        groups = [render_group(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            chunk_size = max(1, len(jobs) // (4 * (processes or os.cpu_count() or 1)))
+            groups = list(pool.map(render_group, *zip(*jobs), chunksize=chunk_size))
+    drawn = sum(cards for cards, _, _ in groups)
+    # drawing and saving happen in the workers, only their wall times come back
+    Instrumentation.add('render: draw', sum(seconds for _, seconds, _ in groups), calls=len(groups))
+    Instrumentation.add('render: savefig', sum(seconds for _, _, seconds in groups), calls=len(groups))
+    Instrumentation.count('graphs saved', len(groups))
+    Instrumentation.count('graphs unchanged', len(keys) - len(jobs))
+    Instrumentation.count('cards drawn', drawn)
+    graphs.update((os.path.basename(job[0]), keys[os.path.basename(job[0])]) for job in jobs)
+    write_manifest(output_dir, manifest)
+    return len(keys), drawn
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render pump card graphs from a *_pumpcards.log")
+    parser.add_argument('log_file')
+    parser.add_argument('--start-hour', type=int, default=0)
+    parser.add_argument('--duration', type=int, default=24, help="hours after the start hour")
+    parser.add_argument('--cards-per-graph', type=int, default=5)
+    parser.add_argument('--output-dir', help="defaults to the site name from the log name")
+    parser.add_argument('--processes', type=int, help="defaults to one per CPU")
+    parser.add_argument('--force', action='store_true', help="redraw graphs that haven't changed too")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    # only the lines of the hours asked for are read, through the log's time index
+    date = PumpCardLog.date_from_file_name(args.log_file)
+    cards = TimeIndex.read_card_window(args.log_file, args.start_hour, args.start_hour + args.duration + 1, date)
+    for line_number, time_stamp, reason in cards.problems:
+        print(f"line {line_number} ({time_stamp}): {reason}")
+    output_dir = args.output_dir or PumpCardLog.site_from_file_name(args.log_file)
+    graphs, drawn = render_cards(cards, output_dir, args.start_hour, args.duration,
+                                 args.cards_per_graph, args.processes, args.force, date)
+    seconds = time.perf_counter() - start
+    print(f"{graphs} graphs in {output_dir}, {drawn} new or changed cards drawn in {seconds:.2f} s "
+          f"({drawn / seconds:.1f} cards/s)")
+
+
+if __name__ == "__main__":
+    main()
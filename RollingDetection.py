@@ -0,0 +1,250 @@
+"""
+Continuous (sliding window) version of the RotationDetection moving/rotating detector.
+
+Usage is:
+
+python RollingDetection.py CRC4_2019-3-24.log
+
+to compare it with RotationDetection.process_array on every pod of a log (and
+on a synthetic recording where the rotator fails), or from code
+
+* detector = RollingDetector()
+* detector.process(mag_x, mag_y, mag_z, time_stamp) for every sample, then read
+  detector.moving and detector.rotating (RotationDetection.Indicator values)
+* moving, rotating = rolling_array(mag_x, mag_y, mag_z, pod_time)
+    ** the indicators after every sample, like RotationDetection.process_array
+
+RotationDetection decides at the end of fixed, back to back windows, so a
+change shows up MOVING_CHECK_SECONDS (moving) or ROTATING_CHECK_SECONDS
+(rotating) after the window it happened in has closed: a rotator that stops
+just after a rotating window opened is only reported two windows later.  Here
+both checks are made after every sample, on the trailing MOVING_CHECK_SECONDS
+and ROTATING_CHECK_SECONDS:
+
+* the noise threshold is calibrated exactly as RotationDetection does it
+* moving is YES while the summed max-min of the trailing fast window is over
+  the threshold, NO when it isn't
+* every MOVING_CHECK_SECONDS of moving the fast sum goes into a ring buffer of
+  MOVING_CHECK_ARRAY_LENGTH entries (emptied when moving goes NO), the fast
+  sums the rotating check averages
+* rotating is checked once the pump jack has been moving for a full slow
+  window, with the same rule as RotationDetection (slow sum more than
+  ROTATING_CHECK_MULT times the average fast sum), and is NO while not moving
+
+The max and min of each axis over a trailing window are kept in monotonic
+deques (see TrailingExtrema), so every sample costs O(1) amortized whatever
+the sample rate and window length.  The slow window only holds the samples
+since moving last went YES, like the rotating search of RotationDetection.
+"""
+
+import sys
+from collections import deque
+
+import numpy as np
+
+import MagnetometerLog
+import RotationDetection
+from RotationDetection import Indicator
+
+COMPARE_FIELDS = (
+    'samples', 'moving_agreement', 'rotating_agreement',
+    'windowed_moving_changes', 'rolling_moving_changes', 'windowed_rotating_changes', 'rolling_rotating_changes',
+    'moving_lead_seconds', 'rotating_lead_seconds',
+)
+
+
+class TrailingExtrema:
+    """max and min of each axis over the samples of the trailing seconds
+
+    the deques hold (time, value) pairs, decreasing values for the maxima and
+    increasing ones for the minima, so the extreme is at the front and a
+    sample is pushed and popped at most once
+    """
+
+    __slots__ = ('seconds', 'maxima', 'minima', 'opened')
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.maxima = (deque(), deque(), deque())
+        self.minima = (deque(), deque(), deque())
+        self.opened = None  # time of the first sample since the window was cleared
+
+    def clear(self):
+        for values in self.maxima + self.minima:
+            values.clear()
+        self.opened = None
+
+    def add(self, time_stamp, values):
+        if self.opened is None:
+            self.opened = time_stamp
+        oldest = time_stamp - self.seconds
+        for maxima, minima, value in zip(self.maxima, self.minima, values):
+            while maxima and maxima[-1][1] <= value:
+                maxima.pop()
+            maxima.append((time_stamp, value))
+            while maxima[0][0] < oldest:
+                maxima.popleft()
+            while minima and minima[-1][1] >= value:
+                minima.pop()
+            minima.append((time_stamp, value))
+            while minima[0][0] < oldest:
+                minima.popleft()
+
+    def full(self, time_stamp):
+        """whether the window has seen seconds of samples since it was cleared"""
+        return self.opened is not None and time_stamp - self.opened >= self.seconds
+
+    def summed_range(self):
+        """sum over the axes of max - min"""
+        return sum(maxima[0][1] - minima[0][1] for maxima, minima in zip(self.maxima, self.minima))
+
+
+class RollingDetector:
+    """moving/rotating detector for a single pod, updated on every sample (see the module docstring)"""
+
+    __slots__ = (
+        'moving', 'rotating', 'calibration', 'fast', 'slow', 'last_time',
+        'moving_sum_array', 'moving_sum_array_counter', 'next_moving_sum_time',
+    )
+
+    def __init__(self):
+        self.init()
+
+    def init(self):
+        self.moving = Indicator.TBD
+        self.rotating = Indicator.TBD
+        self.calibration = RotationDetection.RotationDetector()  # only its noise threshold is used
+        self.fast = TrailingExtrema(RotationDetection.MOVING_CHECK_SECONDS)
+        self.slow = TrailingExtrema(RotationDetection.ROTATING_CHECK_SECONDS)
+        self.last_time = None
+        self.reset_moving_array()
+
+    def reset_moving_array(self):
+        self.moving_sum_array = [None] * RotationDetection.MOVING_CHECK_ARRAY_LENGTH
+        self.moving_sum_array_counter = 0
+        self.next_moving_sum_time = None
+
+    def update_moving_array(self, time_stamp, moving_sum):
+        """one fast sum per MOVING_CHECK_SECONDS goes into the ring buffer"""
+        if self.next_moving_sum_time is not None and time_stamp < self.next_moving_sum_time:
+            return
+        self.moving_sum_array[self.moving_sum_array_counter] = moving_sum
+        self.moving_sum_array_counter = (self.moving_sum_array_counter + 1) % len(self.moving_sum_array)
+        self.next_moving_sum_time = time_stamp + RotationDetection.MOVING_CHECK_SECONDS
+
+    def currently_rotating(self):
+        """RotationDetector.currently_rotating on the slow window and the ring buffer"""
+        moving_sums = [moving_sum for moving_sum in self.moving_sum_array if moving_sum is not None]
+        return self.slow.summed_range() * len(moving_sums) > RotationDetection.ROTATING_CHECK_MULT * sum(moving_sums)
+
+    def process(self, mag_x, mag_y, mag_z, time_stamp):
+        """updates the moving and rotating attributes with one sample"""
+        if not self.calibration.thresh_set:
+            self.calibration.update_thresh(mag_x, mag_y, mag_z)
+            return
+        if self.last_time is not None and time_stamp < self.last_time:
+            # pod_time went back (the pod restarted), the windows start again
+            self.fast.clear()
+            self.slow.clear()
+            self.reset_moving_array()
+        self.last_time = time_stamp
+        values = (mag_x, mag_y, mag_z)
+        self.fast.add(time_stamp, values)
+        if not self.fast.full(time_stamp):
+            return
+        moving_sum = self.fast.summed_range()
+        if moving_sum <= self.calibration.move_thresh:
+            if self.moving != Indicator.NO:
+                self.moving = Indicator.NO
+                self.rotating = Indicator.NO  # can't possibly be rotating
+                self.slow.clear()
+                self.reset_moving_array()
+            return
+        self.moving = Indicator.YES
+        self.update_moving_array(time_stamp, moving_sum)
+        self.slow.add(time_stamp, values)
+        if self.slow.full(time_stamp):
+            self.rotating = Indicator.YES if self.currently_rotating() else Indicator.NO
+
+
+def rolling_array(mag_x, mag_y, mag_z, pod_time):
+    """(moving, rotating) int8 arrays, the indicators of a RollingDetector after every sample"""
+    detector = RollingDetector()
+    moving = np.empty(len(pod_time), dtype=np.int8)
+    rotating = np.empty(len(pod_time), dtype=np.int8)
+    for i, sample in enumerate(zip(np.asarray(mag_x, dtype=np.float64).tolist(),
+                                   np.asarray(mag_y, dtype=np.float64).tolist(),
+                                   np.asarray(mag_z, dtype=np.float64).tolist(),
+                                   np.asarray(pod_time, dtype=np.float64).tolist())):
+        detector.process(*sample)
+        moving[i] = detector.moving
+        rotating[i] = detector.rotating
+    return moving, rotating
+
+
+def change_leads(time_stamps, windowed, rolling):
+    """seconds each change of the windowed indicator comes after the last change of the rolling one to
+    the same value (negative if the rolling one changed later), for the changes both made"""
+    leads = []
+    windowed_changes = np.flatnonzero(windowed[1:] != windowed[:-1]) + 1
+    rolling_changes = np.flatnonzero(rolling[1:] != rolling[:-1]) + 1
+    for change in windowed_changes:
+        same = rolling_changes[rolling[rolling_changes] == windowed[change]]
+        if len(same) == 0:
+            continue
+        nearest = same[np.argmin(np.abs(time_stamps[same] - time_stamps[change]))]
+        leads.append(time_stamps[change] - time_stamps[nearest])
+    return np.array(leads)
+
+
+def compare(mag_x, mag_y, mag_z, pod_time):
+    """dict (COMPARE_FIELDS) comparing rolling_array with RotationDetection.process_array on one pod"""
+    pod_time = np.asarray(pod_time, dtype=np.float64)
+    windowed_moving, windowed_rotating = RotationDetection.process_array(mag_x, mag_y, mag_z, pod_time)
+    rolling_moving, rolling_rotating = rolling_array(mag_x, mag_y, mag_z, pod_time)
+    moving_leads = change_leads(pod_time, windowed_moving, rolling_moving)
+    rotating_leads = change_leads(pod_time, windowed_rotating, rolling_rotating)
+    return {
+        'samples': len(pod_time),
+        'moving_agreement': float(np.mean(windowed_moving == rolling_moving)) if len(pod_time) else 1.0,
+        'rotating_agreement': float(np.mean(windowed_rotating == rolling_rotating)) if len(pod_time) else 1.0,
+        'windowed_moving_changes': int(np.count_nonzero(windowed_moving[1:] != windowed_moving[:-1])),
+        'rolling_moving_changes': int(np.count_nonzero(rolling_moving[1:] != rolling_moving[:-1])),
+        'windowed_rotating_changes': int(np.count_nonzero(windowed_rotating[1:] != windowed_rotating[:-1])),
+        'rolling_rotating_changes': int(np.count_nonzero(rolling_rotating[1:] != rolling_rotating[:-1])),
+        'moving_lead_seconds': float(np.median(moving_leads)) if len(moving_leads) else float('nan'),
+        'rotating_lead_seconds': float(np.median(rotating_leads)) if len(rotating_leads) else float('nan'),
+    }
+
+
+def comparison_text(name, comparison):
+    return (f"{name}: {comparison['samples']} samples, "
+            f"moving agrees on {comparison['moving_agreement']:.1%} "
+            f"({comparison['windowed_moving_changes']} windowed / {comparison['rolling_moving_changes']} rolling "
+            f"changes, rolling {comparison['moving_lead_seconds']:.0f} s earlier), "
+            f"rotating agrees on {comparison['rotating_agreement']:.1%} "
+            f"({comparison['windowed_rotating_changes']} / {comparison['rolling_rotating_changes']} changes, "
+            f"rolling {comparison['rotating_lead_seconds']:.0f} s earlier)")
+
+
+if __name__ == "__main__":
+    # the median "earlier" is over the changes of the windowed indicator that the rolling one
+    # makes too, nan when there are none
+    if len(sys.argv) > 1:
+        columns = MagnetometerLog.read_log(sys.argv[1])
+        for mac in MagnetometerLog.macs_in(columns):
+            pod = columns['mac'] == mac.encode()
+            print(comparison_text(f"{sys.argv[1]} {mac}", compare(columns['mag_x'][pod], columns['mag_y'][pod],
+                                                                  columns['mag_z'][pod], columns['pod_time'][pod])))
+
+    # a few hours with stops and a rotator that fails part way through each stretch of running
+    rng = np.random.default_rng(0)
+    t = 1000.0 + np.cumsum(rng.uniform(0.02, 0.06, 400000))
+    running = (t // 5000) % 3 != 2
+    rotator = (t % 5000) < 3100
+    stroke = 40 * np.sin(2 * np.pi * t / 8) * running
+    turned = np.cumsum(np.diff(t, prepend=t[0]) * rotator * running)  # seconds the rod has been turning
+    drift = 300 * np.sin(2 * np.pi * turned / 3000)
+    noise = rng.integers(-3, 4, (3, len(t)))
+    print(comparison_text("synthetic", compare(stroke + drift + noise[0], 0.5 * stroke - drift + noise[1],
+                                               0.2 * stroke + noise[2], t)))
@@ -1,5 +1,9 @@
 from enum import IntEnum
 
+import numpy as np
+
+import Instrumentation
+
 """
 Usage is:
 
@@ -12,6 +16,20 @@ Usage is:
 * access the "rotating" parameter to determine if the rod is rotating, this is an
     enum with the same 3 values as above
 
+The module level functions drive a single default detector.  To follow several
+pods, create one RotationDetector per pod (same init/process/moving/rotating
+interface), or feed log lines to a RotationDemultiplexer which keeps one
+detector per MAC address.
+
+Alternatively, for a whole recording at once:
+
+* moving, rotating = process_array(mag_x, mag_y, mag_z, pod_time)
+    ** returns one indicator per sample, identical to the value of the "moving"
+       and "rotating" parameters after calling process() on that sample
+
+RollingDetection has a continuous version, checked after every sample on
+trailing windows instead of at the end of fixed ones.
+
 
 "Theory"
 
@@ -77,231 +95,570 @@ ROTATING_CHECK_MULT = 2  # how much larger the slow max-min diff must be than th
 INIT_MAX_SEARCH = -1e6
 INIT_MIN_SEARCH = 1e6
 
-# variables for searching for motion (up/down)
-moving = Indicator.TBD
-end_moving_search_time = 0  # gets initialized properly in init_moving_search
-moving_x_max = moving_y_max = moving_z_max = INIT_MAX_SEARCH
-moving_x_min = moving_y_min = moving_z_min = INIT_MIN_SEARCH
-moving_sum_array = [None] * MOVING_CHECK_ARRAY_LENGTH
-moving_sum_array_counter = 0
 
-# variables for searching for rotation
-rotating = Indicator.TBD
-end_rotating_search_time = 0  # gets initialized properly in init_rotating_search
-rotating_x_max = rotating_y_max = rotating_z_max = INIT_MAX_SEARCH
-rotating_x_min = rotating_y_min = rotating_z_min = INIT_MIN_SEARCH
+class RotationDetector:
+    """moving/rotating detector for a single pod
+
+    holds all the search state, so one instance is needed per rod rotator.
+    Usage is the same as the module level functions: call process() for
+    every sample and read the "moving" and "rotating" attributes.
+    """
 
-moving_search_status = SearchStatus.NEEDS_INIT
-rotating_search_status = SearchStatus.NEEDS_INIT
+    __slots__ = (
+        # variables for searching for motion (up/down)
+        'moving', 'end_moving_search_time',
+        'moving_x_max', 'moving_y_max', 'moving_z_max',
+        'moving_x_min', 'moving_y_min', 'moving_z_min',
+        'moving_sum_array', 'moving_sum_array_counter',
+        # variables for searching for rotation
+        'rotating', 'end_rotating_search_time',
+        'rotating_x_max', 'rotating_y_max', 'rotating_z_max',
+        'rotating_x_min', 'rotating_y_min', 'rotating_z_min',
+        'moving_search_status', 'rotating_search_status',
+        'thresh_set', 'move_thresh', 'noise_thresh_checks', 'samples_into_thresh_check',
+    )
+
+    def __init__(self):
+        self.end_moving_search_time = 0  # gets initialized properly in process
+        self.end_rotating_search_time = 0  # gets initialized properly in process
+        self.init()
+
+    def init_thresh_search(self):
+        self.thresh_set = False
+        self.move_thresh = 0
+        self.noise_thresh_checks = 0
+        self.samples_into_thresh_check = 0
+
+    def init_moving_search(self):
+        self.moving_x_max = self.moving_y_max = self.moving_z_max = INIT_MAX_SEARCH
+        self.moving_x_min = self.moving_y_min = self.moving_z_min = INIT_MIN_SEARCH
+
+    def init_rotating_search(self):
+        self.rotating_x_max = self.rotating_y_max = self.rotating_z_max = INIT_MAX_SEARCH
+        self.rotating_x_min = self.rotating_y_min = self.rotating_z_min = INIT_MIN_SEARCH
+
+    def update_moving_search(self, mag_x, mag_y, mag_z):
+        if mag_x > self.moving_x_max:
+            self.moving_x_max = mag_x
+        if mag_x < self.moving_x_min:
+            self.moving_x_min = mag_x
+        if mag_y > self.moving_y_max:
+            self.moving_y_max = mag_y
+        if mag_y < self.moving_y_min:
+            self.moving_y_min = mag_y
+        if mag_z > self.moving_z_max:
+            self.moving_z_max = mag_z
+        if mag_z < self.moving_z_min:
+            self.moving_z_min = mag_z
+
+    def update_rotating_search(self, mag_x, mag_y, mag_z):
+        if mag_x > self.rotating_x_max:
+            self.rotating_x_max = mag_x
+        if mag_x < self.rotating_x_min:
+            self.rotating_x_min = mag_x
+        if mag_y > self.rotating_y_max:
+            self.rotating_y_max = mag_y
+        if mag_y < self.rotating_y_min:
+            self.rotating_y_min = mag_y
+        if mag_z > self.rotating_z_max:
+            self.rotating_z_max = mag_z
+        if mag_z < self.rotating_z_min:
+            self.rotating_z_min = mag_z
+
+    def update_thresh(self, mag_x, mag_y, mag_z):
+        """called after init to set the noise threshold
+
+        takes a number of short "snapshots" of the sum(max-min)
+        and keeps the smallest one as the noise threshold
+        """
+        self.update_moving_search(mag_x, mag_y, mag_z)  # use this to save on code!
+        self.samples_into_thresh_check += 1
+        if self.samples_into_thresh_check == THRESH_SAMPLES:
+            self.samples_into_thresh_check = 0
+            self.move_thresh += ((self.moving_x_max + self.moving_y_max + self.moving_z_max)
+                                 - (self.moving_x_min + self.moving_y_min + self.moving_z_min))
+            self.init_moving_search()
+            self.noise_thresh_checks += 1
+            if self.noise_thresh_checks == NUM_THRESH_CHECKS:
+                self.move_thresh /= NUM_THRESH_CHECKS
+                self.move_thresh *= MOVING_THRESH_MULT  # up to this point it has been noise thresh - scale!
+                self.thresh_set = True
+
+    def currently_moving(self):
+        """returns bool indicating whether pump is moving
+
+        this is used within process to update the "moving"
+        attribute, which is latched
+        """
+        summed_ext_diff = (self.moving_x_max + self.moving_y_max + self.moving_z_max
+                           - (self.moving_x_min + self.moving_y_min + self.moving_z_min))
+        if summed_ext_diff > self.move_thresh:
+            return True
+
+    def update_moving_array(self):
+        self.moving_sum_array[self.moving_sum_array_counter] = (
+            self.moving_x_max + self.moving_y_max + self.moving_z_max
+            - (self.moving_x_min + self.moving_y_min + self.moving_z_min))
+        self.moving_sum_array_counter = (self.moving_sum_array_counter + 1) % MOVING_CHECK_ARRAY_LENGTH
+
+    def reset_moving_array(self):
+        self.moving_sum_array = [None] * MOVING_CHECK_ARRAY_LENGTH
+        self.moving_sum_array_counter = 0
+
+    def currently_rotating(self):
+        """returns bool indicating whether or not we are currently rotating
+
+        to return True, two conditions need to be met.  First pump needs to
+        be moving.  Secondly, the "extrema difference sum" from the rotation
+        (slow check) has to be significantly larger than the average of the
+        last few "extrema difference sums" of the moving checks (fast checks).
+
+        this is used within process to update the rotating attribute, which
+        is latched
+        """
+        apparent_rotation = False
+        if self.moving:
+            # if we are not moving then apparent_rotation
+            # will not get changed from False
+            summed_ext_diff = (self.rotating_x_max + self.rotating_y_max + self.rotating_z_max -
+                               (self.rotating_x_min + self.rotating_y_min + self.rotating_z_min))
+            compare_val = 0
+            num_to_mult_by = 0
+            # this loop is to "average" over the non-None elements
+            # of the array - actually, we don't average (no division)
+            # but scale the other side of the comparison
+            for i in range(MOVING_CHECK_ARRAY_LENGTH):
+                if self.moving_sum_array[i] is not None:
+                    compare_val += self.moving_sum_array[i]
+                    num_to_mult_by = i + 1
+            if (summed_ext_diff * num_to_mult_by) > (ROTATING_CHECK_MULT * compare_val):
+                apparent_rotation = True
+        return apparent_rotation
+
+    def get_state(self):
+        """the whole search state as a dict of plain numbers and lists (JSON friendly)"""
+        state = {name: getattr(self, name) for name in self.__slots__}
+        state['moving_sum_array'] = list(self.moving_sum_array)
+        return state
+
+    def set_state(self, state):
+        """restores a state from get_state(), the detector carries on where that one was"""
+        for name in self.__slots__:
+            setattr(self, name, state[name])
+        self.moving_sum_array = list(self.moving_sum_array)
+        self.moving = Indicator(self.moving)
+        self.rotating = Indicator(self.rotating)
+        self.moving_search_status = SearchStatus(self.moving_search_status)
+        self.rotating_search_status = SearchStatus(self.rotating_search_status)
+
+    def init(self):
+        self.init_thresh_search()
+        self.init_moving_search()
+        self.init_rotating_search()
+        self.reset_moving_array()
+        self.moving = Indicator.TBD
+        self.rotating = Indicator.TBD
+        self.moving_search_status = SearchStatus.NEEDS_INIT
+        self.rotating_search_status = SearchStatus.NEEDS_INIT
+
+    def process(self, mag_x, mag_y, mag_z, time_stamp):
+        """updates the two attributes moving and rotating
+
+        two checks at different speeds: fast for "moving"
+        and slow for "rotating".  The extrema from the fast
+        check are used in the slow check because we expect
+        to see more than just the "up and down" variations
+        in the rotating check.  Averages of the last "few"
+
+        counts the sample and any change of the two attributes with the same
+        instrumentation counters as process_array (see count_transitions).
+        """
+        moving, rotating = self.moving, self.rotating
+        if not self.thresh_set:
+            self.update_thresh(mag_x, mag_y, mag_z)
+        else:
+            if self.moving_search_status == SearchStatus.NEEDS_INIT:
+                self.init_moving_search()  # initialize the mins and maxes
+                self.end_moving_search_time = time_stamp + MOVING_CHECK_SECONDS
+                self.moving_search_status = SearchStatus.UPDATING
+            elif self.moving_search_status == SearchStatus.UPDATING:
+                self.update_moving_search(mag_x, mag_y, mag_z)
+                if time_stamp > self.end_moving_search_time:
+                    if self.currently_moving():
+                        self.moving = Indicator.YES
+                        self.update_moving_array()
+                    else:
+                        self.moving = Indicator.NO
+                        # if we are not moving, then array should be reset
+                        self.reset_moving_array()
+                        self.rotating = Indicator.NO  # and can't possibly be rotating
+                        self.rotating_search_status = SearchStatus.NEEDS_INIT
+                    # switch back to init again
+                    self.moving_search_status = SearchStatus.NEEDS_INIT
+
+            if self.moving == Indicator.YES:
+                # only need to bother searching for rotation if we are moving
+                if self.rotating_search_status == SearchStatus.NEEDS_INIT:
+                    self.init_rotating_search()  # initialize the mins and maxes
+                    self.end_rotating_search_time = time_stamp + ROTATING_CHECK_SECONDS
+                    self.rotating_search_status = SearchStatus.UPDATING
+                elif self.rotating_search_status == SearchStatus.UPDATING:
+                    self.update_rotating_search(mag_x, mag_y, mag_z)
+                    if time_stamp > self.end_rotating_search_time:
+                        if self.currently_rotating():
+                            self.rotating = Indicator.YES
+                        else:
+                            self.rotating = Indicator.NO
+                        self.rotating_search_status = SearchStatus.NEEDS_INIT
+
+        Instrumentation.count('samples processed')
+        Instrumentation.count('moving transitions', int(self.moving != moving))
+        Instrumentation.count('rotating transitions', int(self.rotating != rotating))
+
+
+class RotationDemultiplexer:
+    """routes magnetometer log lines to one RotationDetector per pod
+
+    lines are in the format
+
+    MAC,Magnetometer,raw,sequence,rtu_time,pod_time,accel_y,mag_x,mag_y,mag_z
+
+    and are keyed by the MAC in column 0, so a log holding several pods
+    only needs to be read once.
+    """
 
-thresh_set = False
-move_thresh = 0
-noise_thresh_checks = 0
-samples_into_thresh_check = 0
+    def __init__(self):
+        self.detectors = {}
+
+    def detector(self, mac):
+        """returns the detector for mac, creating it on first use"""
+        if mac not in self.detectors:
+            self.detectors[mac] = RotationDetector()
+        return self.detectors[mac]
+
+    def process_line(self, line):
+        """feeds one log line to its pod's detector
+
+        returns (mac, detector) or None for header and malformed lines
+        """
+        split_line = line.split(',')
+        if len(split_line) != 10 or split_line[1] != 'Magnetometer':
+            return None
+        try:
+            time_pod = float(split_line[5])
+            mag_x = float(split_line[7])
+            mag_y = float(split_line[8])
+            mag_z = float(split_line[9])
+        except ValueError:  # header line or garbage
+            return None
+        mac = split_line[0].strip()
+        detector = self.detector(mac)
+        detector.process(mag_x, mag_y, mag_z, time_pod)
+        return mac, detector
+
+    def process_file(self, file_name):
+        """runs a whole log file through the detectors, returns {mac: detector}"""
+        with open(file_name, 'r') as f:
+            for line in f:
+                self.process_line(line)
+        return self.detectors
+
+    def get_state(self):
+        """{mac: detector state} (see RotationDetector.get_state)"""
+        return {mac: detector.get_state() for mac, detector in self.detectors.items()}
+
+    def set_state(self, state):
+        """replaces the detectors with ones restored from get_state()"""
+        self.detectors = {}
+        for mac, detector_state in state.items():
+            self.detector(mac).set_state(detector_state)
+
+
+# the module level functions below work on this single default detector
+detector = RotationDetector()
+
+
+def __getattr__(name):
+    # keeps RotationDetection.moving, RotationDetection.move_thresh, ... working
+    if name in RotationDetector.__slots__:
+        return getattr(detector, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def init_thresh_search():
-    global thresh_set, move_thresh, noise_thresh_checks, samples_into_thresh_check
-    thresh_set = False
-    move_thresh = 0
-    noise_thresh_checks = 0
-    samples_into_thresh_check = 0
+    detector.init_thresh_search()
 
 
 def init_moving_search():
-    global moving_x_max, moving_x_min, moving_y_max, moving_y_min, moving_z_max, moving_z_min
-    moving_x_max = moving_y_max = moving_z_max = INIT_MAX_SEARCH
-    moving_x_min = moving_y_min = moving_z_min = INIT_MIN_SEARCH
+    detector.init_moving_search()
 
 
 def init_rotating_search():
-    global rotating_x_max, rotating_x_min, rotating_y_max, rotating_y_min, rotating_z_max, rotating_z_min
-    rotating_x_max = rotating_y_max = rotating_z_max = INIT_MAX_SEARCH
-    rotating_x_min = rotating_y_min = rotating_z_min = INIT_MIN_SEARCH
+    detector.init_rotating_search()
 
 
 def update_moving_search(mag_x, mag_y, mag_z):
-    global moving_x_max, moving_x_min, moving_y_max, moving_y_min, moving_z_max, moving_z_min
-    if mag_x > moving_x_max:
-        moving_x_max = mag_x
-    if mag_x < moving_x_min:
-        moving_x_min = mag_x
-    if mag_y > moving_y_max:
-        moving_y_max = mag_y
-    if mag_y < moving_y_min:
-        moving_y_min = mag_y
-    if mag_z > moving_z_max:
-        moving_z_max = mag_z
-    if mag_z < moving_z_min:
-        moving_z_min = mag_z
+    detector.update_moving_search(mag_x, mag_y, mag_z)
 
 
 def update_rotating_search(mag_x, mag_y, mag_z):
-    global rotating_x_max, rotating_x_min, rotating_y_max, rotating_y_min, rotating_z_max, rotating_z_min
-    if mag_x > rotating_x_max:
-        rotating_x_max = mag_x
-    if mag_x < rotating_x_min:
-        rotating_x_min = mag_x
-    if mag_y > rotating_y_max:
-        rotating_y_max = mag_y
-    if mag_y < rotating_y_min:
-        rotating_y_min = mag_y
-    if mag_z > rotating_z_max:
-        rotating_z_max = mag_z
-    if mag_z < rotating_z_min:
-        rotating_z_min = mag_z
+    detector.update_rotating_search(mag_x, mag_y, mag_z)
 
 
 def update_thresh(mag_x, mag_y, mag_z):
-    """called after init to set the noise threshold
-
-    takes a number of short "snapshots" of the sum(max-min)
-    and keeps the smallest one as the noise threshold
-    """
-    global thresh_set
-    global move_thresh
-    global noise_thresh_checks
-    global samples_into_thresh_check
-    update_moving_search(mag_x, mag_y, mag_z)  # use this to save on code!
-    samples_into_thresh_check += 1
-    if samples_into_thresh_check == THRESH_SAMPLES:
-        samples_into_thresh_check = 0
-        move_thresh += ((moving_x_max + moving_y_max + moving_z_max)
-                        - (moving_x_min + moving_y_min + moving_z_min))
-        init_moving_search()
-        noise_thresh_checks += 1
-        if noise_thresh_checks == NUM_THRESH_CHECKS:
-            move_thresh /= NUM_THRESH_CHECKS
-            move_thresh *= MOVING_THRESH_MULT  # up to this point it has been noise thresh - scale!
-            thresh_set = True
+    detector.update_thresh(mag_x, mag_y, mag_z)
 
 
 def currently_moving():
-    """returns bool indicating whether pump is moving
-
-    this is used within process to update the "moving"
-    parameter, which is latched
-    """
-    summed_ext_diff = (moving_x_max + moving_y_max + moving_z_max
-                       - (moving_x_min + moving_y_min + moving_z_min))
-    if summed_ext_diff > move_thresh:
-        return True
+    return detector.currently_moving()
 
 
 def update_moving_array():
-    global moving_sum_array
-    global moving_sum_array_counter
-    moving_sum_array[moving_sum_array_counter] = (moving_x_max + moving_y_max + moving_z_max
-                                                  - (moving_x_min + moving_y_min + moving_z_min))
-    moving_sum_array_counter = (moving_sum_array_counter + 1) % MOVING_CHECK_ARRAY_LENGTH
+    detector.update_moving_array()
 
 
 def reset_moving_array():
-    global moving_sum_array
-    global moving_sum_array_counter
-    moving_sum_array = [None] * MOVING_CHECK_ARRAY_LENGTH
-    moving_sum_array_counter = 0
+    detector.reset_moving_array()
 
 
 def currently_rotating():
-    """returns bool indicating whether or not we are currently rotating
-
-    to return True, two conditions need to be met.  First pump needs to
-    be moving.  Secondly, the "extrema difference sum" from the rotation
-    (slow check) has to be significantly larger than the average of the
-    last few "extrema difference sums" of the moving checks (fast checks).
-
-    this is used within process to update the rotating parameter, which
-    is latched
-    """
-    apparent_rotation = False
-    if moving:
-        # if we are not moving then apparent_rotation
-        # will not get changed from False
-        summed_ext_diff = (rotating_x_max + rotating_y_max + rotating_z_max -
-                           (rotating_x_min + rotating_y_min + rotating_z_min))
-        compare_val = 0
-        num_to_mult_by = 0
-        # this loop is to "average" over the non-None elements
-        # of the array - actually, we don't average (no division)
-        # but scale the other side of the comparison
-        for i in range(MOVING_CHECK_ARRAY_LENGTH):
-            if moving_sum_array[i] is not None:
-                compare_val += moving_sum_array[i]
-                num_to_mult_by = i + 1
-        if (summed_ext_diff * num_to_mult_by) > (ROTATING_CHECK_MULT * compare_val):
-            apparent_rotation = True
-    return apparent_rotation
+    return detector.currently_rotating()
 
 
 def init():
-    global moving, rotating
-    global moving_search_status
-    global rotating_search_status
-    init_thresh_search()
-    reset_moving_array()
-    moving = Indicator.TBD
-    rotating = Indicator.TBD
-    moving_search_status = SearchStatus.NEEDS_INIT
-    rotating_search_status = SearchStatus.NEEDS_INIT
+    detector.init()
 
 
 def process(mag_x, mag_y, mag_z, time_stamp):
-    """updates the two GLOBAL variables moving and rotating
+    """updates the moving and rotating parameters of the default detector"""
+    detector.process(mag_x, mag_y, mag_z, time_stamp)
 
-    two checks at different speeds: fast for "moving"
-    and slow for "rotating".  The extrema from the fast
-    check are used in the slow check because we expect
-    to see more than just the "up and down" variations
-    in the rotating check.  Averages of the last "few"
 
+def window_end(time_stamps, start, period, monotonic):
+    """returns the index of the first sample after start with a time stamp
+    later than time_stamps[start] + period, or None if the data runs out first
 
+    this is the sample on which process() closes a search window that was
+    opened (initialized) on sample start
     """
-    global thresh_set
-
-    global end_moving_search_time
-    global moving
-    global moving_search_status
-    global moving_sum_array
-    global moving_sum_array_counter
-
-    global end_rotating_search_time
-    global rotating
-    global rotating_search_status
-
-    if not thresh_set:
-        update_thresh(mag_x, mag_y, mag_z)
-    else:
-        if moving_search_status == SearchStatus.NEEDS_INIT:
-            init_moving_search()  # initialize the mins and maxes
-            end_moving_search_time = time_stamp + MOVING_CHECK_SECONDS
-            moving_search_status = SearchStatus.UPDATING
-        elif moving_search_status == SearchStatus.UPDATING:
-            update_moving_search(mag_x, mag_y, mag_z)
-            if time_stamp > end_moving_search_time:
-                if currently_moving():
-                    moving = Indicator.YES
-                    update_moving_array()
-                else:
-                    moving = Indicator.NO
-                    # if we are not moving, then array should be reset
-                    reset_moving_array()
-                    rotating = Indicator.NO  # and can't possibly be rotating
-                    rotating_search_status = SearchStatus.NEEDS_INIT
-                # switch back to init again
-                moving_search_status = SearchStatus.NEEDS_INIT
-
-        if moving == Indicator.YES:
-            # only need to bother searching for rotation if we are moving
-            if rotating_search_status == SearchStatus.NEEDS_INIT:
-                init_rotating_search()  # initialize the mins and maxes
-                end_rotating_search_time = time_stamp + ROTATING_CHECK_SECONDS
-                rotating_search_status = SearchStatus.UPDATING
-            elif rotating_search_status == SearchStatus.UPDATING:
-                update_rotating_search(mag_x, mag_y, mag_z)
-                if time_stamp > end_rotating_search_time:
-                    if currently_rotating():
-                        rotating = Indicator.YES
-                    else:
-                        rotating = Indicator.NO
-                    rotating_search_status = SearchStatus.NEEDS_INIT
+    end_time = time_stamps[start] + period
+    if monotonic:
+        end = max(int(np.searchsorted(time_stamps, end_time, side='right')), start + 1)
+        return end if end < len(time_stamps) else None
+    # time has gone backwards somewhere - scan forward in growing chunks
+    chunk = 256
+    lo = start + 1
+    while lo < len(time_stamps):
+        hi = min(lo + chunk, len(time_stamps))
+        later = np.flatnonzero(time_stamps[lo:hi] > end_time)
+        if len(later):
+            return lo + int(later[0])
+        lo = hi
+        chunk *= 2
+    return None
+
+
+def segment_extrema(values, starts, stops, init_max=INIT_MAX_SEARCH, init_min=INIT_MIN_SEARCH):
+    """max and min of values[starts[i]:stops[i]] for each (non-empty, ordered,
+    non-overlapping) segment, seeded like the scalar searches are"""
+    if len(starts) == 0:
+        return np.empty(0), np.empty(0)
+    bounds = np.empty(2 * len(starts), dtype=np.intp)
+    bounds[0::2] = starts
+    bounds[1::2] = stops
+    if bounds[-1] == len(values):
+        bounds = bounds[:-1]
+    seg_max = np.maximum.reduceat(values, bounds)[0::2]
+    seg_min = np.minimum.reduceat(values, bounds)[0::2]
+    return np.maximum(seg_max, init_max), np.minimum(seg_min, init_min)
+
+
+def segment_sums(mag_x, mag_y, mag_z, starts, stops):
+    """summed (max - min) over the three channels for each segment"""
+    x_max, x_min = segment_extrema(mag_x, starts, stops)
+    y_max, y_min = segment_extrema(mag_y, starts, stops)
+    z_max, z_min = segment_extrema(mag_z, starts, stops)
+    return (x_max + y_max + z_max) - (x_min + y_min + z_min)
+
+
+def step_function(length, change_at, values, initial):
+    """per-sample array that takes values[i] from sample change_at[i] onwards"""
+    marker = np.full(length, -1, dtype=np.intp)
+    marker[change_at] = np.arange(len(change_at))
+    marker = np.maximum.accumulate(marker)
+    out = np.full(length, int(initial), dtype=np.int8)
+    set_samples = marker >= 0
+    out[set_samples] = np.asarray(values, dtype=np.int8)[marker[set_samples]]
+    return out
+
+
+def count_transitions(moving, rotating):
+    """instrumentation counters of a process_array result"""
+    Instrumentation.count('samples processed', len(moving))
+    Instrumentation.count('moving transitions', int(np.count_nonzero(moving[1:] != moving[:-1])))
+    Instrumentation.count('rotating transitions', int(np.count_nonzero(rotating[1:] != rotating[:-1])))
+
+
+@Instrumentation.staged('rotation detection')
+def process_array(mag_x, mag_y, mag_z, pod_time):
+    """batch version of init() followed by process() on every sample
+
+    returns two int8 arrays (moving, rotating) holding, for every sample, the
+    Indicator value the "moving" and "rotating" parameters would have right
+    after process() was called on that sample.  The module globals are not
+    touched.
+
+    The search windows only depend on the time stamps, so their boundaries
+    are found up front (searchsorted) and the extrema of every window are
+    computed with segment reductions.  Only the short per-window bookkeeping
+    (moving_sum_array, rotation windows) is done in a python loop, which runs
+    once per window instead of once per sample.
+    """
+    mag_x = np.asarray(mag_x, dtype=np.float64)
+    mag_y = np.asarray(mag_y, dtype=np.float64)
+    mag_z = np.asarray(mag_z, dtype=np.float64)
+    time_stamps = np.asarray(pod_time, dtype=np.float64)
+    num_samples = len(time_stamps)
+    monotonic = bool(np.all(time_stamps[1:] >= time_stamps[:-1]))
+
+    thresh_length = THRESH_SAMPLES * NUM_THRESH_CHECKS
+    if num_samples < thresh_length:
+        Instrumentation.count('samples processed', num_samples)
+        return (np.full(num_samples, int(Indicator.TBD), dtype=np.int8),
+                np.full(num_samples, int(Indicator.TBD), dtype=np.int8))
+
+    # noise threshold - same accumulation order as update_thresh
+    thresh_starts = np.arange(0, thresh_length, THRESH_SAMPLES)
+    thresh_sums = segment_sums(mag_x, mag_y, mag_z, thresh_starts, thresh_starts + THRESH_SAMPLES)
+    thresh = 0
+    for thresh_sum in thresh_sums:
+        thresh += float(thresh_sum)
+    thresh /= NUM_THRESH_CHECKS
+    thresh *= MOVING_THRESH_MULT
+
+    # moving search windows: opened on sample start, closed on sample end
+    moving_starts = []
+    moving_ends = []
+    start = thresh_length
+    while start < num_samples:
+        end = window_end(time_stamps, start, MOVING_CHECK_SECONDS, monotonic)
+        if end is None:
+            break
+        moving_starts.append(start)
+        moving_ends.append(end)
+        start = end + 1
+    moving_ends = np.asarray(moving_ends, dtype=np.intp)
+    moving_window_sums = segment_sums(mag_x, mag_y, mag_z,
+                                      np.asarray(moving_starts, dtype=np.intp) + 1, moving_ends + 1)
+    moving_decisions = moving_window_sums > thresh
+
+    # replay moving_sum_array so each moving window end has the "average" it leaves behind
+    compare_vals = np.empty(len(moving_ends))
+    compare_counts = np.empty(len(moving_ends), dtype=np.intp)
+    sum_array = [None] * MOVING_CHECK_ARRAY_LENGTH
+    sum_array_counter = 0
+    for k, (is_moving, window_sum) in enumerate(zip(moving_decisions, moving_window_sums)):
+        if is_moving:
+            sum_array[sum_array_counter] = float(window_sum)
+            sum_array_counter = (sum_array_counter + 1) % MOVING_CHECK_ARRAY_LENGTH
+        else:
+            sum_array = [None] * MOVING_CHECK_ARRAY_LENGTH
+            sum_array_counter = 0
+        compare_val = 0
+        num_to_mult_by = 0
+        for i in range(MOVING_CHECK_ARRAY_LENGTH):
+            if sum_array[i] is not None:
+                compare_val += sum_array[i]
+                num_to_mult_by = i + 1
+        compare_vals[k] = compare_val
+        compare_counts[k] = num_to_mult_by
+
+    # rotating search windows only run while moving is latched to YES, i.e.
+    # from a YES window end up to (not including) the next NO window end
+    rotating_starts = []
+    rotating_ends = []
+    no_ends = []
+    k = 0
+    while k < len(moving_ends):
+        if not moving_decisions[k]:
+            no_ends.append(moving_ends[k])
+            k += 1
+            continue
+        yes_from = moving_ends[k]
+        while k < len(moving_ends) and moving_decisions[k]:
+            k += 1
+        yes_until = moving_ends[k] if k < len(moving_ends) else num_samples
+        start = yes_from
+        while start < yes_until:
+            end = window_end(time_stamps, start, ROTATING_CHECK_SECONDS, monotonic)
+            if end is None or end >= yes_until:
+                break
+            rotating_starts.append(start)
+            rotating_ends.append(end)
+            start = end + 1
+    rotating_ends = np.asarray(rotating_ends, dtype=np.intp)
+    rotating_window_sums = segment_sums(mag_x, mag_y, mag_z,
+                                        np.asarray(rotating_starts, dtype=np.intp) + 1, rotating_ends + 1)
+    latest_moving = np.searchsorted(moving_ends, rotating_ends, side='right') - 1
+    rotating_decisions = ((rotating_window_sums * compare_counts[latest_moving])
+                          > (ROTATING_CHECK_MULT * compare_vals[latest_moving]))
+
+    moving_out = step_function(num_samples, moving_ends,
+                               np.where(moving_decisions, Indicator.YES, Indicator.NO), Indicator.TBD)
+    rotating_change_at = np.concatenate([rotating_ends, np.asarray(no_ends, dtype=np.intp)])
+    rotating_values = np.concatenate([np.where(rotating_decisions, Indicator.YES, Indicator.NO),
+                                      np.full(len(no_ends), int(Indicator.NO))])
+    order = np.argsort(rotating_change_at, kind='stable')
+    rotating_out = step_function(num_samples, rotating_change_at[order], rotating_values[order], Indicator.TBD)
+    count_transitions(moving_out, rotating_out)
+    return moving_out, rotating_out
+
+
+def check_process_array(mag_x, mag_y, mag_z, pod_time):
+    """runs a RotationDetector sample by sample and process_array() on the same
+    data, returns the number of samples on which the indicators disagree"""
+    scalar = RotationDetector()
+    scalar_moving = np.empty(len(pod_time), dtype=np.int8)
+    scalar_rotating = np.empty(len(pod_time), dtype=np.int8)
+    for i in range(len(pod_time)):
+        scalar.process(float(mag_x[i]), float(mag_y[i]), float(mag_z[i]), float(pod_time[i]))
+        scalar_moving[i] = scalar.moving
+        scalar_rotating[i] = scalar.rotating
+    batch_moving, batch_rotating = process_array(mag_x, mag_y, mag_z, pod_time)
+    return int(np.count_nonzero((scalar_moving != batch_moving) | (scalar_rotating != batch_rotating)))
+
+
+if __name__ == "__main__":
+    import sys
+
+    # check the batch path against the scalar one on a log file (first argument)
+    # and on a couple of hours of synthetic data, which exercises the rotation windows;
+    # exits with 1 if they disagree anywhere, so it can gate changes to either
+    failed = []
+    if len(sys.argv) > 1:
+        import MagnetometerLog
+
+        columns = MagnetometerLog.read_log(sys.argv[1])
+        for mac in MagnetometerLog.macs_in(columns):
+            pod = columns['mac'] == mac.encode()
+            mismatches = check_process_array(columns['mag_x'][pod], columns['mag_y'][pod],
+                                             columns['mag_z'][pod], columns['pod_time'][pod])
+            print(f"{sys.argv[1]} {mac}: {np.count_nonzero(pod)} samples, {mismatches} mismatches")
+            if mismatches:
+                failed.append(f"{sys.argv[1]} {mac}")
+
+    rng = np.random.default_rng(0)
+    t = 1000.0 + np.cumsum(rng.uniform(0.02, 0.06, 400000))
+    running = (t // 1500) % 4 != 3  # stopped every fourth 25 minutes
+    stroke = 40 * np.sin(2 * np.pi * t / 8) * running
+    drift = 300 * np.sin(2 * np.pi * t / 3000) * ((t // 2500) % 2 == 0)
+    noise = rng.integers(-3, 4, (3, len(t)))
+    mismatches = check_process_array(stroke + drift + noise[0], 0.5 * stroke - drift + noise[1],
+                                     0.2 * stroke + noise[2], t)
+    print(f"synthetic: {len(t)} samples, {mismatches} mismatches")
+    if mismatches:
+        failed.append("synthetic")
+
+    if failed:
+        print(f"process_array disagrees with process() on: {', '.join(failed)}")
+        sys.exit(1)
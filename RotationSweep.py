@@ -0,0 +1,344 @@
+"""
+Sweep of the RotationDetection parameters over a grid, in one pass over a log.
+
+Usage is:
+
+python RotationSweep.py CRC4_2019-3-24.log --moving-thresh-mult 3 4 5 6 7 \
+    --moving-check-seconds 30 60 --rotating-check-seconds 600 1200 --rotating-check-mult 1.5 2 3 4 5 \
+    [--output sweep.csv] [--check]
+
+(--check also runs RotationDetection.process_array on up to CHECK_POINTS
+points of the grid and exits with 1 if the sweep disagrees with it anywhere)
+
+or from code
+
+* rows = sweep_pod(mag_x, mag_y, mag_z, pod_time, grid)
+    ** grid is a list of Parameters, rows has one dict per entry (same order):
+       the parameters, moving_fraction, rotating_fraction (of the samples
+       with the indicator YES), moving_transitions and rotating_transitions
+       (changes of the per-sample indicator, as counted for Instrumentation)
+
+Every configuration gives exactly what RotationDetection.process_array gives
+with the module constants set to it, but the work is shared:
+
+* the noise threshold is found once and scaled by every MOVING_THRESH_MULT
+* the moving windows and their extrema are found once per MOVING_CHECK_SECONDS,
+  and compared against all the thresholds at once (a configurations x windows
+  matrix), the moving_sum_array bookkeeping is replayed for all of them with
+  cumulative sums
+* the rotating windows of a configuration are cut from its moving YES spans,
+  once per ROTATING_CHECK_SECONDS, and their extrema come from a RangeExtrema
+  table built once for the pod, so a window costs O(BLOCK) however long it is
+* the rotating decisions of all the ROTATING_CHECK_MULT values are one
+  broadcast comparison
+
+The per-sample indicators are never built, the statistics come from the
+change points.
+"""
+
+import argparse
+import csv
+import itertools
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+
+import MagnetometerLog
+import RotationDetection
+from RotationDetection import Indicator
+
+Parameters = namedtuple('Parameters', 'moving_thresh_mult moving_check_seconds '
+                                      'rotating_check_seconds rotating_check_mult')
+
+SWEEP_FIELDS = Parameters._fields + ('mac', 'samples', 'moving_fraction', 'rotating_fraction',
+                                     'moving_transitions', 'rotating_transitions')
+BLOCK = 256  # samples per block of the RangeExtrema tables
+CHECK_POINTS = 4  # grid points checked against process_array with --check
+
+
+def parameter_grid(moving_thresh_mults, moving_check_seconds, rotating_check_seconds, rotating_check_mults):
+    """every combination of the values, as Parameters"""
+    return [Parameters(*values) for values in itertools.product(moving_thresh_mults, moving_check_seconds,
+                                                                rotating_check_seconds, rotating_check_mults)]
+
+
+def default_parameters():
+    """the Parameters RotationDetection runs with"""
+    return Parameters(RotationDetection.MOVING_THRESH_MULT, RotationDetection.MOVING_CHECK_SECONDS,
+                      RotationDetection.ROTATING_CHECK_SECONDS, RotationDetection.ROTATING_CHECK_MULT)
+
+
+class RangeExtrema:
+    """max and min of arbitrary ranges of a few channels, from per block sparse tables"""
+
+    __slots__ = ('channels', 'max_tables', 'min_tables')
+
+    def __init__(self, channels):
+        self.channels = channels
+        self.max_tables = []
+        self.min_tables = []
+        for values in channels:
+            full = len(values) // BLOCK
+            blocks = values[:full * BLOCK].reshape(full, BLOCK)
+            self.max_tables.append(self.sparse_table(blocks.max(axis=1) if full else np.empty(0), np.maximum))
+            self.min_tables.append(self.sparse_table(blocks.min(axis=1) if full else np.empty(0), np.minimum))
+
+    @staticmethod
+    def sparse_table(values, combine):
+        """level k, entry i holds combine() of values[i:i + 2 ** k]"""
+        levels = [values]
+        while 2 ** len(levels) <= len(values):
+            previous = levels[-1]
+            half = 2 ** (len(levels) - 1)
+            levels.append(combine(previous[:-half], previous[half:]))
+        table = np.empty((len(levels), len(values)))
+        for level, row in enumerate(levels):
+            table[level, :len(row)] = row
+        return table
+
+    def summed_differences(self, starts, stops):
+        """(x_max + y_max + z_max) - (x_min + y_min + z_min) of values[starts[i]:stops[i]],
+        seeded like RotationDetection.segment_extrema (so equal to segment_sums)"""
+        starts = np.asarray(starts, dtype=np.intp)
+        stops = np.asarray(stops, dtype=np.intp)
+        first_block = -(-starts // BLOCK)
+        stop_block = stops // BLOCK
+        has_blocks = first_block < stop_block
+        # the ranges are whole blocks with a partial block on either side
+        left_stop = np.minimum(first_block * BLOCK, stops)
+        right_start = np.maximum(stop_block * BLOCK, left_stop)
+        level = np.zeros(len(starts), dtype=np.intp)
+        level[has_blocks] = np.floor(np.log2(stop_block[has_blocks] - first_block[has_blocks])).astype(np.intp)
+        low = np.where(has_blocks, first_block, 0)
+        high = np.where(has_blocks, stop_block - 2 ** level, 0)
+        edge = np.arange(BLOCK)
+        maxima = []
+        minima = []
+        for values, max_table, min_table in zip(self.channels, self.max_tables, self.min_tables):
+            channel_max = np.full(len(starts), RotationDetection.INIT_MAX_SEARCH)
+            channel_min = np.full(len(starts), RotationDetection.INIT_MIN_SEARCH)
+            if len(max_table[0]):
+                blocks_max = np.maximum(max_table[level, low], max_table[level, high])
+                blocks_min = np.minimum(min_table[level, low], min_table[level, high])
+                channel_max = np.where(has_blocks, np.maximum(blocks_max, channel_max), channel_max)
+                channel_min = np.where(has_blocks, np.minimum(blocks_min, channel_min), channel_min)
+            for edge_start, edge_stop in ((starts, left_stop), (right_start, stops)):
+                index = edge_start[:, np.newaxis] + edge
+                inside = index < edge_stop[:, np.newaxis]
+                edge_values = values[np.minimum(index, len(values) - 1)]
+                channel_max = np.maximum(channel_max, np.where(inside, edge_values, -np.inf).max(axis=1))
+                channel_min = np.minimum(channel_min, np.where(inside, edge_values, np.inf).min(axis=1))
+            maxima.append(channel_max)
+            minima.append(channel_min)
+        return (maxima[0] + maxima[1] + maxima[2]) - (minima[0] + minima[1] + minima[2])
+
+
+def chain_windows(time_stamps, start, stop, seconds, monotonic):
+    """(starts, ends) of back to back search windows from sample start, as process() opens
+    and closes them, keeping only the windows that close before sample stop"""
+    starts = []
+    ends = []
+    while start < stop:
+        end = RotationDetection.window_end(time_stamps, start, seconds, monotonic)
+        if end is None or end >= stop:
+            break
+        starts.append(start)
+        ends.append(end)
+        start = end + 1
+    return np.asarray(starts, dtype=np.intp), np.asarray(ends, dtype=np.intp)
+
+
+def replay_moving_sums(decisions, window_sums):
+    """(compare_vals, compare_counts) left in moving_sum_array after every moving window,
+    for every row (configuration) of decisions at once
+
+    the array holds the sums of the last (up to MOVING_CHECK_ARRAY_LENGTH) windows
+    of the current run of YES windows, and is emptied by a NO window
+    """
+    configurations, windows = decisions.shape
+    index = np.arange(windows)
+    last_no = np.maximum.accumulate(np.where(decisions, -1, index), axis=1)
+    counts = np.minimum(index - last_no, RotationDetection.MOVING_CHECK_ARRAY_LENGTH)
+    cumulative = np.zeros((configurations, windows + 1))
+    np.cumsum(np.where(decisions, window_sums, 0.0), axis=1, out=cumulative[:, 1:])
+    rows = np.arange(configurations)[:, np.newaxis]
+    compare_vals = cumulative[rows, index + 1] - cumulative[rows, index + 1 - counts]
+    return compare_vals, counts
+
+
+def indicator_statistics(num_samples, change_at, values):
+    """(fraction of samples YES, transitions) of the step function step_function() would build"""
+    if len(change_at) == 0:
+        return 0.0, 0
+    previous = np.concatenate(([int(Indicator.TBD)], values[:-1]))
+    transitions = int(np.count_nonzero(values != previous))
+    lengths = np.diff(np.append(change_at, num_samples))
+    return float(lengths[values == Indicator.YES].sum()) / num_samples, transitions
+
+
+def sweep_changes(mag_x, mag_y, mag_z, pod_time, grid):
+    """yields (grid position, (moving_ends, moving_values), (rotating_change_at, rotating_values))
+    for every Parameters of the grid, the change points of process_array's output"""
+    mag_x = np.asarray(mag_x, dtype=np.float64)
+    mag_y = np.asarray(mag_y, dtype=np.float64)
+    mag_z = np.asarray(mag_z, dtype=np.float64)
+    time_stamps = np.asarray(pod_time, dtype=np.float64)
+    num_samples = len(time_stamps)
+    monotonic = bool(np.all(time_stamps[1:] >= time_stamps[:-1]))
+    no_changes = (np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.int8))
+
+    thresh_length = RotationDetection.THRESH_SAMPLES * RotationDetection.NUM_THRESH_CHECKS
+    if num_samples < thresh_length:
+        for position in range(len(grid)):
+            yield position, no_changes, no_changes
+        return
+
+    # noise threshold, before MOVING_THRESH_MULT - same accumulation order as process_array
+    thresh_starts = np.arange(0, thresh_length, RotationDetection.THRESH_SAMPLES)
+    thresh_sums = RotationDetection.segment_sums(mag_x, mag_y, mag_z, thresh_starts,
+                                                 thresh_starts + RotationDetection.THRESH_SAMPLES)
+    noise_thresh = 0
+    for thresh_sum in thresh_sums:
+        noise_thresh += float(thresh_sum)
+    noise_thresh /= RotationDetection.NUM_THRESH_CHECKS
+
+    extrema = RangeExtrema((mag_x, mag_y, mag_z))
+    by_moving_seconds = {}
+    for position, parameters in enumerate(grid):
+        by_moving_seconds.setdefault(parameters.moving_check_seconds, []).append(position)
+
+    for moving_seconds, positions in by_moving_seconds.items():
+        moving_starts, moving_ends = chain_windows(time_stamps, thresh_length, num_samples, moving_seconds, monotonic)
+        window_sums = RotationDetection.segment_sums(mag_x, mag_y, mag_z, moving_starts + 1, moving_ends + 1)
+        mults = sorted({grid[position].moving_thresh_mult for position in positions})
+        decisions = window_sums > np.array([noise_thresh * mult for mult in mults])[:, np.newaxis]
+        compare_vals, compare_counts = replay_moving_sums(decisions, window_sums)
+        moving_values = np.where(decisions, Indicator.YES, Indicator.NO).astype(np.int8)
+
+        for row, mult in enumerate(mults):
+            is_moving = decisions[row]
+            # moving is latched YES from a YES window end up to the next NO window end
+            no_ends = moving_ends[~is_moving]
+            span_starts = moving_ends[is_moving & ~np.concatenate(([False], is_moving[:-1]))]
+            span_stops = np.append(no_ends, num_samples)[np.searchsorted(no_ends, span_starts)]
+            at_mult = [position for position in positions if grid[position].moving_thresh_mult == mult]
+            by_rotating_seconds = {}
+            for position in at_mult:
+                by_rotating_seconds.setdefault(grid[position].rotating_check_seconds, []).append(position)
+
+            for rotating_seconds, rotating_positions in by_rotating_seconds.items():
+                starts = []
+                ends = []
+                for span_start, span_stop in zip(span_starts.tolist(), span_stops.tolist()):
+                    span_window_starts, span_window_ends = chain_windows(time_stamps, span_start, span_stop,
+                                                                         rotating_seconds, monotonic)
+                    starts.append(span_window_starts)
+                    ends.append(span_window_ends)
+                rotating_starts = np.concatenate(starts) if starts else np.zeros(0, dtype=np.intp)
+                rotating_ends = np.concatenate(ends) if ends else np.zeros(0, dtype=np.intp)
+                rotating_sums = extrema.summed_differences(rotating_starts + 1, rotating_ends + 1)
+                latest_moving = np.searchsorted(moving_ends, rotating_ends, side='right') - 1
+                rotating_change_at = np.concatenate([rotating_ends, no_ends])
+                order = np.argsort(rotating_change_at, kind='stable')
+                for position in rotating_positions:
+                    rotating_decisions = ((rotating_sums * compare_counts[row, latest_moving])
+                                          > (grid[position].rotating_check_mult * compare_vals[row, latest_moving]))
+                    rotating_values = np.concatenate([np.where(rotating_decisions, Indicator.YES, Indicator.NO),
+                                                      np.full(len(no_ends), int(Indicator.NO))]).astype(np.int8)
+                    yield (position, (moving_ends, moving_values[row]),
+                           (rotating_change_at[order], rotating_values[order]))
+
+
+def sweep_pod(mag_x, mag_y, mag_z, pod_time, grid):
+    """one row of statistics per Parameters of the grid, see the module docstring"""
+    num_samples = len(pod_time)
+    rows = [None] * len(grid)
+    for position, moving_changes, rotating_changes in sweep_changes(mag_x, mag_y, mag_z, pod_time, grid):
+        moving_fraction, moving_transitions = indicator_statistics(num_samples, *moving_changes)
+        rotating_fraction, rotating_transitions = indicator_statistics(num_samples, *rotating_changes)
+        rows[position] = dict(grid[position]._asdict(), samples=num_samples,
+                              moving_fraction=moving_fraction, rotating_fraction=rotating_fraction,
+                              moving_transitions=moving_transitions, rotating_transitions=rotating_transitions)
+    return rows
+
+
+def check_sweep(mag_x, mag_y, mag_z, pod_time, grid):
+    """runs process_array with the RotationDetection constants set to every
+    Parameters of the grid and compares it with the indicators the sweep gives,
+    returns the number of (configuration, sample) pairs that disagree"""
+    names = ('MOVING_THRESH_MULT', 'MOVING_CHECK_SECONDS', 'ROTATING_CHECK_SECONDS', 'ROTATING_CHECK_MULT')
+    num_samples = len(pod_time)
+    changes = list(sweep_changes(mag_x, mag_y, mag_z, pod_time, grid))
+    saved = [getattr(RotationDetection, name) for name in names]
+    mismatches = 0
+    try:
+        for position, moving_changes, rotating_changes in changes:
+            for name, value in zip(names, grid[position]):
+                setattr(RotationDetection, name, value)
+            moving, rotating = RotationDetection.process_array(mag_x, mag_y, mag_z, pod_time)
+            swept_moving = RotationDetection.step_function(num_samples, *moving_changes, Indicator.TBD)
+            swept_rotating = RotationDetection.step_function(num_samples, *rotating_changes, Indicator.TBD)
+            mismatches += int(np.count_nonzero((swept_moving != moving) | (swept_rotating != rotating)))
+    finally:
+        for name, value in zip(names, saved):
+            setattr(RotationDetection, name, value)
+    return mismatches
+
+
+def sweep_log(file_name, grid):
+    """sweep_pod rows of every pod of a magnetometer log, with a 'mac' column"""
+    columns = MagnetometerLog.read_log(file_name)
+    rows = []
+    for mac in MagnetometerLog.macs_in(columns):
+        pod = columns['mac'] == mac.encode()
+        for row in sweep_pod(columns['mag_x'][pod], columns['mag_y'][pod], columns['mag_z'][pod],
+                             columns['pod_time'][pod], grid):
+            row['mac'] = mac
+            rows.append(row)
+    return rows
+
+
+def main():
+    defaults = default_parameters()
+    parser = argparse.ArgumentParser(description="Sweep the rotation detector's parameters over a magnetometer log")
+    parser.add_argument('log_file')
+    parser.add_argument('--moving-thresh-mult', type=float, nargs='+', default=[defaults.moving_thresh_mult])
+    parser.add_argument('--moving-check-seconds', type=float, nargs='+', default=[defaults.moving_check_seconds])
+    parser.add_argument('--rotating-check-seconds', type=float, nargs='+',
+                        default=[defaults.rotating_check_seconds])
+    parser.add_argument('--rotating-check-mult', type=float, nargs='+', default=[defaults.rotating_check_mult])
+    parser.add_argument('--output', default='sweep.csv')
+    parser.add_argument('--check', action='store_true',
+                        help=f"check up to {CHECK_POINTS} points of the grid against RotationDetection.process_array")
+    args = parser.parse_args()
+
+    grid = parameter_grid(args.moving_thresh_mult, args.moving_check_seconds,
+                          args.rotating_check_seconds, args.rotating_check_mult)
+    start = time.perf_counter()
+    rows = sweep_log(args.log_file, grid)
+    with open(args.output, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SWEEP_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"{len(grid)} parameter sets, {len(rows)} rows to {args.output} in {time.perf_counter() - start:.2f} s")
+
+    if args.check:
+        check_grid = grid[::-(-len(grid) // CHECK_POINTS)]  # spread over the grid
+        columns = MagnetometerLog.read_log(args.log_file)
+        failed = []
+        for mac in MagnetometerLog.macs_in(columns):
+            pod = columns['mac'] == mac.encode()
+            mismatches = check_sweep(columns['mag_x'][pod], columns['mag_y'][pod], columns['mag_z'][pod],
+                                     columns['pod_time'][pod], check_grid)
+            print(f"{mac}: {len(check_grid)} parameter sets checked, {mismatches} mismatches")
+            if mismatches:
+                failed.append(mac)
+        if failed:
+            print(f"the sweep disagrees with process_array on: {', '.join(failed)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
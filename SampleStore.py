@@ -0,0 +1,207 @@
+"""
+Bounded, typed storage of rotator samples, one ring buffer per pod.
+
+Usage is:
+
+* store = SampleStore(retention_seconds=48 * 3600)
+* store.append(columns) with a column dict from MagnetometerLog (read_log,
+  parse_chunk, LogCache.load_log, ...), optionally with 'moving' and
+  'rotating' indicator columns
+* for mac in store.macs(): samples = store.samples(mac)
+    ** a column dict (see STORE_COLUMNS) of that pod's retained samples,
+       oldest first, as views of the buffers
+* store.set_indicators(mac, moving, rotating) after running
+  RotationDetection.process_array on samples()
+* python SampleStore.py checks the expiry on a synthetic log across midnight
+
+Each pod keeps at most max_samples samples, and only the ones within
+retention_seconds (of rtu time) of its newest sample; older samples are
+overwritten in place, so memory stays at max_samples * SAMPLE_BYTES per pod
+however long the log.  The magnetometer and accelerometer values are whole
+numbers well inside float32's exact range, the rtu time is kept as int64
+microseconds (as unwrapped by MagnetometerLog.unwrap_times) and pod_time stays
+float64 since the detector's windows depend on its fractions of a tick.
+"""
+
+import numpy as np
+
+import MagnetometerLog
+import RotationDetection
+
+# name -> dtype of the stored columns
+STORE_COLUMNS = {
+    'time': np.int64,  # rtu time, microseconds
+    'pod_time': np.float64,
+    'accel_y': np.float32,
+    'mag_x': np.float32,
+    'mag_y': np.float32,
+    'mag_z': np.float32,
+    'moving': np.int8,  # RotationDetection.Indicator values
+    'rotating': np.int8,
+}
+SAMPLE_BYTES = sum(np.dtype(dtype).itemsize for dtype in STORE_COLUMNS.values())
+MAX_SAMPLES = 25 * 3600 * 24 * 2  # two days of a pod at 25 Hz
+
+
+class PodSamples:
+    """ring buffer of one pod's samples; start is the oldest, size the number retained
+
+    the buffers grow (doubling) as samples come in, up to max_samples
+    """
+
+    __slots__ = ('buffers', 'start', 'size', 'max_samples')
+
+    def __init__(self, max_samples):
+        self.buffers = {name: np.empty(0, dtype=dtype) for name, dtype in STORE_COLUMNS.items()}
+        self.start = 0
+        self.size = 0
+        self.max_samples = max_samples
+
+    @property
+    def capacity(self):
+        return len(self.buffers['time'])
+
+    def reserve(self, count):
+        """makes room for count samples (as far as max_samples allows) without dropping any"""
+        if count <= self.capacity or self.capacity == self.max_samples:
+            return
+        capacity = min(max(count, 2 * self.capacity), self.max_samples)
+        samples = self.samples()
+        for name, dtype in STORE_COLUMNS.items():
+            buffer = np.empty(capacity, dtype=dtype)
+            buffer[:self.size] = samples[name]
+            self.buffers[name] = buffer
+        self.start = 0
+
+    def append(self, columns):
+        """adds the samples of a column dict, overwriting the oldest ones once full"""
+        count = len(columns['time'])
+        self.reserve(self.size + count)
+        capacity = self.capacity
+        skip = max(count - capacity, 0)  # more than fits, only the newest are kept
+        stored = count - skip
+        stop = (self.start + self.size) % capacity if capacity else 0
+        first = min(stored, capacity - stop)
+        for name, buffer in self.buffers.items():
+            values = columns.get(name)
+            if values is None:  # indicators are filled in later, see SampleStore.set_indicators
+                buffer[stop:stop + first] = int(RotationDetection.Indicator.TBD)
+                buffer[:stored - first] = int(RotationDetection.Indicator.TBD)
+                continue
+            values = values[skip:]
+            buffer[stop:stop + first] = values[:first]
+            buffer[:stored - first] = values[first:]
+        dropped = max(self.size + stored - capacity, 0)
+        if capacity:
+            self.start = (self.start + dropped) % capacity
+        self.size = min(self.size + stored, capacity)
+
+    def unwrap(self):
+        """rotates the buffers so the retained samples start at index 0"""
+        if self.start + self.size > self.capacity:
+            for name, buffer in self.buffers.items():
+                buffer[:] = np.roll(buffer, -self.start)
+            self.start = 0
+
+    def samples(self):
+        self.unwrap()
+        return {name: buffer[self.start:self.start + self.size] for name, buffer in self.buffers.items()}
+
+    def expire(self, oldest_time):
+        """drops the oldest samples up to the first one at or after oldest_time"""
+        recent = self.samples()['time'] >= oldest_time
+        old = int(np.argmax(recent)) if recent.any() else self.size
+        self.start = (self.start + old) % max(self.capacity, 1)
+        self.size -= old
+
+
+class SampleStore:
+    """the retained samples of every pod, keyed by MAC address"""
+
+    __slots__ = ('retention_seconds', 'max_samples', 'pods')
+
+    def __init__(self, retention_seconds=None, max_samples=MAX_SAMPLES):
+        self.retention_seconds = retention_seconds
+        self.max_samples = max_samples
+        self.pods = {}  # mac -> PodSamples, in order of first appearance
+
+    def __len__(self):
+        return sum(pod.size for pod in self.pods.values())
+
+    def __contains__(self, mac):
+        return mac in self.pods
+
+    def nbytes(self):
+        """memory held by the buffers"""
+        return sum(buffer.nbytes for pod in self.pods.values() for buffer in pod.buffers.values())
+
+    def clear(self):
+        self.pods = {}
+
+    def macs(self):
+        return list(self.pods)
+
+    def append(self, columns):
+        """adds a column dict with a 'mac' column, returns the MACs it had samples of"""
+        macs = []
+        for mac in MagnetometerLog.macs_in(columns):
+            pod = columns['mac'] == mac.encode()
+            self.append_pod(mac, {name: columns[name][pod] for name in STORE_COLUMNS if name in columns})
+            macs.append(mac)
+        return macs
+
+    def append_pod(self, mac, columns):
+        """adds the samples of one pod (a column dict without 'mac')"""
+        if mac not in self.pods:
+            self.pods[mac] = PodSamples(self.max_samples)
+        pod = self.pods[mac]
+        pod.append(columns)
+        if self.retention_seconds is not None and pod.size:
+            newest = pod.buffers['time'][(pod.start + pod.size - 1) % pod.capacity]
+            pod.expire(newest - int(self.retention_seconds * 10 ** 6))
+
+    def samples(self, mac):
+        """column dict of the retained samples of a pod, views of its buffers"""
+        return self.pods[mac].samples()
+
+    def set_indicators(self, mac, moving, rotating):
+        """stores the detector's output for every retained sample of a pod"""
+        samples = self.samples(mac)
+        samples['moving'][:] = moving
+        samples['rotating'][:] = rotating
+
+    def detect(self, mac):
+        """runs RotationDetection.process_array over a pod's retained samples"""
+        samples = self.samples(mac)
+        self.set_indicators(mac, *RotationDetection.process_array(samples['mag_x'], samples['mag_y'],
+                                                                  samples['mag_z'], samples['pod_time']))
+
+
+if __name__ == "__main__":
+    # self-check: two hours of a pod at 25 Hz across midnight into a 10 minute store, appended a chunk at a
+    # time with the times unwrapped as the callers do, must keep the last 10 minutes rather than everything
+    # since midnight
+    import os
+    import tempfile
+
+    import SyntheticLogs
+
+    retention_seconds = 10 * 60
+    with tempfile.TemporaryDirectory() as temp_dir:
+        log_file = os.path.join(temp_dir, 'Check_2019-3-24.log')
+        SyntheticLogs.write_magnetometer_log(log_file, 2, start_hour=23)
+        store = SampleStore(retention_seconds)
+        last_time = None
+        times = []
+        for columns in MagnetometerLog.iter_chunks(log_file):
+            columns['time'] = MagnetometerLog.unwrap_times(columns['time'], last_time)
+            if len(columns['time']):
+                last_time = int(columns['time'][-1])
+            store.append(columns)
+            times.append(columns['time'])
+    times = np.concatenate(times)
+    expected = int(np.count_nonzero(times >= times[-1] - retention_seconds * 10 ** 6))
+    retained = len(store)
+    print(f"{len(times)} samples from 23:00 to 01:00, {retained} retained for {retention_seconds} s, "
+          f"{expected} expected")
+    assert retained == expected, "samples from before midnight weren't expired"
@@ -0,0 +1,128 @@
+"""
+Generators of synthetic magnetometer and pump card logs, in the same format as
+the real ones, for benchmarks and checks.
+
+Usage is:
+
+* write_magnetometer_log(file_name, hours, pods=1, rate_hz=25)
+    ** every pod sees the pumping stroke (STROKE_SECONDS) on all three axes, a
+       slow drift as the rod rotates through the ambient field, and stretches
+       where the pump jack is stopped; the raw packet column matches the
+       decimal ones (see MagnetometerLog.PACKET_DTYPE)
+* write_pumpcard_log(file_name, hours, card_seconds=20)
+    ** 128 point position/load cards
+
+Use names like Site_2019-3-24.log and Site_2019-3-24_pumpcards.log so the
+readers can take the date from them.  Times start at start_hour and run past
+midnight for logs longer than a day, like a gateway that was left running.
+"""
+
+import numpy as np
+
+import MagnetometerLog
+import PumpCardLog
+
+STROKE_SECONDS = 8  # 7.5 SPM
+ROTATION_SECONDS = 3000  # one turn of the rod
+STOP_EVERY_SECONDS = 3 * 3600  # the pump jack stops for STOP_SECONDS this often
+STOP_SECONDS = 30 * 60
+LINES_PER_WRITE = 100000
+
+HEADER = ('{mac},Magnetometer,Raw,sequence,rtu_time(H-M-S-uS edmonton TZ),pod_time,'
+          'accel_y,mag_x,mag_y,mag_z\n')
+
+
+def pod_macs(pods):
+    return [':'.join(f'{b:02X}' for b in (0xC0, 0xFF, 0xEE, 0x00, pod // 256, pod % 256)) for pod in range(pods)]
+
+
+def rtu_time_strings(time_us, separator):
+    """microseconds (past midnight, wrapping at midnight) -> 'H-M-S-uS' style strings, not zero padded"""
+    time_us = np.asarray(time_us, dtype=np.int64) % MagnetometerLog.DAY_US
+    parts = zip((time_us // 3600000000).tolist(), (time_us // 60000000 % 60).tolist(),
+                (time_us // 1000000 % 60).tolist(), (time_us % 1000000).tolist())
+    return [f'{h}{separator}{m}{separator}{s}{separator}{us}' for h, m, s, us in parts]
+
+
+def magnetometer_samples(hours, rate_hz, rng):
+    """(seconds since start, accel_y, mag_x, mag_y, mag_z) of one pod"""
+    count = int(hours * 3600 * rate_hz)
+    period = 1 / rate_hz
+    seconds = np.cumsum(rng.uniform(0.5 * period, 1.5 * period, count))
+    running = (seconds % STOP_EVERY_SECONDS) < (STOP_EVERY_SECONDS - STOP_SECONDS)
+    stroke = np.sin(2 * np.pi * seconds / STROKE_SECONDS) * running
+    angle = 2 * np.pi * seconds / ROTATION_SECONDS + rng.uniform(0, 2 * np.pi)
+    rotation = np.cumsum(running * np.diff(angle, prepend=angle[0]))  # turns only while pumping
+    noise = rng.normal(0, 2, (4, count))
+    accel_y = 16000 + 2500 * stroke + 40 * noise[0]
+    mag_x = 400 * np.cos(rotation) + 35 * stroke + noise[1]
+    mag_y = 400 * np.sin(rotation) - 25 * stroke + noise[2]
+    mag_z = 1300 + 15 * stroke + noise[3]
+    return seconds, [np.round(v).astype(np.int64) for v in (accel_y, mag_x, mag_y, mag_z)]
+
+
+def write_magnetometer_log(file_name, hours, pods=1, rate_hz=25, start_hour=0, seed=0):
+    """writes a log of hours of samples from pods pods, returns the number of samples"""
+    rng = np.random.default_rng(seed)
+    macs = pod_macs(pods)
+    pod_ids, pod_seconds, sequence, ticks, sensors = [], [], [], [], []
+    for pod in range(pods):
+        seconds, values = magnetometer_samples(hours, rate_hz, rng)
+        pod_ids.append(np.full(len(seconds), pod))
+        pod_seconds.append(seconds)
+        sequence.append(np.arange(len(seconds)))
+        start_ticks = int(rng.uniform(1e5, 1e6) * MagnetometerLog.TICKS_PER_SECOND)
+        pod_ticks = start_ticks + np.round(seconds * MagnetometerLog.TICKS_PER_SECOND).astype(np.int64)
+        ticks.append(pod_ticks % 2 ** 32)  # the pod's counter is 32 bits
+        sensors.append(np.stack(values))
+    order = np.argsort(np.concatenate(pod_seconds), kind='stable')  # the pods interleave in time
+    pod_ids = np.concatenate(pod_ids)[order]
+    seconds = np.concatenate(pod_seconds)[order]
+    sequence = np.concatenate(sequence)[order]
+    ticks = np.concatenate(ticks)[order]
+    sensors = np.concatenate(sensors, axis=1)[:, order]
+
+    packets = np.zeros(len(order), dtype=MagnetometerLog.PACKET_DTYPE)
+    packets['rssi'] = rng.integers(-32, 0, len(order))
+    packets['header'] = np.frombuffer(b'\x0d\x01\x03\x0a\x21', dtype='V5')[0]
+    packets['counter'] = sequence % 256
+    packets['ticks'] = ticks
+    for row, name in enumerate(MagnetometerLog.SENSOR_FIELDS):
+        packets[name] = sensors[row]
+    rtu_us = start_hour * 3600 * 10 ** 6 + np.round(seconds * 10 ** 6).astype(np.int64)
+
+    with open(file_name, 'w') as f:
+        for mac in macs:
+            f.write(HEADER.format(mac=mac))
+        for first in range(0, len(order), LINES_PER_WRITE):
+            part = slice(first, first + LINES_PER_WRITE)
+            raw = packets[part].tobytes().hex()
+            width = 2 * packets.itemsize
+            rows = zip(pod_ids[part].tolist(), sequence[part].tolist(), rtu_time_strings(rtu_us[part], '-'),
+                       (ticks[part] / MagnetometerLog.TICKS_PER_SECOND).tolist(), *sensors[:, part].tolist())
+            f.writelines(f"{macs[pod]},Magnetometer,b'{raw[i * width:(i + 1) * width]}',{seq},{rtu},{pod_time!r},"
+                         f"{accel_y},{mag_x},{mag_y},{mag_z}\n"
+                         for i, (pod, seq, rtu, pod_time, accel_y, mag_x, mag_y, mag_z) in enumerate(rows))
+    return len(order)
+
+
+def write_pumpcard_log(file_name, hours, card_seconds=20, start_hour=0, seed=0,
+                       points=PumpCardLog.POINTS_PER_CARD):
+    """writes a pump card log with one card every card_seconds (or so), returns the number of cards"""
+    rng = np.random.default_rng(seed)
+    count = int(hours * 3600 / card_seconds)
+    card_us = start_hour * 3600 * 10 ** 6 + np.round(
+        np.cumsum(rng.uniform(0.9, 1.1, count)) * card_seconds * 10 ** 6).astype(np.int64)
+    phase = 2 * np.pi * np.arange(points) / points
+    # the card starts at the top of the stroke, the rods are light on the way down
+    positions = 60 * (1 + np.cos(phase)) + rng.normal(0, 0.2, (count, points))
+    upstroke = 0.5 * (1 - np.tanh(3 * np.sin(phase)))
+    peak = rng.normal(5500, 150, (count, 1))
+    loads = (5700 + peak * upstroke + 500 * np.sin(6 * phase) * upstroke
+             + rng.normal(0, 100, (count, points)))
+    with open(file_name, 'w') as f:
+        f.write('\n')
+        for time_string, position, load in zip(rtu_time_strings(card_us, ':'), positions.tolist(), loads.tolist()):
+            f.write(f"position,{time_string},{','.join(map(repr, position))}\n")
+            f.write(f"load,{time_string},{','.join(map(repr, load))}\n")
+    return count
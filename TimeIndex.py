@@ -0,0 +1,228 @@
+"""
+Sparse time index of a log file, for reading only the lines of a time window.
+
+Usage is:
+
+* columns = read_magnetometer_window(file_name, start_hour, stop_hour)
+* cards = read_card_window(file_name, start_hour, stop_hour)
+
+or, for the byte ranges themselves,
+
+* index = TimeIndex.load_or_build(file_name)
+* index.ranges(start_us, stop_us) -> [(start byte, stop byte, first line number, reference)]
+
+Every LINES_PER_ENTRY lines or so the index keeps the byte offset and line
+number of a line, plus the smallest and largest time of the lines up to the
+next entry.  Times are unwrapped (see MagnetometerLog.unwrap_times), so hours
+past 24 are on the next day, and since every block has its own min/max, lines
+that are out of order just make the blocks overlapping rather than break the
+search.  An entry is never put between two lines with the same time, so the
+position and load lines of a pump card stay in the same block.
+
+The index is saved next to the log (<log file>.tidx.npz) and rebuilt when the
+size or mtime of the log changes.  A compressed log (see CompressedLog) can't be
+seeked in, so it has no index: the window functions stream through it and keep
+only the lines of the window.
+"""
+
+import os
+
+import numpy as np
+
+import CompressedLog
+import MagnetometerLog
+import PumpCardLog
+
+INDEX_VERSION = 1
+LINES_PER_ENTRY = 1000
+HOUR_US = 3600 * 10 ** 6
+NO_TIME = np.iinfo(np.int64).max  # min_times of blocks without a time
+
+# kind -> (time field, separator of the time parts)
+TIME_FIELDS = {
+    'magnetometer': (MagnetometerLog.RTU_TIME_FIELD, ord('-')),  # H-M-S-uS
+    'pumpcards': (1, ord(':')),  # H:M:S:us
+}
+
+
+def log_kind(file_name):
+    return 'pumpcards' if 'pumpcards' in os.path.basename(file_name) else 'magnetometer'
+
+
+def scan_chunk(chunk, time_field, separator):
+    """(line starts, times, valid) of a bytes object holding whole lines"""
+    if not chunk.endswith(b'\n'):
+        chunk += b'\n'
+    pad = MagnetometerLog.PAD
+    buf = np.frombuffer(bytes(pad) + chunk + bytes(pad), dtype=np.uint8)
+    line_stops = np.flatnonzero(buf == MagnetometerLog.NEWLINE)
+    line_starts = np.empty_like(line_stops)
+    line_starts[0] = pad
+    line_starts[1:] = line_stops[:-1] + 1
+    commas = np.append(np.flatnonzero(buf == MagnetometerLog.COMMA), len(buf))
+    first = np.searchsorted(commas, line_starts) + time_field
+    field_starts = commas[np.minimum(first - 1, len(commas) - 1)] + 1
+    field_stops = commas[np.minimum(first, len(commas) - 1)]
+    valid = field_stops < line_stops  # the line has the field and one more after it
+    field_stops = np.where(valid, field_stops, field_starts)
+    times, valid_times = MagnetometerLog.parse_rtu_time(buf, field_starts, field_stops,
+                                                        np.flatnonzero(buf == separator))
+    return line_starts - pad, times, valid & valid_times
+
+
+class TimeIndex:
+    """byte offsets, line numbers and time ranges of the blocks of a log"""
+
+    __slots__ = ('offsets', 'first_lines', 'references', 'min_times', 'max_times', 'signature')
+
+    def __init__(self, offsets, first_lines, references, min_times, max_times, signature):
+        self.offsets = offsets  # one more than blocks, the last is where the indexed bytes end
+        self.first_lines = first_lines
+        self.references = references  # unwrapped time of the last line with a time before each block
+        self.min_times = min_times
+        self.max_times = max_times
+        self.signature = signature  # [INDEX_VERSION, size, mtime_ns] of the log
+
+    @staticmethod
+    def signature_of(file_name):
+        stat = os.stat(file_name)
+        return np.array([INDEX_VERSION, stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+    @classmethod
+    def build(cls, file_name, kind=None, lines_per_entry=LINES_PER_ENTRY):
+        """scans the whole log once"""
+        time_field, separator = TIME_FIELDS[kind or log_kind(file_name)]
+        signature = cls.signature_of(file_name)
+        starts, times, valid = [], [], []
+        offset = 0
+        with open(file_name, 'rb') as f:
+            carry = b''
+            while True:
+                data = f.read(MagnetometerLog.CHUNK_BYTES)
+                block = carry + data
+                # at the end of the file the last line may not have a newline
+                cut = block.rfind(b'\n') + 1 if data else len(block)
+                if cut:
+                    chunk_starts, chunk_times, chunk_valid = scan_chunk(block[:cut], time_field, separator)
+                    starts.append(chunk_starts + offset)
+                    times.append(chunk_times)
+                    valid.append(chunk_valid)
+                    offset += cut
+                carry = block[cut:]
+                if not data:
+                    break
+        starts = np.concatenate(starts) if starts else np.zeros(0, dtype=np.intp)
+        times = np.concatenate(times) if times else np.zeros(0, dtype=np.int64)
+        valid = np.concatenate(valid) if valid else np.zeros(0, dtype=bool)
+        num_lines = len(starts)
+        if num_lines == 0:
+            empty = np.zeros(0, dtype=np.int64)
+            return cls(np.zeros(1, dtype=np.int64), empty, empty, empty, empty, signature)
+
+        unwrapped = np.zeros(num_lines, dtype=np.int64)
+        unwrapped[valid] = MagnetometerLog.unwrap_times(times[valid])
+        # blocks start at multiples of lines_per_entry, moved down to the next line
+        # whose time differs from the line before
+        differs = np.flatnonzero(np.concatenate(([True], (times[1:] != times[:-1]) | ~valid[1:])))
+        wanted = np.arange(0, num_lines, lines_per_entry)
+        block_starts = np.unique(differs[np.minimum(np.searchsorted(differs, wanted), len(differs) - 1)])
+        min_times = np.minimum.reduceat(np.where(valid, unwrapped, NO_TIME), block_starts)
+        max_times = np.maximum.reduceat(np.where(valid, unwrapped, -1), block_starts)
+        last_valid = np.maximum.accumulate(np.where(valid, np.arange(num_lines), -1))
+        before = np.where(block_starts > 0, last_valid[np.maximum(block_starts - 1, 0)], -1)
+        first_time = unwrapped[valid][0] if np.any(valid) else 0
+        references = np.where(before >= 0, unwrapped[np.maximum(before, 0)], first_time)
+        offsets = np.append(starts[block_starts], signature[1]).astype(np.int64)
+        return cls(offsets, block_starts.astype(np.int64) + 1, references, min_times, max_times, signature)
+
+    def save(self, index_file):
+        with open(index_file, 'wb') as f:
+            np.savez(f, **{name: getattr(self, name) for name in self.__slots__})
+
+    @classmethod
+    def load(cls, index_file):
+        with np.load(index_file) as arrays:
+            return cls(*[arrays[name] for name in cls.__slots__])
+
+    @classmethod
+    def load_or_build(cls, file_name, kind=None):
+        """the saved index of the log, built (and saved) first if missing or out of date"""
+        index_file = file_name + '.tidx.npz'
+        try:
+            index = cls.load(index_file)
+            if np.array_equal(index.signature, cls.signature_of(file_name)):
+                return index
+        except (OSError, ValueError, KeyError):
+            pass
+        index = cls.build(file_name, kind)
+        try:
+            index.save(index_file)
+        except OSError:  # read only directory, just don't keep it
+            pass
+        return index
+
+    def ranges(self, start_us, stop_us):
+        """byte ranges holding every line with start_us <= unwrapped time < stop_us
+
+        returns [(start byte, stop byte, first line number, reference)], with
+        neighbouring blocks merged; lines outside the window may come along.
+        """
+        hits = np.flatnonzero((self.max_times >= start_us) & (self.min_times < stop_us))
+        ranges = []
+        for block in hits:
+            if ranges and ranges[-1][1] == self.offsets[block]:
+                ranges[-1][1] = int(self.offsets[block + 1])
+            else:
+                ranges.append([int(self.offsets[block]), int(self.offsets[block + 1]),
+                               int(self.first_lines[block]), int(self.references[block])])
+        return [tuple(r) for r in ranges]
+
+
+def read_magnetometer_window(file_name, start_hour, stop_hour, mac=None):
+    """column dict (see MagnetometerLog) of the samples from start_hour up to stop_hour
+
+    hours are counted from midnight of the day the log starts (25 is 1 am the
+    next day), and so is the 'time' column, see MagnetometerLog.unwrap_times.
+    """
+    start_us, stop_us = start_hour * HOUR_US, stop_hour * HOUR_US
+    if CompressedLog.compression_of(file_name):
+        return stream_magnetometer_window(file_name, start_us, stop_us, mac)
+    chunks = []
+    with open(file_name, 'rb') as f:
+        for start, stop, _, reference in TimeIndex.load_or_build(file_name, 'magnetometer').ranges(start_us, stop_us):
+            f.seek(start)
+            columns = MagnetometerLog.parse_chunk(f.read(stop - start), mac)
+            columns['time'] = MagnetometerLog.unwrap_times(columns['time'], reference)
+            keep = (columns['time'] >= start_us) & (columns['time'] < stop_us)
+            chunks.append({name: values[keep] for name, values in columns.items()})
+    return MagnetometerLog.concatenate_columns(chunks)
+
+
+def stream_magnetometer_window(file_name, start_us, stop_us, mac=None):
+    """read_magnetometer_window without an index, every chunk is parsed but only the window is kept"""
+    chunks = []
+    reference = None
+    for columns in MagnetometerLog.iter_chunks(file_name):
+        # unwrapped over every pod, like the index does, before the other pods are dropped
+        columns['time'] = MagnetometerLog.unwrap_times(columns['time'], reference)
+        if len(columns['time']):
+            reference = int(columns['time'][-1])
+        keep = (columns['time'] >= start_us) & (columns['time'] < stop_us)
+        if mac is not None:
+            keep &= columns['mac'] == mac.encode()
+        chunks.append({name: values[keep] for name, values in columns.items()})
+    return MagnetometerLog.concatenate_columns(chunks)
+
+
+def read_card_window(file_name, start_hour, stop_hour, date=None):
+    """PumpCards of the cards from start_hour up to stop_hour (see read_magnetometer_window)"""
+    if CompressedLog.compression_of(file_name):
+        ranges = None  # read whole, there is no seeking in a compressed log
+    else:
+        index = TimeIndex.load_or_build(file_name, 'pumpcards')
+        ranges = index.ranges(start_hour * HOUR_US, stop_hour * HOUR_US)
+    cards = PumpCardLog.read_cards(file_name, date, ranges=ranges)
+    day = MagnetometerLog.to_datetime64(0, date)
+    keep = ((cards.times >= day + np.timedelta64(start_hour * HOUR_US, 'us'))
+            & (cards.times < day + np.timedelta64(stop_hour * HOUR_US, 'us')))
+    return PumpCardLog.PumpCards(cards.times[keep], cards.positions[keep], cards.loads[keep], cards.problems)